@@ -0,0 +1,19 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Benchmarks for reading, routing and delivering dicoms.
+
+They run against a corpus of synthetic files (see benchmarks.corpus), so
+they need nothing but this tree. To keep an eye on performance across
+commits:
+
+  python -m benchmarks run --output=before.json
+  (change things)
+  python -m benchmarks run --output=after.json
+  python -m benchmarks compare before.json after.json
+
+This isn't installed with yadda.
+"""
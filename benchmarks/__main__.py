@@ -0,0 +1,100 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Run the benchmarks, or compare two runs. Run this as python -m benchmarks.
+
+Usage:
+  benchmarks run [options] [<name>...]
+  benchmarks compare [--threshold=<ratio>] <old.json> <new.json>
+  benchmarks list
+
+Options:
+  --corpus=<dir>        Where to build (or find) the corpus. Default: a
+                        temporary directory, removed afterwards.
+  --scale=<factor>      Multiply the number of files in the corpus.
+                        [default: 1]
+  --repeat=<n>          Timed runs per benchmark. [default: 5]
+  --output=<file>       Write JSON results here instead of stdout.
+  --threshold=<ratio>   How much slower counts as a regression.
+                        [default: 1.1]
+  -v, --verbose         Say what's going on.
+  -h                    Show this help screen.
+
+<name> selects benchmarks whose names start with it, e.g. "read." or
+"pipeline.pooled".
+"""
+from __future__ import with_statement, division, print_function
+
+import sys
+import json
+import shutil
+import tempfile
+import logging
+
+import yadda
+from yadda.vendor.docopt import docopt
+
+from benchmarks import timing, suite
+from benchmarks.corpus import build_corpus
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    arguments = docopt(__doc__, version=yadda.__version__)
+    logging.basicConfig(level=logging.WARNING)
+    if arguments['--verbose']:
+        logging.getLogger('benchmarks').setLevel(logging.INFO)
+    if arguments['list']:
+        for name, fx in timing.BENCHMARKS:
+            print(name)
+        return 0
+    if arguments['compare']:
+        return compare(
+            arguments['<old.json>'], arguments['<new.json>'],
+            float(arguments['--threshold']))
+    return run(
+        arguments['<name>'], arguments['--corpus'],
+        float(arguments['--scale']), int(arguments['--repeat']),
+        arguments['--output'])
+
+
+def run(patterns, corpus_dir, scale, repeat, output):
+    remove = corpus_dir is None
+    if remove:
+        corpus_dir = tempfile.mkdtemp(prefix='yadda-bench-')
+    try:
+        logger.info('Building corpus in {0}'.format(corpus_dir))
+        corpus = build_corpus(corpus_dir, scale)
+        results = timing.run_all(corpus, patterns, repeat)
+    finally:
+        if remove:
+            shutil.rmtree(corpus_dir)
+    if output:
+        with open(output, 'w') as f:
+            timing.dump(results, f)
+    else:
+        timing.dump(results, sys.stdout)
+    return 0
+
+
+def compare(old_file, new_file, threshold):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    rows = timing.compare(old, new, threshold)
+    regressions = 0
+    for name, before, after, ratio, regressed in rows:
+        if regressed:
+            regressions += 1
+        print('{0:<32} {1:>12.6f} {2:>12.6f} {3:>7.2f}x{4}'.format(
+            name, before, after, ratio, '  SLOWER' if regressed else ''))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Synthetic DICOM corpora for benchmarks.
+
+Everything is built from scratch with dicom.filewriter, deterministically,
+so two runs (or two commits) see byte-for-byte the same files. There are
+five kinds of file:
+
+  ct          single-frame 512x512 CT, explicit VR little endian
+  mr          multi-frame MR (32 frames of 128x128), explicit VR
+  deep        nested sequences a few levels down, implicit VR
+  private     lots of private tags in two private blocks
+  deflated    like ct but smaller, deflated explicit VR little endian
+"""
+
+import os
+import zlib
+import logging
+from array import array
+
+from dicom.dataset import Dataset, FileDataset
+from dicom.sequence import Sequence
+from dicom.filebase import DicomFile, DicomBytesIO
+from dicom.filewriter import write_file, write_dataset, _write_file_meta_info
+from dicom import UID
+
+logger = logging.getLogger(__name__)
+
+UID_ROOT = '1.2.826.0.1.3680043.8.498.77'
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+ENHANCED_MR_STORAGE = '1.2.840.10008.5.1.4.1.1.4.1'
+SECONDARY_CAPTURE_STORAGE = '1.2.840.10008.5.1.4.1.1.7'
+
+# kind: (series, files per series)
+DEFAULT_COUNTS = {
+    'ct': (3, 20),
+    'mr': (2, 4),
+    'deep': (1, 10),
+    'private': (2, 10),
+    'deflated': (1, 10),
+}
+
+KINDS = ('ct', 'mr', 'deep', 'private', 'deflated')
+
+_pixel_cache = {}
+
+
+def pixels(count):
+    """ count 16-bit pixels in a repeatable, not-too-compressible pattern. """
+    if count not in _pixel_cache:
+        _pixel_cache[count] = array(
+            'H', ((i * 7919) % 4096 for i in xrange(count))).tostring()
+    return _pixel_cache[count]
+
+
+def make_uid(*parts):
+    return '.'.join([UID_ROOT] + [str(p) for p in parts])
+
+
+def base_dataset(kind, series, instance, sop_class):
+    ds = Dataset()
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = make_uid(KINDS.index(kind) + 1, series, instance)
+    ds.StudyDate = '20140102'
+    ds.StudyTime = '101500'
+    ds.Modality = 'MR' if kind == 'mr' else 'CT'
+    ds.PatientName = 'Bench^Mark'
+    ds.PatientID = 'BENCH{0:03d}'.format(KINDS.index(kind))
+    ds.StudyInstanceUID = make_uid(KINDS.index(kind) + 1)
+    ds.SeriesInstanceUID = make_uid(KINDS.index(kind) + 1, series)
+    ds.StudyID = '1'
+    ds.SeriesNumber = (KINDS.index(kind) + 1) * 100 + series
+    ds.InstanceNumber = instance + 1
+    ds.ImagePositionPatient = ['-158.135803', '-179.035797',
+                               str(-75.7 + instance)]
+    ds.ImageOrientationPatient = ['1', '0', '0', '0', '1', '0']
+    ds.SliceThickness = '1.25'
+    return ds
+
+
+def add_pixels(ds, rows, columns, frames=1):
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    if frames > 1:
+        ds.NumberOfFrames = frames
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.add_new(0x7fe00010, 'OW', pixels(rows * columns * frames))
+
+
+def build_ct(series, instance, rows=512, columns=512, kind='ct'):
+    ds = base_dataset(kind, series, instance, CT_IMAGE_STORAGE)
+    ds.RescaleIntercept = '-1024'
+    ds.RescaleSlope = '1'
+    ds.WindowCenter = '40'
+    ds.WindowWidth = '400'
+    add_pixels(ds, rows, columns)
+    return ds
+
+
+def build_mr(series, instance, frames=32):
+    ds = base_dataset('mr', series, instance, ENHANCED_MR_STORAGE)
+    ds.MagneticFieldStrength = '3'
+    per_frame = []
+    for frame in range(frames):
+        position = Dataset()
+        position.ImagePositionPatient = ['0', '0', str(frame * 1.25)]
+        group = Dataset()
+        group.PlanePositionSequence = Sequence([position])
+        per_frame.append(group)
+    ds.PerFrameFunctionalGroupsSequence = Sequence(per_frame)
+    add_pixels(ds, 128, 128, frames)
+    return ds
+
+
+def nested(depth, breadth):
+    item = Dataset()
+    item.CodeValue = 'D{0}'.format(depth)
+    item.CodingSchemeDesignator = 'DCM'
+    item.CodeMeaning = 'Depth {0}'.format(depth)
+    if depth > 1:
+        item.ContentSequence = Sequence(
+            [nested(depth - 1, breadth) for i in range(breadth)])
+    return item
+
+
+def build_deep(series, instance, depth=5, breadth=3):
+    ds = base_dataset('deep', series, instance, SECONDARY_CAPTURE_STORAGE)
+    ds.ContentSequence = Sequence([nested(depth, breadth)])
+    add_pixels(ds, 64, 64)
+    return ds
+
+
+def build_private(series, instance, per_block=40):
+    ds = base_dataset('private', series, instance, CT_IMAGE_STORAGE)
+    for block, creator in enumerate(('YADDA BENCH 1', 'YADDA BENCH 2')):
+        group = 0x0019 + 2 * block
+        ds.add_new((group, 0x0010), 'LO', creator)
+        for i in range(per_block):
+            element = 0x1000 + i
+            if i % 4 == 0:
+                ds.add_new((group, element), 'DS', str(i * 0.5))
+            elif i % 4 == 1:
+                ds.add_new((group, element), 'US', i)
+            elif i % 4 == 2:
+                ds.add_new((group, element), 'OB', b'\x01\x02' * (i + 1))
+            else:
+                ds.add_new((group, element), 'LO', 'private {0}'.format(i))
+    add_pixels(ds, 128, 128)
+    return ds
+
+
+def file_dataset(filename, ds, transfer_syntax):
+    meta = Dataset()
+    meta.MediaStorageSOPClassUID = ds.SOPClassUID
+    meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    meta.TransferSyntaxUID = transfer_syntax
+    meta.ImplementationClassUID = make_uid(0)
+    fds = FileDataset(filename, ds, file_meta=meta, preamble=b'\0' * 128)
+    fds.is_implicit_VR = transfer_syntax == UID.ImplicitVRLittleEndian
+    fds.is_little_endian = True
+    return fds
+
+
+def write_deflated(filename, ds):
+    """
+    filewriter can't deflate, so do it by hand: the dataset goes through
+    write_dataset() as explicit VR little endian, then raw deflate (PS3.5
+    A.5), after an ordinary file meta header.
+    """
+    body = DicomBytesIO()
+    body.is_little_endian = True
+    body.is_implicit_VR = False
+    write_dataset(body, ds)
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(body.parent.getvalue())
+    deflated += compressor.flush()
+    fds = file_dataset(filename, ds, UID.DeflatedExplicitVRLittleEndian)
+    fp = DicomFile(filename, 'wb')
+    try:
+        fp.write(fds.preamble)
+        _write_file_meta_info(fp, fds.file_meta)
+        fp.write(deflated)
+    finally:
+        fp.close()
+
+
+def build_file(kind, series, instance, filename):
+    if kind == 'ct':
+        ds, syntax = build_ct(series, instance), UID.ExplicitVRLittleEndian
+    elif kind == 'mr':
+        ds, syntax = build_mr(series, instance), UID.ExplicitVRLittleEndian
+    elif kind == 'deep':
+        ds, syntax = build_deep(series, instance), UID.ImplicitVRLittleEndian
+    elif kind == 'private':
+        ds, syntax = build_private(series, instance), \
+            UID.ExplicitVRLittleEndian
+    elif kind == 'deflated':
+        write_deflated(
+            filename, build_ct(series, instance, 256, 256, 'deflated'))
+        return
+    else:
+        raise ValueError("Unknown kind of file: {0}".format(kind))
+    write_file(filename, file_dataset(filename, ds, syntax))
+
+
+class Corpus(object):
+    """
+    A directory of synthetic dicoms: files[kind] lists each kind's files.
+    """
+
+    def __init__(self, directory, files):
+        self.directory = directory
+        self.files = files
+
+    def all_files(self):
+        return [f for kind in KINDS for f in self.files.get(kind, [])]
+
+    def __len__(self):
+        return len(self.all_files())
+
+
+def build_corpus(directory, scale=1.0, kinds=KINDS):
+    """
+    Write a corpus into directory (reusing files that are already there)
+    and return it. scale multiplies the number of files per series.
+    """
+    files = {}
+    for kind in kinds:
+        series_count, per_series = DEFAULT_COUNTS[kind]
+        per_series = max(1, int(round(per_series * scale)))
+        kind_dir = os.path.join(directory, kind)
+        if not os.path.isdir(kind_dir):
+            os.makedirs(kind_dir)
+        files[kind] = []
+        for series in range(series_count):
+            for instance in range(per_series):
+                filename = os.path.join(
+                    kind_dir, '{0}-{1:04d}.dcm'.format(series, instance))
+                if not os.path.exists(filename):
+                    build_file(kind, series, instance, filename)
+                files[kind].append(filename)
+        logger.debug('{0}: {1} files'.format(kind, len(files[kind])))
+    return Corpus(directory, files)
@@ -0,0 +1,304 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+The benchmarks: reading, Dataset access, writing, a whole
+read -> route -> handle run through yadda's managers, and startup time.
+"""
+
+import os
+import sys
+import logging
+import threading
+import subprocess
+
+from dicom.filereader import read_file
+from dicom.filewriter import write_file
+from dicom.datadict import tag_for_name, mask_match
+from dicom.dataset import Dataset
+
+from yadda import handlers, managers
+from yadda.readers import read_routing_header
+from yadda.ingest import ingest
+
+from benchmarks.timing import benchmark
+
+logger = logging.getLogger(__name__)
+
+ROUTING_KEYS = ('StudyDate', 'StudyID', 'SeriesNumber')
+
+ATTRIBUTES = (
+    'PatientName', 'StudyDate', 'SeriesNumber', 'InstanceNumber',
+    'Rows', 'Columns', 'ImagePositionPatient', 'SliceThickness',
+    'SOPInstanceUID', 'Modality')
+
+
+def reader(kind, **kwargs):
+    def setup(corpus):
+        filenames = corpus.files[kind]
+
+        def run():
+            for filename in filenames:
+                read_file(filename, **kwargs)
+        return run, len(filenames)
+    return setup
+
+
+for kind in ('ct', 'mr', 'deep', 'private', 'deflated'):
+    benchmark('read.full.' + kind)(reader(kind))
+
+benchmark('read.stop_before_pixels.ct')(reader('ct', stop_before_pixels=True))
+benchmark('read.defer.mr')(reader('mr', defer_size=1024))
+benchmark('read.memory_map.mr')(reader('mr', memory_map=True))
+
+
+@benchmark('read.routing_header.ct')
+def routing_header(corpus):
+    filenames = corpus.files['ct']
+
+    def run():
+        for filename in filenames:
+            read_routing_header(filename, ROUTING_KEYS)
+    return run, len(filenames)
+
+
+@benchmark('read.convert_all.private')
+def convert_all(corpus):
+    # Reading leaves raw elements; this also converts every one of them
+    filenames = corpus.files['private']
+
+    def run():
+        for filename in filenames:
+            for data_element in read_file(filename):
+                pass
+    return run, len(filenames)
+
+
+@benchmark('dataset.attributes.ct')
+def attributes(corpus):
+    datasets = [read_file(f, stop_before_pixels=True)
+                for f in corpus.files['ct']]
+    rounds = 50
+
+    def run():
+        for i in range(rounds):
+            for ds in datasets:
+                for name in ATTRIBUTES:
+                    getattr(ds, name)
+    return run, rounds * len(datasets) * len(ATTRIBUTES)
+
+
+@benchmark('dataset.contains.ct')
+def contains(corpus):
+    datasets = [read_file(f, stop_before_pixels=True)
+                for f in corpus.files['ct']]
+    tags = [tag_for_name(name) for name in ATTRIBUTES]
+    rounds = 50
+
+    def run():
+        for i in range(rounds):
+            for ds in datasets:
+                for name in ATTRIBUTES:
+                    name in ds
+                for tag in tags:
+                    tag in ds
+    return run, rounds * len(datasets) * len(ATTRIBUTES) * 2
+
+
+@benchmark('dataset.missing.ct')
+def missing(corpus):
+    # hasattr() on names that aren't DICOM keywords at all
+    datasets = [read_file(f, stop_before_pixels=True)
+                for f in corpus.files['ct']]
+    names = ['handler_key', 'series_uid', 'ReferencedThing', 'CPIndex']
+    rounds = 50
+
+    def run():
+        for i in range(rounds):
+            for ds in datasets:
+                for name in names:
+                    hasattr(ds, name)
+    return run, rounds * len(datasets) * len(names)
+
+
+@benchmark('datadict.tag_for_name')
+def keyword_lookup(corpus):
+    names = ATTRIBUTES + ('NotAKeyword', 'RefdImageSequence')
+    rounds = 5000
+
+    def run():
+        for i in range(rounds):
+            for name in names:
+                tag_for_name(name)
+    return run, rounds * len(names)
+
+
+@benchmark('datadict.mask_match')
+def repeaters(corpus):
+    # Overlay, curve and private tags: repeating groups and misses
+    tags = [0x60000010, 0x60020011, 0x50000005, 0x10000013, 0x00280842,
+            0x00091001, 0x00291010, 0x00431027]
+    rounds = 5000
+
+    def run():
+        for i in range(rounds):
+            for tag in tags:
+                mask_match(tag)
+    return run, rounds * len(tags)
+
+
+@benchmark('dataset.walk.deep')
+def walk(corpus):
+    datasets = [read_file(f) for f in corpus.files['deep']]
+
+    def visit(ds, data_element):
+        pass
+
+    def run():
+        for ds in datasets:
+            ds.walk(visit)
+    return run, len(datasets)
+
+
+def writer(kind):
+    def setup(corpus):
+        datasets = [read_file(f) for f in corpus.files[kind]]
+        out_dir = os.path.join(corpus.directory, 'written')
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        out_name = os.path.join(out_dir, kind + '.dcm')
+
+        def run():
+            for ds in datasets:
+                write_file(out_name, ds)
+        return run, len(datasets)
+    return setup
+
+benchmark('write.ct')(writer('ct'))
+benchmark('write.deep')(writer('deep'))
+
+
+class BenchManagerMixin(object):
+    routing_keys = ROUTING_KEYS
+
+    def handler_key(self, dcm):
+        return '{0}-{1}-{2}'.format(
+            dcm.StudyDate, dcm.StudyID, dcm.SeriesNumber)
+
+
+class BenchThreadedManager(BenchManagerMixin, managers.ThreadedDicomManager):
+    def build_handler(self, dcm, filename):
+        return BenchThreadedHandler(self, self.handler_key(dcm), self.timeout)
+
+
+class BenchThreadedHandler(handlers.ThreadedDicomHandler):
+    def on_handle(self, dcm, filename):
+        pass
+
+
+class BenchPooledManager(BenchManagerMixin, managers.PooledDicomManager):
+    def build_handler(self, dcm, filename):
+        return BenchPooledHandler(self, self.handler_key(dcm), self.timeout)
+
+
+class BenchPooledHandler(handlers.PooledDicomHandler):
+    def on_handle(self, dcm, filename):
+        pass
+
+
+def pipeline(manager_class):
+    def setup(corpus):
+        filenames = corpus.all_files()
+
+        def run():
+            manager = manager_class(timeout=60)
+            for filename in filenames:
+                manager.handle_file(filename)
+            manager.stop()
+        return run, len(filenames)
+    return setup
+
+benchmark('pipeline.threaded')(pipeline(BenchThreadedManager))
+benchmark('pipeline.pooled')(pipeline(BenchPooledManager))
+
+
+def contention(producers, series=64, per_producer=2000):
+    # Many threads feeding one manager at once; compare against
+    #   manager.contention.1 for what the extra threads cost
+    def setup(corpus):
+        datasets = []
+        for number in range(series):
+            ds = Dataset()
+            ds.StudyDate = '20140101'
+            ds.StudyID = '1'
+            ds.SeriesNumber = number
+            datasets.append(ds)
+
+        def feed(manager, offset):
+            for i in range(per_producer):
+                manager.handle_dicom(
+                    datasets[(offset + i) % series], 'contention')
+
+        def run():
+            manager = BenchThreadedManager(timeout=60)
+            threads = [threading.Thread(target=feed, args=(manager, i))
+                       for i in range(producers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            manager.stop()
+        return run, producers * per_producer
+    return setup
+
+benchmark('manager.contention.1')(contention(1))
+benchmark('manager.contention.16')(contention(16))
+
+
+
+class RoutingOnlyManager(BenchManagerMixin, managers.ThreadedDicomManager):
+    def handle_dicom(self, dcm, filename):
+        self.handler_key(dcm)
+
+
+def ingester(processes):
+    def setup(corpus):
+        filenames = corpus.all_files()
+
+        def run():
+            ingest(RoutingOnlyManager(timeout=60), filenames, processes,
+                   progress=None)
+        return run, len(filenames)
+    return setup
+
+benchmark('ingest.inline')(ingester(1))
+benchmark('ingest.parallel')(ingester(None))
+
+
+# Modules that are slow to import and only needed by some callers; importing
+#   dicom or yadda's managers mustn't pull them in
+DEFERRED_MODULES = ('numpy', 'inspect', 'ctypes', 'dicom._private_dict')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importer(module):
+    # Each op is a fresh interpreter; compare against import.baseline
+    check = ("import sys{0}\n"
+             "loaded = [m for m in {1!r} if m in sys.modules]\n"
+             "sys.exit('imported too early: %s' % loaded if loaded else 0)\n")
+    code = check.format(', ' + module if module else '', DEFERRED_MODULES)
+    rounds = 5
+
+    def setup(corpus):
+        def run():
+            for i in range(rounds):
+                subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+        return run, rounds
+    return setup
+
+benchmark('import.baseline')(importer(None))
+benchmark('import.dicom')(importer('dicom'))
+benchmark('import.yadda.managers')(importer('yadda.managers'))
@@ -0,0 +1,125 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+The benchmark registry, the timer, and the JSON results.
+
+A benchmark is a function that takes a Corpus, does any setup, and returns
+(run, ops): run() is what gets timed, and ops is how many things (files,
+attribute lookups...) one run() does, so per_op numbers compare across
+corpus sizes. Register it with @benchmark('some.name').
+"""
+
+import os
+import sys
+import time
+import json
+import platform
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+timer = time.time
+if sys.platform.startswith('win'):
+    timer = time.clock
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(fx):
+        BENCHMARKS.append((name, fx))
+        return fx
+    return register
+
+
+def selected(patterns=None):
+    """ Registered benchmarks whose names start with any of patterns. """
+    if not patterns:
+        return list(BENCHMARKS)
+    return [(name, fx) for name, fx in BENCHMARKS
+            if any(name.startswith(p) for p in patterns)]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_benchmark(fx, corpus, repeat=5):
+    run, ops = fx(corpus)
+    run()  # warm up
+    runs = []
+    for i in range(repeat):
+        started = timer()
+        run()
+        runs.append(timer() - started)
+    best = min(runs)
+    return {
+        'runs': runs,
+        'min': best,
+        'median': median(runs),
+        'ops': ops,
+        'per_op': best / ops if ops else best,
+    }
+
+
+def git_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=here,
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(corpus, patterns=None, repeat=5):
+    """ Run the selected benchmarks; returns a JSON-ready dict. """
+    results = {}
+    for name, fx in selected(patterns):
+        logger.info('Running {0}'.format(name))
+        results[name] = time_benchmark(fx, corpus, repeat)
+        logger.info('{0}: {1:.6f}s per op'.format(
+            name, results[name]['per_op']))
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'files': len(corpus),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def dump(results, fp):
+    json.dump(results, fp, indent=2, sort_keys=True)
+    fp.write('\n')
+
+
+def compare(old, new, threshold=1.1):
+    """
+    Compare two run_all() results by min per_op time. Returns a list of
+    (name, old per_op, new per_op, ratio, regressed), where regressed means
+    new is more than threshold times slower.
+    """
+    rows = []
+    old_results = old['results']
+    for name in sorted(new['results']):
+        if name not in old_results:
+            continue
+        before = old_results[name]['per_op']
+        after = new['results'][name]['per_op']
+        ratio = after / before if before else float('inf')
+        rows.append((name, before, after, ratio, ratio > threshold))
+    return rows
@@ -11,12 +11,15 @@
 import sys
 import logging
 logger = logging.getLogger("pydicom")
-from dicom.tag import Tag
+from dicom.tag import Tag, BaseTag
 from dicom._dicom_dict import DicomDictionary  # the actual dict of {tag: (VR, VM, name, is_retired, keyword), ...}
 from dicom._dicom_dict import RepeatersDictionary # those with tags like "(50xx, 0005)"
-from dicom._private_dict import private_dictionaries
 import warnings
 from dicom import in_py3
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
 
 # Generate mask dict for checking repeating groups etc.
 # Map a true bitwise mask to the DICOM mask with "x"'s in it.
@@ -37,11 +40,35 @@ shortNames = [("BeamLimitingDevice", "BLD"),
               ("Referenced", "Refd")
              ]
 
+# Index the masks by which bits they care about: for each distinct mask2,
+#   {tag & mask2: mask_x}. There are only a handful of mask2's (e.g. the
+#   "50xx" style groups all share one), so a lookup is a few dict gets.
+#   Most specific (fewest "x"s) first, in case masks overlap.
+mask_index = {}
+for mask_x, (mask1, mask2) in masks.items():
+    mask_index.setdefault(mask2, {})[mask1 & mask2] = mask_x
+mask_index = sorted(mask_index.items(), key=lambda item: -bin(item[0]).count("1"))
+
+# Tags already resolved by mask_match (including misses, as None).
+#   Emptied when it reaches max_matched_tags
+matched_tags = {}
+max_matched_tags = 4096
+
 def mask_match(tag):
-    for mask_x, (mask1, mask2) in masks.items():
-        if (tag ^ mask1) & mask2 == 0:
-            return mask_x
-    return None
+    tag = int(tag)
+    try:
+        return matched_tags[tag]
+    except KeyError:
+        pass
+    mask_x = None
+    for mask2, index in mask_index:
+        mask_x = index.get(tag & mask2)
+        if mask_x is not None:
+            break
+    if len(matched_tags) >= max_matched_tags:
+        matched_tags.clear()
+    matched_tags[tag] = mask_x
+    return mask_x
 
 def get_entry(tag):
     """Return the tuple (VR, VM, name, is_retired, keyword) from the DICOM dictionary
@@ -97,6 +124,10 @@ def keyword_for_tag(tag):
     Will return GroupLength for group length tags,
     and returns empty string ("") if the tag doesn't exist in the dictionary.
     """
+    try:
+        return VR_keyword_dict[tag][1]
+    except (KeyError, TypeError):  # not a plain tag, or a repeater
+        pass
     try:
         return dictionary_keyword(tag)
     except KeyError:
@@ -136,10 +167,58 @@ def CleanName(tag):
                 s = s[:-2]+"ies"
     return s
 
+class _LazyDict(MutableMapping):
+    """A dict that build() makes the first time it's used"""
+    def __init__(self, build):
+        self._build = build
+        self._dict = None
+
+    def built(self):
+        if self._dict is None:
+            self._dict = self._build()
+        return self._dict
+
+    def __getitem__(self, key):
+        return self.built()[key]
+
+    def __setitem__(self, key, value):
+        self.built()[key] = value
+
+    def __delitem__(self, key):
+        del self.built()[key]
+
+    def __contains__(self, key):
+        return key in self.built()
+
+    def __iter__(self):
+        return iter(self.built())
+
+    def __len__(self):
+        return len(self.built())
+
 # Provide for the 'reverse' lookup. Given clean name, what is the tag?
-logger.debug("Reversing DICOM dictionary so can look up tag from a name...")
-NameDict = dict([(CleanName(tag), tag) for tag in DicomDictionary])
-keyword_dict = dict([(dictionary_keyword(tag), tag) for tag in DicomDictionary])
+# Only needed for old style names, and slow to build, so done on first use
+def _build_name_dict():
+    logger.debug("Reversing DICOM dictionary so can look up tag from a name...")
+    return dict([(CleanName(tag), tag) for tag in DicomDictionary])
+
+NameDict = _LazyDict(_build_name_dict)
+
+def name_dict():
+    """Return NameDict's underlying dict, building it if need be"""
+    return NameDict.built()
+
+# Lookup tables for the hot paths (Dataset attribute access), built once.
+# Tags are stored as BaseTag so callers needn't call Tag() on them again
+keyword_dict = dict([(entry[4], BaseTag(tag))
+                     for tag, entry in DicomDictionary.items()])
+VR_keyword_dict = dict([(BaseTag(tag), (entry[0], entry[4]))
+                        for tag, entry in DicomDictionary.items()])
+
+# Names tag_for_name() found no tag for, so misses (hasattr() etc.) are
+# cheap too. Emptied when it reaches max_unknown_names
+unknown_names = set()
+max_unknown_names = 4096
 
 def short_name(name):
     """Return a short *named tag* for the corresponding long version.
@@ -164,13 +243,29 @@ def long_name(name):
             return name.replace(shortname, longname)
     return ""
 
+def tag_for_keyword(name):
+    """Return the tag for a DICOM keyword (or its short form), or None.
+
+    Unlike tag_for_name, old style pydicom names are not recognized.
+    """
+    tag = keyword_dict.get(name)
+    if tag is None:
+        longname = long_name(name)
+        if longname:
+            tag = keyword_dict.get(longname)
+    return tag
+
 def tag_for_name(name):
     """Return the dicom tag corresponding to name, or None if none exist."""
-    if name in keyword_dict: # the usual case
-        return keyword_dict[name]
+    tag = keyword_dict.get(name)
+    if tag is not None: # the usual case
+        return tag
+    if name in unknown_names:
+        return None
     # If not an official keyword, check the old style pydicom names
-    if name in NameDict:
-        tag = NameDict[name]
+    names = name_dict()
+    if name in names:
+        tag = names[name]
         msg = ("'%s' as tag name has been deprecated; use official DICOM keyword '%s'"
                 % (name, dictionary_keyword(tag)))
         warnings.warn(msg, DeprecationWarning)
@@ -179,8 +274,12 @@ def tag_for_name(name):
     # check if is short-form of a valid name
     longname = long_name(name)
     if longname:
-        return NameDict.get(longname, None)
-    return None
+        tag = names.get(longname, None)
+    if tag is None:
+        if len(unknown_names) >= max_unknown_names:
+            unknown_names.clear()
+        unknown_names.add(name)
+    return tag
 
 def all_names_for_tag(tag):
     """Return a list of all (long and short) names for the tag"""
@@ -194,28 +293,45 @@ def all_names_for_tag(tag):
 
 # PRIVATE DICTIONARY handling
 # functions in analogy with those of main DICOM dict
-def get_private_entry(tag, private_creator):
-    """Return the tuple (VR, VM, name, is_retired) from a private dictionary"""
-    tag = Tag(tag)
+# The private dictionaries (dicom._private_dict) are big and rarely needed,
+#   so they are only imported on the first private lookup. Each private
+#   creator's entries are then indexed by (group, low byte of element)
+#   the first time that creator is looked up.
+def _import_private_dictionaries():
+    from dicom._private_dict import private_dictionaries
+    return private_dictionaries
+
+private_dictionaries = _LazyDict(_import_private_dictionaries)
+private_dictionary_index = {}
+
+def private_index(private_creator):
+    """Return {(group, element & 0xFF): entry} for a private creator"""
     try:
-        private_dict = private_dictionaries[private_creator]
+        return private_dictionary_index[private_creator]
+    except KeyError:
+        pass
+    try:
+        private_dict = private_dictionaries.built()[private_creator]
     except KeyError:
         raise KeyError("Private creator {0} not in private dictionary".format(private_creator))
-
     # private elements are usually agnostic for "block" (see PS3.5-2008 7.8.1 p44)
-    # Some elements in _private_dict are explicit; most have "xx" for high-byte of element
-    # Try exact key first, but then try with "xx" in block position
+    # so most keys have "xx" for high-byte of element, e.g. "0029xx10"
+    index = {}
+    for key, entry in private_dict.items():
+        if key[4:6] == "xx" and "x" not in key[:4] + key[6:]:
+            index[int(key[:4], 16), int(key[6:], 16)] = entry
+    private_dictionary_index[private_creator] = index
+    return index
+
+def get_private_entry(tag, private_creator):
+    """Return the tuple (VR, VM, name, is_retired) from a private dictionary"""
+    tag = Tag(tag)
+    index = private_index(private_creator)
     try:
-        dict_entry = private_dict[tag]
+        return index[tag.group, tag.elem & 0xFF]
     except KeyError:
-        #     so here put in the "xx" in the block position for key to look up
-        group_str = "%04x" % tag.group
-        elem_str = "%04x" % tag.elem
-        key = "%sxx%s" % (group_str, elem_str[-2:])
-        if key not in private_dict:
-            raise KeyError("Tag {0} not in private dictionary for private creator {1}".format(key, private_creator))
-        dict_entry = private_dict[key]
-    return dict_entry
+        key = "%04xxx%02x" % (tag.group, tag.elem & 0xFF)
+        raise KeyError("Tag {0} not in private dictionary for private creator {1}".format(key, private_creator))
 
 def private_dictionary_description(tag, private_creator):
     """Return the descriptive text for the given dicom tag."""
@@ -91,6 +91,12 @@ class DataElement(object):
     descripWidth = 35
     maxBytesToDisplay = 16
     showVR = 1
+
+    # No per-instance __dict__: a dataset can hold thousands of these.
+    # private_creator is only set (by Dataset) for private tags.
+    __slots__ = ('tag', 'VR', '_value', 'file_tell', 'is_undefined_length',
+                 'private_creator')
+
     def __init__(self, tag, VR, value, file_value_tell=None,
                         is_undefined_length=False):
         """Create a data element instance.
@@ -262,6 +268,18 @@ class DataElement(object):
         else:
             return str(self)
 
+    # __slots__ classes need these to be pickled with protocols 0 and 1
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))  # subclasses may have one
+        for name in DataElement.__slots__:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
 
 class DeferredDataElement(DataElement):
     """Subclass of DataElement where value is not read into memory until needed"""
@@ -310,9 +328,8 @@ RawDataElement = namedtuple('RawDataElement',
                   'tag VR length value value_tell is_implicit_VR is_little_endian')
 
 
-def DataElement_from_raw(raw_data_element):
-    """Return a DataElement from a RawDataElement"""
-    from dicom.values import convert_value # XXX buried here to avoid circular import filereader->Dataset->convert_value->filereader (for SQ parsing)
+def raw_VR(raw_data_element):
+    """Return the VR for a RawDataElement, looking it up if was implicit VR"""
     raw = raw_data_element
     VR = raw.VR
     if VR is None: # Can be if was implicit VR
@@ -325,6 +342,14 @@ def DataElement_from_raw(raw_data_element):
                 VR = 'UL'
             else:
                 raise KeyError("Unknown DICOM tag {0:s} - can't look up VR".format(str(raw.tag)))
+    return VR
+
+
+def DataElement_from_raw(raw_data_element):
+    """Return a DataElement from a RawDataElement"""
+    from dicom.values import convert_value # XXX buried here to avoid circular import filereader->Dataset->convert_value->filereader (for SQ parsing)
+    raw = raw_data_element
+    VR = raw_VR(raw)
     try:
         value = convert_value(VR, raw)
     except NotImplementedError as e:
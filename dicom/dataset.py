@@ -23,12 +23,12 @@ from sys import byteorder
 sys_is_little_endian = (byteorder == 'little')
 import logging
 logger = logging.getLogger('pydicom')
-import inspect  # for __dir__
 
 from dicom.datadict import DicomDictionary, dictionaryVR
 from dicom.datadict import tag_for_name, all_names_for_tag
+from dicom.datadict import tag_for_keyword, keyword_for_tag, VR_keyword_dict
 from dicom.tag import Tag, BaseTag
-from dicom.dataelem import DataElement, DataElement_from_raw, RawDataElement
+from dicom.dataelem import DataElement, DataElement_from_raw, RawDataElement, raw_VR
 from dicom.UID import NotCompressedPixelTransferSyntaxes
 import os.path
 
@@ -37,11 +37,14 @@ import dicom.charset
 import warnings
 
 
-have_numpy = True
-
+# numpy is only needed for pixel_array and is slow to import, so it is
+#   imported on first use. have_numpy just says whether it can be found
+numpy = None
 try:
-    import numpy
-except:
+    import imp
+    imp.find_module('numpy')
+    have_numpy = True
+except ImportError:
     have_numpy = False
 
 stat_available = True
@@ -73,9 +76,24 @@ class Dataset(dict):
 
     :attribute indent_chars: for string display, the characters used to indent
        nested Data Elements (e.g. sequence items). Default is three spaces.
+    :attribute deprecated_names: if True, also accept the old style
+       (pydicom < 0.9.7) names, e.g. ds.PatientsName, with a
+       DeprecationWarning. Default is False: only DICOM keywords are used,
+       which keeps attribute lookups on the fast path. Setting an old style
+       name while it's False raises AttributeError, rather than quietly
+       setting a python attribute in place of the data element.
 
     """
     indent_chars = "   "
+    deprecated_names = False
+
+    def _tag_for_name(self, name):
+        """Return the tag for a DICOM keyword (or old style name, if
+        deprecated_names is set), or None."""
+        tag = tag_for_keyword(name)
+        if tag is None and self.deprecated_names:
+            tag = tag_for_name(name)
+        return tag
 
     def add(self, data_element):
         """Equivalent to dataset[data_element.tag] = data_element."""
@@ -94,7 +112,7 @@ class Dataset(dict):
         :returns: a DataElement instance in this dataset with the given name
                 if the tag for that name is not found, returns None
         """
-        tag = tag_for_name(name)
+        tag = self._tag_for_name(name)
         if tag:
             return self[tag]
         return None
@@ -105,8 +123,10 @@ class Dataset(dict):
         This is called for code like: ``if 'SliceLocation' in dataset``.
 
         """
+        if isinstance(name, BaseTag):
+            return dict.__contains__(self, name)
         if isinstance(name, (str, unicode)):
-            tag = tag_for_name(name)
+            tag = self._tag_for_name(name)
         else:
             try:
                 tag = Tag(name)
@@ -145,7 +165,7 @@ class Dataset(dict):
 
         """
         # First check if is a valid DICOM name and if we have that data element
-        tag = tag_for_name(name)
+        tag = self._tag_for_name(name)
         if tag and tag in self:
             del self[tag]
         # If not a DICOM name in this dataset, check for regular instance name
@@ -162,6 +182,7 @@ class Dataset(dict):
         List of attributes is used, for example, in auto-completion in editors
            or command-line environments.
         """
+        import inspect  # only needed here; slow to import
         meths = set(zip(*inspect.getmembers(Dataset, inspect.isroutine))[0])
         props = set(zip(
                     *inspect.getmembers(Dataset, inspect.isdatadescriptor))[0])
@@ -225,16 +246,18 @@ class Dataset(dict):
         """
         # __getattr__ only called if instance cannot find name in self.__dict__
         # So, if name is not a dicom string, then is an error
-        tag = tag_for_name(name)
+        tag = self._tag_for_name(name)
         if tag is None:
             raise AttributeError("Dataset does not have attribute "
                                     "'{0:s}'.".format(name))
-        tag = Tag(tag)
-        if tag not in self:
+        try:
+            data_element = dict.__getitem__(self, tag)
+        except KeyError:
             raise AttributeError("Dataset does not have attribute "
                                     "'{0:s}'.".format(name))
-        else:  # do have that dicom data_element
-            return self[tag].value
+        if not isinstance(data_element, DataElement):  # still raw
+            data_element = self[tag]
+        return data_element.value
 
     def __getitem__(self, key):
         """Operator for dataset[key] request."""
@@ -283,6 +306,22 @@ class Dataset(dict):
         for tag in taglist:
             yield self[tag]
 
+    def iterraw(self):
+        """Iterate through the dataset in tag order without converting values.
+
+        Yields (tag, VR, length) for each data element. length is the value
+        length as read from the file (0xFFFFFFFFL for undefined length), or
+        None if the element wasn't read from a file or has been converted
+        already. Elements stay unconverted, so this is cheap for large
+        collections of headers.
+        """
+        for tag in sorted(self.keys()):
+            data_element = dict.__getitem__(self, tag)
+            if isinstance(data_element, tuple):
+                yield tag, raw_VR(data_element), data_element.length
+            else:
+                yield tag, data_element.VR, None
+
     def _pixel_data_numpy(self):
         """Return a NumPy array of the pixel data.
 
@@ -295,9 +334,13 @@ class Dataset(dict):
         if not 'PixelData' in self:
             raise TypeError("No pixel data found in this dataset.")
 
-        if not have_numpy:
-            msg = "The Numpy package is required to use pixel_array, and numpy could not be imported.\n"
-            raise ImportError(msg)
+        global numpy
+        if numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                msg = "The Numpy package is required to use pixel_array, and numpy could not be imported.\n"
+                raise ImportError(msg)
 
         # determine the type used for the array
         need_byteswap = (self.is_little_endian != sys_is_little_endian)
@@ -316,11 +359,17 @@ class Dataset(dict):
                             numpy_format, self.PixelRepresentation, self.BitsAllocated))
 
         # Have correct Numpy format, so create the NumPy array
-        arr = numpy.fromstring(self.PixelData, numpy_format)
+        if isinstance(self.PixelData, memoryview):
+            # Memory-mapped (see read_file): look at the pixels where they are
+            arr = numpy.frombuffer(self.PixelData, numpy_format)
+            if need_byteswap:
+                arr = arr.byteswap()
+        else:
+            arr = numpy.fromstring(self.PixelData, numpy_format)
 
-        # XXX byte swap - may later handle this in read_file!!?
-        if need_byteswap:
-            arr.byteswap(True)  # True means swap in-place, don't make a new copy
+            # XXX byte swap - may later handle this in read_file!!?
+            if need_byteswap:
+                arr.byteswap(True)  # True means swap in-place, don't make a new copy
         # Note the following reshape operations return a new *view* onto arr, but don't copy the data
         if 'NumberOfFrames' in self and self.NumberOfFrames > 1:
             if self.SamplesPerPixel > 1:
@@ -443,10 +492,10 @@ class Dataset(dict):
         Else, set an instance (python) attribute as any other class would do.
 
         """
-        tag = tag_for_name(name)
+        tag = self._tag_for_name(name)
         if tag is not None:  # successfully mapped name to a tag
             if tag not in self:  # don't have this tag yet->create the data_element instance
-                VR = dictionaryVR(tag)
+                VR = VR_keyword_dict[tag][0]
                 data_element = DataElement(tag, VR, value)
             else:  # already have this data_element, just changing its value
                 data_element = self[tag]
@@ -455,8 +504,22 @@ class Dataset(dict):
             self[tag] = data_element
         else:  # name not in dicom dictionary - setting a non-dicom instance attribute
             # XXX note if user mis-spells a dicom data_element - no error!!!
+            if name[:1].isupper():
+                self._refuse_old_name(name)
             self.__dict__[name] = value
 
+    def _refuse_old_name(self, name):
+        """Raise AttributeError if name is an old style name. Only called
+        for capitalized names: python attributes here are lowercase, and
+        checking builds the old style name dict."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            tag = tag_for_name(name)
+        if tag is not None:
+            msg = ("'%s' is an old style name; use the DICOM keyword '%s' "
+                   "or set deprecated_names" % (name, keyword_for_tag(tag)))
+            raise AttributeError(msg)
+
     def __setitem__(self, key, value):
         """Operator for dataset[key]=value. Check consistency, and deal with private tags"""
         if not isinstance(value, (DataElement, RawDataElement)): # ok if is subclass, e.g. DeferredDataElement
@@ -17,7 +17,7 @@ def ListBeams(plan_dataset):
         name="Beam name", num="Number", gantry="Gantry", ssd="SSD (cm)")]
     for beam in plan_dataset.BeamSequence:
         cp0 = beam.ControlPointSequence[0]
-        SSD = float(cp0.SourcetoSurfaceDistance / 10)
+        SSD = float(cp0.SourceToSurfaceDistance / 10)
         lines.append("{b.BeamName:^13s} {b.BeamNumber:8d} "
                     "{gantry:8.1f} {ssd:8.1f}".format(b=beam,
                                         gantry=cp0.GantryAngle, ssd=SSD))
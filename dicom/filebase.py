@@ -10,6 +10,7 @@ from dicom.tag import Tag
 from struct import unpack, pack
 
 from io import BytesIO
+import mmap
 import logging
 logger = logging.getLogger('pydicom')
 
@@ -135,6 +136,72 @@ class DicomFileLike(DicomIO):
         """Used for file-like objects where no write is available"""
         raise IOError("This DicomFileLike object has no write() method")
 
+class DicomMMapFile(DicomIO):
+    """Read-only DicomIO over a memory-mapped file.
+
+    read() returns bytes, like any DicomIO. read_view() returns a memoryview
+    slice of the mapping instead, so large values are never copied.
+    Views stay valid after close(); the file is unmapped when the last
+    of them is gone. The mapping is copy-on-write, so writes into a view
+    never reach the file.
+    """
+    def __init__(self, filename, mode='rb'):
+        if mode.strip('b') != 'r':
+            raise ValueError("DicomMMapFile is read-only, can't open with mode %r" % mode)
+        DicomIO.__init__(self)
+        self.name = filename
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            except ValueError:  # can't map an empty file
+                self._map = b''
+        try:
+            self._view = memoryview(self._map)
+        except TypeError:
+            # python 2's mmap only has the old buffer interface; a ctypes
+            # array over it has the new one (and keeps the map alive)
+            import ctypes  # only needed here; slow to import
+            self._view = memoryview((ctypes.c_char * len(self._map)).from_buffer(self._map))
+        self._size = len(self._map)
+        self._pos = 0
+    def read(self, length=None, need_exact_length=False):
+        """Read like a file does: short reads at the end are not an error,
+        unless need_exact_length is True"""
+        start = self._pos
+        if length is None:
+            self._pos = self._size
+        else:
+            self._pos = min(start + length, self._size)
+            if need_exact_length and self._pos - start < length:
+                msg = "Unexpected end of file. "
+                msg += "Read {0} bytes of {1} expected starting at position 0x{2:x}".format(self._pos - start, length, start)
+                raise EOFError(msg)
+        return self._map[start:self._pos]
+    def read_view(self, length):
+        """Like read(), but return a memoryview instead of copying"""
+        start = self._pos
+        self._pos = min(start + length, self._size)
+        return self._view[start:self._pos]
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        if offset < 0:
+            raise IOError("Negative seek position %d" % offset)
+        self._pos = offset
+    def tell(self):
+        return self._pos
+    def write(self, bytes_written):
+        raise IOError("DicomMMapFile objects are read-only")
+    def close(self):
+        # Just drop our references -- values read with read_view() may
+        # still be using the mapping
+        self._map = b''
+        self._view = memoryview(b'')
+        self._size = 0
+        self._pos = 0
+
 def DicomFile(*args, **kwargs):
     return DicomFileLike(open(*args, **kwargs))
 
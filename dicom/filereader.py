@@ -11,7 +11,7 @@ import warnings
 import zlib
 from io import BytesIO
 import logging
-from dicom.tag import TupleTag
+from dicom.tag import TupleTag, BaseTag
 from dicom.dataelem import RawDataElement
 from dicom.util.hexutil import bytes2hex
 from dicom.valuerep import extra_length_VRs
@@ -30,7 +30,7 @@ from os import SEEK_CUR
 
 import dicom.UID # for Implicit/Explicit/Little/Big Endian transfer syntax UIDs
 from dicom.filebase import DicomFile, DicomFileLike
-from dicom.filebase import DicomIO, DicomBytesIO
+from dicom.filebase import DicomIO, DicomBytesIO, DicomMMapFile
 from dicom.dataset import Dataset, FileDataset
 from dicom.datadict import dictionaryVR
 from dicom.dataelem import DataElement, DeferredDataElement
@@ -43,6 +43,13 @@ from struct import Struct, unpack
 from sys import byteorder
 sys_is_little_endian = (byteorder == 'little')
 
+# Values of these VRs are read as memoryviews when the file object can
+# hand them out without copying (see DicomMMapFile)
+bulk_VRs = ('OB', 'OW', 'OF', 'UN', 'OB or OW', 'OW or OB', 'OB/OW', 'OW/OB')
+
+# How much explicit_VR_little_endian_generator reads from the file at once
+bulk_read_size = 65536
+
 
 class InvalidDicomError(Exception):
     """Exception that is raised when the the file does not seem
@@ -177,6 +184,7 @@ def data_element_generator(fp, is_implicit_VR, is_little_endian,
     logger_debug = logger.debug
     debugging = dicom.debugging
     element_struct_unpack = element_struct.unpack
+    read_view = getattr(fp, 'read_view', None)
 
     while True:
         # Read tag, VR, length, get ready to read value
@@ -232,13 +240,28 @@ def data_element_generator(fp, is_implicit_VR, is_little_endian,
                             "Skipping forward to next data element.")
                 fp.seek(fp_tell()+length)
             else:
-                value = fp_read(length)
+                if read_view is not None:
+                    bulk_VR = VR
+                    if bulk_VR is None:
+                        try:
+                            bulk_VR = dictionaryVR(tag)
+                        except KeyError:
+                            pass
+                    if bulk_VR in bulk_VRs:
+                        value = read_view(length)
+                    else:
+                        value = fp_read(length)
+                else:
+                    value = fp_read(length)
                 if debugging:
                     dotdot = "   "
                     if length > 12:
                         dotdot = "..."
+                    start = value[:12]
+                    if isinstance(start, memoryview):
+                        start = start.tobytes()
                     logger_debug("%08x: %-34s %s %r %s" % (value_tell,
-                           bytes2hex(value[:12]), dotdot, value[:12], dotdot))
+                           bytes2hex(start), dotdot, start, dotdot))
             yield RawDataElement(tag, VR, length, value, value_tell,
                                      is_implicit_VR, is_little_endian)
 
@@ -273,8 +296,104 @@ def data_element_generator(fp, is_implicit_VR, is_little_endian,
                                 is_implicit_VR, is_little_endian)
 
 
+def explicit_VR_little_endian_generator(fp, stop_when=None, defer_size=None):
+    """Like data_element_generator for Explicit VR Little Endian, but faster
+
+    Reads the file bulk_read_size bytes at a time and parses the buffer with
+    Struct.unpack_from, instead of making several fp.read() calls per
+    element. Values too big for the buffer are read straight from the file.
+    Yields exactly what data_element_generator would.
+
+    While it runs, fp is positioned somewhere ahead of the element just
+    yielded, so don't use this where the caller watches fp.tell() between
+    elements. When the generator finishes or is closed, fp is put back
+    where data_element_generator would have left it.
+    """
+    element_unpack_from = Struct("<HH2sH").unpack_from
+    extra_length_unpack_from = Struct("<L").unpack_from
+    fp_read = fp.read
+    fp_seek = fp.seek
+    read_view = getattr(fp, 'read_view', None)
+
+    buf_start = fp.tell()  # file position of buf[0]
+    buf = b""
+    pos = 0  # next element starts at buf[pos]
+    try:
+        while True:
+            # Header is 8 bytes, 12 for the extra length VRs
+            if len(buf) - pos < 12:
+                buf_start += pos
+                buf = buf[pos:] + fp_read(bulk_read_size)
+                pos = 0
+                if len(buf) < 8:
+                    pos = len(buf)  # at end of file
+                    return
+            group, elem, VR, length = element_unpack_from(buf, pos)
+            if in_py3:
+                VR = VR.decode(default_encoding)
+            if VR in extra_length_VRs:
+                length = extra_length_unpack_from(buf, pos + 8)[0]
+                value_start = pos + 12
+            else:
+                value_start = pos + 8
+            value_tell = buf_start + value_start
+            tag = BaseTag(group << 16 | elem)
+            if stop_when is not None and stop_when(tag, VR, length):
+                return
+
+            if length != 0xFFFFFFFFL:
+                value_end = value_start + length
+                deferred = defer_size is not None and length > defer_size
+                as_view = read_view is not None and VR in bulk_VRs
+                if value_end <= len(buf):
+                    if deferred:
+                        value = None
+                    elif as_view:
+                        fp_seek(value_tell)
+                        value = read_view(length)
+                        fp_seek(buf_start + len(buf))
+                    else:
+                        value = buf[value_start:value_end]
+                    pos = value_end
+                else:
+                    # Runs past the buffer; start a new one after the value
+                    if deferred:
+                        value = None
+                        fp_seek(value_tell + length)
+                    else:
+                        fp_seek(value_tell)
+                        if as_view:
+                            value = read_view(length)
+                        else:
+                            value = fp_read(length)
+                    buf_start = fp.tell()
+                    buf = b""
+                    pos = 0
+                yield RawDataElement(tag, VR, length, value, value_tell,
+                                     False, True)
+            else:
+                # Undefined length: let the usual code find the end of it
+                fp_seek(value_tell)
+                buf_start = value_tell
+                buf = b""
+                pos = 0
+                if VR == 'SQ':
+                    seq = read_sequence(fp, False, True, length)
+                    element = DataElement(tag, VR, seq, value_tell,
+                                          is_undefined_length=True)
+                else:
+                    value = read_undefined_length_value(fp, True,
+                                            SequenceDelimiterTag, defer_size)
+                    element = RawDataElement(tag, VR, length, value,
+                                             value_tell, False, True)
+                buf_start = fp.tell()
+                yield element
+    finally:
+        fp_seek(buf_start + pos)
+
+
 def read_dataset(fp, is_implicit_VR, is_little_endian, bytelength=None,
-                    stop_when=None, defer_size=None):
+                    stop_when=None, defer_size=None, bulk=False):
     """Return a Dataset instance containing the next dataset in the file.
     :param fp: an opened file object
     :param is_implicit_VR: True if file transfer syntax is implicit VR
@@ -285,12 +404,19 @@ def read_dataset(fp, is_implicit_VR, is_little_endian, bytelength=None,
     See help for data_element_generator for details
     :param defer_size: optional size to avoid loading large elements in memory.
     See help for data_element_generator for details
+    :param bulk: True to use explicit_VR_little_endian_generator if the
+    transfer syntax allows. Only for reads with no bytelength.
     :returns: a Dataset instance
     """
     raw_data_elements = dict()
     fpStart = fp.tell()
-    de_gen = data_element_generator(fp, is_implicit_VR, is_little_endian,
-                                    stop_when, defer_size)
+    if (bulk and bytelength is None and not is_implicit_VR
+                and is_little_endian and not dicom.debugging):
+        de_gen = explicit_VR_little_endian_generator(fp, stop_when,
+                                                     defer_size)
+    else:
+        de_gen = data_element_generator(fp, is_implicit_VR, is_little_endian,
+                                        stop_when, defer_size)
     try:
         while (bytelength is None) or (fp.tell()-fpStart < bytelength):
             raw_data_element = next(de_gen)
@@ -308,6 +434,8 @@ def read_dataset(fp, is_implicit_VR, is_little_endian, bytelength=None,
                     getattr(fp, "name", "<no filename>"))
     except NotImplementedError as details:
         logger.error(details)
+    finally:
+        de_gen.close()  # puts fp back in place if we read ahead
 
     return Dataset(raw_data_elements)
 
@@ -533,14 +661,16 @@ def read_partial(fileobj, stop_when=None, defer_size=None, force=False):
 
     try:
         dataset = read_dataset(fileobj, is_implicit_VR, is_little_endian,
-                            stop_when=stop_when, defer_size=defer_size)
+                            stop_when=stop_when, defer_size=defer_size,
+                            bulk=True)
     except EOFError as e:
         pass  # error already logged in read_dataset
     return FileDataset(fileobj, dataset, preamble, file_meta_dataset,
                                 is_implicit_VR, is_little_endian)
 
 
-def read_file(fp, defer_size=None, stop_before_pixels=False, force=False):
+def read_file(fp, defer_size=None, stop_before_pixels=False, force=False,
+                                                    memory_map=False):
     """Read and parse a DICOM file
 
     :param fp: either a file-like object, or a string containing the file name.
@@ -556,6 +686,11 @@ def read_file(fp, defer_size=None, stop_before_pixels=False, force=False):
     :param force: Set to True to force reading even if no header is found.
                   If False, a dicom.filereader.InvalidDicomError is raised 
                     when the file is not valid DICOM.
+    :param memory_map: Set True to memory-map the file (only if fp is a
+                  file name). Values of OB, OW, OF and UN elements are then
+                  memoryviews into the mapping instead of copies, which
+                  saves memory for big pixel data. Use .tobytes() on them
+                  where you need a real byte string.
     :returns: a FileDataset instance
     """
     # Open file if not already a file object
@@ -564,7 +699,10 @@ def read_file(fp, defer_size=None, stop_before_pixels=False, force=False):
         # caller provided a file name; we own the file handle
         caller_owns_file = False
         logger.debug("Reading file '{0}'".format(fp))
-        fp = open(fp, 'rb')
+        if memory_map:
+            fp = DicomMMapFile(fp, 'rb')
+        else:
+            fp = open(fp, 'rb')
 
     if dicom.debugging:
         logger.debug("\n"+"-"*80)
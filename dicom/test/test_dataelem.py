@@ -8,6 +8,7 @@
 # Many tests of DataElement class are implied in test_dataset also
 
 import unittest
+import pickle
 from dicom.dataelem import DataElement
 from dicom.dataelem import RawDataElement, DataElement_from_raw
 from dicom.tag import Tag
@@ -50,6 +51,23 @@ class DataElementTests(unittest.TestCase):
         self.assertTrue(isinstance(ds.TransferSyntaxUID, UID),
                                 "+= to UID did not keep as UID class")
 
+    def testSlots(self):
+        """DataElement: has no instance __dict__ or unset private_creator..."""
+        self.assertFalse(hasattr(self.data_elementSH, '__dict__'))
+        self.assertFalse(hasattr(self.data_elementSH, 'private_creator'))
+        self.assertRaises(AttributeError, setattr, self.data_elementSH,
+                                                        'not_a_slot', 1)
+
+    def testPickle(self):
+        """DataElement: pickles and unpickles with all protocols............"""
+        self.data_elementSH.private_creator = 'creator'
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            elem = pickle.loads(pickle.dumps(self.data_elementSH, protocol))
+            self.assertEqual(elem.tag, self.data_elementSH.tag)
+            self.assertEqual(elem.VR, 'SH')
+            self.assertEqual(elem.value, 'hello')
+            self.assertEqual(elem.private_creator, 'creator')
+
 
 class RawDataElementTests(unittest.TestCase):
     def setUp(self):
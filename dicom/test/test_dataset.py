@@ -176,6 +176,59 @@ class DatasetTests(unittest.TestCase):
                         "and ds[tag]:\nBy get():%r\nBy ds[tag]:%r\n")
         self.assertEqual(by_get, by_item, msg % (by_get, by_item))
 
+    def testIterRaw(self):
+        """Dataset: iterraw() gives tag, VR, length without converting......"""
+        raw_name = RawDataElement(Tag(0x100010), 'PN', 4, 'test',
+                                                                0, True, True)
+        raw_id = RawDataElement(Tag(0x100020), None, 6, 'ident1',
+                                                                0, True, True)
+        ds = Dataset({raw_id.tag: raw_id, raw_name.tag: raw_name})
+        ds.add_new(0x80020, 'DA', '20140101')
+        self.assertEqual(list(ds.iterraw()), [(0x80020, 'DA', None),
+                                              (0x100010, 'PN', 4),
+                                              (0x100020, 'LO', 6)])
+        self.assertTrue(dict.__getitem__(ds, raw_id.tag) is raw_id)
+        self.assertTrue(dict.__getitem__(ds, raw_name.tag) is raw_name)
+
+    def testDeprecatedNames(self):
+        """Dataset: old style names only used if deprecated_names is set...."""
+        import warnings
+        ds = Dataset()
+        ds.PatientName = 'CITIZEN^Jan'
+        self.assertRaises(AttributeError, getattr, ds, 'PatientsName')
+        self.assertFalse('PatientsName' in ds)
+        ds.deprecated_names = True
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.assertEqual(ds.PatientsName, 'CITIZEN^Jan')
+            self.assertTrue('PatientsName' in ds)
+
+    def testSetDeprecatedName(self):
+        """Dataset: setting an old style name raises unless allowed........."""
+        import warnings
+        ds = Dataset()
+        ds.PatientName = 'CITIZEN^Jan'
+        self.assertRaises(AttributeError, setattr, ds, 'PatientsName', 'X')
+        self.assertEqual(ds.PatientName, 'CITIZEN^Jan')
+        self.assertFalse('PatientsName' in ds.__dict__)
+        ds.NotADicomName = 1
+        self.assertEqual(ds.NotADicomName, 1)
+        ds.deprecated_names = True
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            ds.PatientsName = 'X'
+        self.assertEqual(ds.PatientName, 'X')
+
+    def testContainsTag(self):
+        """Dataset: 'in' works for Tags, ints, tuples and keywords.........."""
+        ds = Dataset()
+        ds.PatientName = 'CITIZEN^Jan'
+        self.assertTrue(Tag(0x100010) in ds)
+        self.assertTrue(0x100010 in ds)
+        self.assertTrue((0x10, 0x10) in ds)
+        self.assertTrue('PatientName' in ds)
+        self.assertFalse(Tag(0x100020) in ds)
+
     def test__setitem__(self):
         """Dataset: if set an item, it must be a DataElement instance......."""
         def callSet():
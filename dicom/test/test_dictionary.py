@@ -5,9 +5,18 @@
 #    See the file license.txt included with this distribution, also
 #    available at http://pydicom.googlecode.com
 
+import os
+import sys
+import subprocess
 import unittest
 from dicom.tag import Tag
 from dicom.datadict import DicomDictionary, CleanName, all_names_for_tag, dictionary_description
+from dicom.datadict import tag_for_name, tag_for_keyword, keyword_for_tag
+from dicom.datadict import mask_match, get_private_entry
+import dicom.datadict
+
+package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+                                        os.path.abspath(__file__))))
 
 
 class DictTests(unittest.TestCase):
@@ -34,6 +43,46 @@ class DictTests(unittest.TestCase):
         self.assertEqual(dictionary_description(0x280400), 'Transform Label')
         self.assertEqual(dictionary_description(0x280410), 'Rows For Nth Order Coefficients')
 
+    def testMaskMatch(self):
+        """dicom_dictionary: mask_match finds each kind of repeater........."""
+        for tag, mask_x in [(0x60020010, '60xx0010'), (0x50000005, '50xx0005'),
+                            (0x10000013, '1000xxx3'), (0x00280842, '002808x2'),
+                            (0x10100123, '1010xxxx'), (0x002031ff, '002031xx')]:
+            self.assertEqual(mask_match(Tag(tag)), mask_x)
+            self.assertEqual(mask_match(tag), mask_x)  # cached
+        self.assertEqual(mask_match(0x00099999), None)
+        self.assertEqual(mask_match(0x00099999), None)
+
+    def testTagForKeyword(self):
+        """dicom_dictionary: tag_for_keyword ignores old style names........"""
+        self.assertEqual(tag_for_keyword('PatientName'), 0x00100010)
+        self.assertEqual(tag_for_keyword('BLDAngle'), 0x300A0120)
+        self.assertEqual(tag_for_keyword('PatientsName'), None)
+        self.assertEqual(tag_for_keyword('NotAKeyword'), None)
+
+    def testUnknownNames(self):
+        """dicom_dictionary: tag_for_name remembers names it can't find....."""
+        self.assertEqual(tag_for_name('NotAKeyword'), None)
+        self.assertTrue('NotAKeyword' in dicom.datadict.unknown_names)
+        self.assertEqual(tag_for_name('NotAKeyword'), None)
+        self.assertFalse('PatientName' in dicom.datadict.unknown_names)
+
+    def testKeywordForTag(self):
+        """dicom_dictionary: keyword_for_tag for plain and repeater tags...."""
+        self.assertEqual(keyword_for_tag(0x00100010), 'PatientName')
+        self.assertEqual(keyword_for_tag((0x0010, 0x0010)), 'PatientName')
+        self.assertEqual(keyword_for_tag(0x60000010), 'OverlayRows')
+        self.assertEqual(keyword_for_tag(0x99991111), '')
+
+    def testNameDictStillAMapping(self):
+        """dicom_dictionary: NameDict looks up old style names on first use."""
+        code = ("import sys, dicom.datadict as d; "
+                "built = d.NameDict._dict is not None; "
+                "found = d.NameDict['PatientsName'] == 0x00100010; "
+                "sys.exit(built or not found or 'Nope' in d.NameDict)")
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=package_root), 0)
+
 
 class PrivateDictTests(unittest.TestCase):
     def testPrivate1(self):
@@ -41,6 +90,33 @@ class PrivateDictTests(unittest.TestCase):
         self.assertTrue(CleanName(0x00100010) == "PatientsName")
         self.assertTrue(CleanName(Tag((0x0010, 0x0010))) == "PatientsName")
 
+    def testPrivateEntry(self):
+        """private dict: entries are found for any private block..........."""
+        expected = ('SL', '1', 'Upper range of Pixels1', '')
+        for tag in (0x00291016, 0x00291116, 0x0029ff16):
+            self.assertEqual(get_private_entry(tag, 'GEMS_IMPS_01'), expected)
+        self.assertRaises(KeyError, get_private_entry, 0x00291099,
+                          'GEMS_IMPS_01')
+        self.assertRaises(KeyError, get_private_entry, 0x00291000,
+                          'Not a private creator')
+
+    def testPrivateLoadedLazily(self):
+        """private dict: not imported until a private lookup is made......."""
+        code = ("import sys, dicom, dicom.filereader; "
+                "sys.exit('dicom._private_dict' in sys.modules)")
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=package_root), 0)
+
+    def testPrivateDictionariesStillAMapping(self):
+        """private dict: private_dictionaries imports on first use.........."""
+        code = ("import sys, dicom.datadict as d; "
+                "imported = 'dicom._private_dict' in sys.modules; "
+                "found = 'GEMS_IMPS_01' in d.private_dictionaries; "
+                "sys.exit(imported or not found or "
+                "'dicom._private_dict' not in sys.modules)")
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=package_root), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
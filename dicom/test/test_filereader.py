@@ -27,6 +27,8 @@ try:
 except:
     have_numpy = False
 from dicom.filereader import read_file, data_element_generator, InvalidDicomError
+import dicom.filereader
+from dicom.filereader import explicit_VR_little_endian_generator, read_preamble, _read_file_meta_info
 from dicom.values import convert_value
 from dicom.tag import Tag
 from dicom.sequence import Sequence
@@ -386,6 +388,118 @@ class FileLikeTests(unittest.TestCase):
         file_like.close()
 
 
+class BulkReadTests(unittest.TestCase):
+    """Test explicit_VR_little_endian_generator against data_element_generator"""
+    def setUp(self):
+        self.saved_read_size = dicom.filereader.bulk_read_size
+
+    def tearDown(self):
+        dicom.filereader.bulk_read_size = self.saved_read_size
+
+    def elements(self, filename, bulk, stop_when=None, defer_size=None):
+        fp = open(filename, 'rb')
+        read_preamble(fp, False)
+        _read_file_meta_info(fp)
+        if bulk:
+            gen = explicit_VR_little_endian_generator(fp, stop_when, defer_size)
+        else:
+            gen = data_element_generator(fp, False, True, stop_when, defer_size)
+        elements = list(gen)
+        end = fp.tell()
+        fp.close()
+        return elements, end
+
+    def assertSameStream(self, filename, **kwargs):
+        expected, expected_end = self.elements(filename, False, **kwargs)
+        got, got_end = self.elements(filename, True, **kwargs)
+        self.assertEqual(len(expected), len(got))
+        for want, have in zip(expected, got):
+            if isinstance(want, tuple):  # a RawDataElement
+                self.assertEqual(want, have)
+            else:  # undefined length sequence, parsed already
+                self.assertEqual((want.tag, want.VR, len(want.value), want.file_tell),
+                                 (have.tag, have.VR, len(have.value), have.file_tell))
+        self.assertEqual(expected_end, got_end)
+
+    def testSameElements(self):
+        """bulk read: same elements as data_element_generator......"""
+        for read_size in (65536, 100, 13, 12):
+            dicom.filereader.bulk_read_size = read_size
+            for filename in (ct_name, rtplan_name, rtdose_name, jpeg_lossy_name):
+                self.assertSameStream(filename)
+
+    def testStopWhen(self):
+        """bulk read: stop_when leaves file at the element.........."""
+        def at_rows(tag, VR, length):
+            return tag == 0x00280010
+        for read_size in (65536, 13):
+            dicom.filereader.bulk_read_size = read_size
+            self.assertSameStream(ct_name, stop_when=at_rows)
+
+    def testDeferSize(self):
+        """bulk read: defer_size skips big values..................."""
+        for read_size in (65536, 13):
+            dicom.filereader.bulk_read_size = read_size
+            self.assertSameStream(ct_name, defer_size=100)
+
+    def testReadFileUsesBulk(self):
+        """bulk read: read_file gives the same dataset.............."""
+        dicom.filereader.bulk_read_size = 13
+        ct = read_file(ct_name)
+        self.assertEqual(ct.Rows, 128)
+        self.assertEqual(len(ct.PixelData), 128 * 128 * 2)
+        self.assertEqual(ct.ImagePositionPatient,
+                         [Decimal('-158.135803'), Decimal('-179.035797'), Decimal('-75.699997')])
+
+
+class MemoryMapTests(unittest.TestCase):
+    """Test reading with memory_map=True"""
+    def assertSameValues(self, filename):
+        ds_norm = read_file(filename)
+        ds_mmap = read_file(filename, memory_map=True)
+        self.assertEqual(ds_norm.fileobj_type, file)
+        for data_elem in ds_norm:
+            tag = data_elem.tag
+            self.assertEqual(data_elem.value, ds_mmap[tag].value, "Mismatched value for tag %r" % tag)
+
+    def testValuesIdenticalExplicitVR(self):
+        """memory map: values match normal read (explicit VR)......"""
+        self.assertSameValues(ct_name)
+        self.assertSameValues(rtplan_name)
+
+    def testValuesIdenticalImplicitVR(self):
+        """memory map: values match normal read (implicit VR)......"""
+        self.assertSameValues(mr_name)
+        self.assertSameValues(priv_SQ_name)
+
+    def testPixelDataIsView(self):
+        """memory map: PixelData is a memoryview, outlives the file.."""
+        ct = read_file(ct_name, memory_map=True)
+        self.assertTrue(isinstance(ct.PixelData, memoryview))
+        self.assertEqual(len(ct.PixelData), 128 * 128 * 2)
+        self.assertTrue(isinstance(ct.PatientName, str))
+        expected = read_file(ct_name).PixelData
+        self.assertEqual(ct.PixelData.tobytes(), expected)
+
+    def testDeferredRead(self):
+        """memory map: deferred values are read through the map......"""
+        ds = read_file(ct_name, defer_size=2000, memory_map=True)
+        self.assertEqual(ds.PixelData.tobytes(), read_file(ct_name).PixelData)
+
+    def testStopBeforePixels(self):
+        """memory map: stop_before_pixels works......................"""
+        ct = read_file(ct_name, stop_before_pixels=True, memory_map=True)
+        self.assertFalse('PixelData' in ct)
+
+    def testPixelArray(self):
+        """memory map: pixel_array matches normal read..............."""
+        if not have_numpy:
+            return
+        expected = read_file(ct_name).pixel_array
+        got = read_file(ct_name, memory_map=True).pixel_array
+        self.assertTrue((expected == got).all())
+
+
 if __name__ == "__main__":
     # This is called if run alone, but not if loaded through run_tests.py
     # If not run from the directory where the sample images are, then need to switch there
@@ -21,7 +21,7 @@ if __name__ == "__main__":
     for name in names:
         ds = dicom.read_file(name)
         ds.decode()
-        files_info.append((name, ds.SpecificCharacterSet, ds.PatientsName))
+        files_info.append((name, ds.SpecificCharacterSet, ds.PatientName))
 
     # Show the information
     format = "%-16s %-40s %s"
@@ -14,6 +14,9 @@ Options:
   --dest-dir <dir>   Base directory on host to put files
   --user <user>      FTP username [default: anonymous]
   --password <pw>    FTP password
+  --connections <n>  Most FTP sessions to have open at once [default: 4]
+  --parallel <n>     Most batches to upload at once in one series
+                     [default: 2]
   --timeout <sec>    Timeout (in seconds) to wait for more files in a series
                      [default: 30]
   --verbose, -v      Show lots of debugging.
@@ -27,15 +30,14 @@ import os
 import logging
 logger = logging.getLogger(__name__)
 
-from ftplib import FTP
-
 import yadda
 from yadda import handlers, managers
+from yadda.ftp import FTPConnectionPool
+from yadda.transports import FTPTransport, Delivery
 
 from yadda.vendor.docopt import docopt
 from yadda.vendor.schema import Schema, Use, SchemaError
 from yadda.vendor import pyinotify
-import dicom
 
 
 class UseDefault(object):
@@ -56,6 +58,8 @@ SCHEMA = Schema({
     '<source_dir>': Use(os.path.expanduser),
     '<port>': UseDefault(int, 21),
     '--timeout': Use(float),
+    '--connections': Use(int),
+    '--parallel': Use(int),
     str: object})
 
 
@@ -75,11 +79,14 @@ def main():
         port=validated['<port>'],
         ftp_user=validated['--user'],
         ftp_pw=validated['--password'],
-        initial_dir=validated.get('--dest-dir'))
+        initial_dir=validated.get('--dest-dir'),
+        connections=validated['--connections'],
+        parallel=validated['--parallel'])
 
 
 def dicom_ftp(
-        source_dir, timeout, host, port, ftp_user, ftp_pw, initial_dir):
+        source_dir, timeout, host, port, ftp_user, ftp_pw, initial_dir,
+        connections, parallel):
     wm = pyinotify.WatchManager()
     watch_mask = (
         pyinotify.IN_MOVED_TO |
@@ -91,7 +98,9 @@ def dicom_ftp(
         port=port,
         ftp_user=ftp_user,
         ftp_pw=ftp_pw,
-        initial_dir=initial_dir)
+        initial_dir=initial_dir,
+        connections=connections,
+        parallel=parallel)
     fch = FileChangeHandler(dicom_manager=dicom_manager)
     notifier = pyinotify.ThreadedNotifier(wm, fch)
     wm.add_watch(source_dir, watch_mask, rec=True, auto_add=True)
@@ -125,26 +134,26 @@ class FileChangeHandler(pyinotify.ProcessEvent):
 
 
 class FTPDicomManager(managers.ThreadedDicomManager):
-    def __init__(self, timeout, host, port, ftp_user, ftp_pw, initial_dir):
+    routing_keys = ('StudyDate', 'StudyID', 'SeriesNumber')
+
+    def __init__(
+            self, timeout, host, port, ftp_user, ftp_pw, initial_dir,
+            connections=4, parallel=2):
         super(FTPDicomManager, self).__init__(timeout)
-        self.host = host
-        self.port = port
-        self.ftp_user = ftp_user
-        self.ftp_pw = ftp_pw
-        self.initial_dir = initial_dir
+        ftp_pool = FTPConnectionPool(
+            host=host,
+            port=port,
+            user=ftp_user,
+            password=ftp_pw,
+            base_dir=initial_dir,
+            max_connections=connections)
+        self.delivery = Delivery(
+            FTPTransport(ftp_pool), workers=connections, pipeline=parallel)
 
     def handler_key(self, dcm):
         return '{0}-{1}-{2}'.format(
             dcm.StudyDate, dcm.StudyID, dcm.SeriesNumber)
 
-    def handle_file(self, filename):
-        try:
-            dcm = dicom.read_file(filename)
-        except dicom.filereader.InvalidDicomError:
-            logger.warn('Not a dicom: {0}'.format(filename))
-            return
-        self.handle_dicom(dcm, filename)
-
     def build_handler(self, dcm, filename):
         logger.debug(
             'Building a handler from {0}'.format(filename))
@@ -152,55 +161,23 @@ class FTPDicomManager(managers.ThreadedDicomManager):
             manager=self,
             name=self.handler_key(dcm),
             timeout=self.timeout,
-            host=self.host,
-            port=self.port,
-            ftp_user=self.ftp_user,
-            ftp_pw=self.ftp_pw,
-            initial_dir=self.initial_dir)
+            delivery=self.delivery)
 
+    def stop(self):
+        super(FTPDicomManager, self).stop()
+        self.delivery.stop()
 
-class FTPDicomHandler(handlers.ThreadedDicomHandler):
-    def __init__(
-            self, manager, name, timeout,
-            host, port, ftp_user, ftp_pw, initial_dir):
-        self.host = host
-        self.port = port
-        self.ftp_user = ftp_user
-        self.ftp_pw = ftp_pw
-        self.initial_dir = initial_dir
-        self.ftp = FTP()
-        super(FTPDicomHandler, self).__init__(manager, name, timeout)
 
+class FTPDicomHandler(handlers.DeliveringDicomHandler):
     def on_start(self):
-        logger.debug('{0}: Connecting to {1}:{2}'.format(
-            self, self.host, self.port))
-        self.ftp.connect(self.host, self.port)
-        logger.debug('{0}: Connected.')
-        logger.debug('{0}: Logging in as {1}:{2}'.format(
-            self, self.ftp_user, self.ftp_pw))
-        self.ftp.login(self.ftp_user, self.ftp_pw)
-        logger.debug('{0}: Logged in.')
-        if self.initial_dir is not None:
-            logger.debug('{0}: cwd to {1}'.format(self, self.initial_dir))
-            self.ftp.cwd(self.initial_dir)
-        dir_name = '.'+str(self)
-        logger.debug('{0}: Creating directory {1}'.format(self, dir_name))
-        self.ftp.mkd(dir_name)
-        self.ftp.cwd(dir_name)
-        logger.info('{0}: Ready to upload')
-
-    def on_handle(self, dcm, filename):
-        base_filename = os.path.basename(filename)
-        logger.debug('{0}: Uploading {1}'.format(self, filename))
-        cmd = 'STOR ' + base_filename
-        with open(filename, 'r') as f:
-            self.ftp.storbinary(cmd, f)
+        logger.info('{0}: Creating directory .{0}'.format(self))
+        super(FTPDicomHandler, self).on_start()
+        logger.info('{0}: Ready to upload'.format(self))
 
     def on_finish(self):
         logger.info('{0}: Renaming directory'.format(self))
-        self.ftp.cwd('..')
-        self.ftp.rename('.'+str(self), str(self))
-        self.ftp.quit()
+        super(FTPDicomHandler, self).on_finish()
+        logger.info('{0}: {1}'.format(self, self.series.stats.snapshot()))
 
     def terminate(self):
         logger.warn('{0}: Forcing quit!'.format(self))
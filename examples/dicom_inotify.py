@@ -9,6 +9,8 @@ Usage:
 Options:
   --timeout=<sec>  Timeout (in seconds) to wait for more files in a series
                    [default: 30]
+  --shards=<n>     Spread parsing and handling over n processes. Defaults
+                   to 1; 0 means one per CPU. [default: 1]
   -h               Show this help screen.
 
 """
@@ -21,15 +23,18 @@ logger = logging.getLogger(__name__)
 
 import yadda
 from yadda import handlers, managers
+from yadda.dedup import Deduplicator
+from yadda.watcher import FileWatcher
+from yadda.sharding import ShardedDicomManager
 
 from yadda.vendor.docopt import docopt
 from yadda.vendor.schema import Schema, Use
 from yadda.vendor import pyinotify
-import dicom
 
 SCHEMA = Schema({
     '<source_dir>': Use(os.path.expanduser),
     '--timeout': Use(float),
+    '--shards': Use(int),
     str: object})
 
 
@@ -43,19 +48,28 @@ def main():
     logger.debug("Using log level {0}".format(log_level))
     return dicom_inotify(
         validated['<source_dir>'],
-        validated['--timeout'])
+        validated['--timeout'],
+        validated['--shards'])
 
 
-def dicom_inotify(source_dir, timeout):
-    wm = pyinotify.WatchManager()
-    watch_mask = (
-        pyinotify.IN_MOVED_TO |
-        pyinotify.IN_CLOSE_WRITE |
-        pyinotify.IN_CREATE)
+def build_manager(timeout):
     dicom_manager = MyDicomManager(timeout)
-    fch = FileChangeHandler(dicom_manager=dicom_manager)
-    notifier = pyinotify.ThreadedNotifier(wm, fch)
-    wm.add_watch(source_dir, watch_mask, rec=True, auto_add=True)
+    # Senders resend files; only handle them once
+    dicom_manager.dedup = Deduplicator()
+    return dicom_manager
+
+
+def dicom_inotify(source_dir, timeout, shards=1):
+    wm = pyinotify.WatchManager()
+    if shards == 1:
+        dicom_manager = build_manager(timeout)
+    else:
+        dicom_manager = ShardedDicomManager(
+            lambda: build_manager(timeout), shards or None)
+        dicom_manager.start()
+    watcher = FileWatcher(callback=dicom_manager.handle_file)
+    notifier = pyinotify.ThreadedNotifier(wm, watcher)
+    watcher.watch(wm, source_dir)
     logger.info('Watching {0}'.format(source_dir))
     try:
         notifier.start()
@@ -63,36 +77,17 @@ def dicom_inotify(source_dir, timeout):
     except KeyboardInterrupt:
         logger.debug("Keyboard Interrupt!")
         notifier.stop()
+        watcher.stop()
         dicom_manager.stop()
 
 
-class FileChangeHandler(pyinotify.ProcessEvent):
-
-    def my_init(self, dicom_manager):
-        self.dicom_manager = dicom_manager
-
-    def process_event(self, event):
-        logger.debug('Processing {0}'.format(event.pathname))
-        self.dicom_manager.handle_file(event.pathname)
-
-    process_IN_MOVED_TO = process_event
-    process_IN_CLOSE_WRITE = process_event
-    process_IN_CREATE = process_event
-
-
 class MyDicomManager(managers.ThreadedDicomManager):
 
+    routing_keys = ('SeriesNumber',)
+
     def handler_key(self, dcm):
         return str(dcm.SeriesNumber)
 
-    def handle_file(self, filename):
-        try:
-            dcm = dicom.read_file(filename)
-        except dicom.filereader.InvalidDicomError:
-            logger.warn('Not a dicom: {0}'.format(filename))
-            return
-        self.handle_dicom(dcm, filename)
-
     def build_handler(self, dcm, filename):
         logger.debug(
             'Building a handler from {0}'.format(filename))
@@ -7,10 +7,12 @@ Usage:
   dicom_walk_sort [options] <source_dir> <dest_dir>
 
 Options:
-  --timeout=<sec>  Timeout (in seconds) to wait for more files
-                   [default: 30]
-  -h               Show this help screen.
-  -v, --verbose    Print what's going on.
+  --timeout=<sec>    Timeout (in seconds) to wait for more files
+                     [default: 30]
+  --processes=<n>    Parse headers in this many processes. Default: one per
+                     CPU.
+  -h                 Show this help screen.
+  -v, --verbose      Print what's going on.
 
 """
 from __future__ import with_statement, division, print_function
@@ -18,21 +20,20 @@ from __future__ import with_statement, division, print_function
 import sys
 import os
 import shutil
-import dicom
 import logging
-from time import time
 logger = logging.getLogger(__name__)
 
 from yadda.vendor.docopt import docopt
-from yadda.vendor.schema import Schema, Use
+from yadda.vendor.schema import Schema, Use, Or
 
 import yadda
-from yadda import handlers, managers
+from yadda import handlers, managers, ingest
 
 SCHEMA = Schema({
     '<source_dir>': Use(os.path.expanduser),
     '<dest_dir>': Use(os.path.expanduser),
     '--timeout': Use(float),
+    '--processes': Or(None, Use(int)),
     str: object})
 
 
@@ -50,32 +51,27 @@ def main():
     return dicom_sort_walk(
         validated['<source_dir>'],
         validated['<dest_dir>'],
-        validated['--timeout'])
+        validated['--timeout'],
+        validated['--processes'])
 
 
-def dicom_sort_walk(source_dir, dest_dir, timeout):
+def dicom_sort_walk(source_dir, dest_dir, timeout, processes=None):
     """ Sort dicoms into subdirectories.
 
     Run through the source directory and copy all the dicoms, sorted into
-    directory by series, into subdirectories of dest_dir.
+    directory by series, into subdirectories of dest_dir. Headers are
+    parsed in processes processes (default: one per CPU); progress is
+    logged as it goes.
 
     """
     mgr = SortingDicomManager(timeout, dest_dir)
-    logger.debug("Watching {0}".format(source_dir))
-    start_time = time()
-    file_count = 0
-    for info in os.walk(source_dir):
-        files = info[2]
-        file_count += len(files)
-        for f in files:
-            full_file = os.path.join(source_dir, info[0], f)
-            mgr.handle_file(full_file)
-    elapsed = time() - start_time
-    logger.info("{0} files, {1} seconds, {2} files/sec".format(
-        file_count, elapsed, file_count/elapsed))
+    logger.debug("Walking {0}".format(source_dir))
+    ingest.ingest(mgr, [source_dir], processes)
 
 
 class SortingDicomManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
     def __init__(self, timeout, destination_base):
         self.destination_base = destination_base
         super(SortingDicomManager, self).__init__(timeout)
@@ -83,13 +79,6 @@ class SortingDicomManager(managers.ThreadedDicomManager):
     def handler_key(self, dicom):
         return str(dicom.SeriesNumber)
 
-    def handle_file(self, filename):
-        try:
-            dcm = dicom.read_file(filename)
-        except dicom.filereader.InvalidDicomError:
-            return
-        self.handle_dicom(dcm, filename)
-
     def handle_dicom(self, dcm, filename):
         logger.debug((dcm.SeriesNumber, filename))
         super(SortingDicomManager, self).handle_dicom(dcm, filename)
@@ -22,7 +22,6 @@ logger = logging.getLogger(__name__)
 
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
 from watchdog.observers import Observer
-import dicom
 
 from yadda.vendor.docopt import docopt
 from yadda.vendor.schema import Schema, Use
@@ -94,6 +93,8 @@ class FileChangeHandler(FileSystemEventHandler):
 
 
 class SortingDicomManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
     def __init__(self, timeout, destination_base):
         self.destination_base = destination_base
         super(SortingDicomManager, self).__init__(timeout)
@@ -101,13 +102,6 @@ class SortingDicomManager(managers.ThreadedDicomManager):
     def handler_key(self, dicom):
         return str(dicom.SeriesNumber)
 
-    def handle_file(self, filename):
-        try:
-            dcm = dicom.read_file(filename)
-        except dicom.filereader.InvalidDicomError:
-            return
-        self.handle_dicom(dcm, filename)
-
     def handle_dicom(self, dcm, filename):
         logger.debug((dcm.SeriesNumber, filename))
         super(SortingDicomManager, self).handle_dicom(dcm, filename)
@@ -10,8 +10,15 @@ Usage:
   realtime_dicom_copy.py [options] <source_dir> <dest_dir>
 
 Options:
-  --timeout <sec>    Timeout (in seconds) to wait for more files in a series
-                     [default: 30]
+  --timeout <sec>    Timeout (in seconds) to wait for more files in a series,
+                     if its headers don't say how many to expect, until
+                     we've learned how fast its scanner sends [default: 30]
+  --materialize <how>  How to put files in dest_dir: auto, link, reflink,
+                     copy_file_range, sendfile, or copy. auto picks the
+                     cheapest that works, once per series. [default: auto]
+  --journal <file>   Record progress in <file>. On startup, finish the
+                     series the last run didn't, and pick up files that
+                     arrived while we weren't running.
   --verbose, -v      Show lots of debugging.
   -h                 Show this help screen
 
@@ -20,23 +27,26 @@ from __future__ import with_statement, division, print_function
 
 import sys
 import os
-import shutil
 import logging
 logger = logging.getLogger(__name__)
 
 import yadda
-from yadda import handlers, managers
+from yadda import handlers, managers, materialize
+from yadda.journal import Journal
+from yadda.dedup import Deduplicator
+from yadda.watcher import FileWatcher
 
 from yadda.vendor.docopt import docopt
-from yadda.vendor.schema import Schema, Use
+from yadda.vendor.schema import Schema, Use, Or
 from yadda.vendor import pyinotify
-import dicom
 
 
 SCHEMA = Schema({
     '<source_dir>': Use(os.path.expanduser),
     '<dest_dir>': Use(os.path.expanduser),
     '--timeout': Use(float),
+    '--materialize': Or('auto', *materialize.STRATEGIES),
+    '--journal': Or(None, Use(os.path.expanduser)),
     str: object})
 
 
@@ -52,68 +62,60 @@ def main():
     return dicom_copier(
         source_dir=validated['<source_dir>'],
         dest_dir=validated['<dest_dir>'],
-        timeout=validated['--timeout'])
+        timeout=validated['--timeout'],
+        strategies=validated['--materialize'],
+        journal_path=validated['--journal'])
 
 
-def dicom_copier(source_dir, dest_dir, timeout):
+def dicom_copier(
+        source_dir, dest_dir, timeout, strategies='auto', journal_path=None):
     wm = pyinotify.WatchManager()
-    watch_mask = (
-        pyinotify.IN_MOVED_TO |
-        pyinotify.IN_CLOSE_WRITE |
-        pyinotify.IN_CREATE)
     dicom_manager = CopyingDicomManager(
         timeout=timeout,
-        dest_dir=dest_dir)
-    fch = FileChangeHandler(dicom_manager=dicom_manager)
-    notifier = pyinotify.ThreadedNotifier(wm, fch)
-    wm.add_watch(source_dir, watch_mask, rec=True, auto_add=True)
+        dest_dir=dest_dir,
+        strategies=strategies)
+    # Senders resend files; only copy them once
+    dicom_manager.dedup = Deduplicator()
+    watcher = FileWatcher(callback=dicom_manager.handle_file)
+    notifier = pyinotify.ThreadedNotifier(wm, watcher)
+    watcher.watch(wm, source_dir)
     logger.info('Watching {0}'.format(source_dir))
+    journal = None
     try:
         notifier.start()
+        if journal_path is not None:
+            # Watch first, so nothing lands between the rescan and the watch
+            journal = Journal(journal_path)
+            dicom_manager.recover(journal, [source_dir])
         dicom_manager.wait()
     except KeyboardInterrupt:
         logger.debug("Keyboard Interrupt!")
         notifier.stop()
+        watcher.stop()
         dicom_manager.stop()
-
-
-class FileChangeHandler(pyinotify.ProcessEvent):
-
-    def my_init(self, dicom_manager):
-        self.dicom_manager = dicom_manager
-
-    def process_event(self, event):
-        if event.dir:
-            return
-        logger.debug('Processing {0}'.format(event.pathname))
-        try:
-            self.dicom_manager.handle_file(event.pathname)
-        except Exception as exc:
-            logger.error('Error processing {0}: {1}'.format(
-                event.pathname, exc))
-
-    process_IN_MOVED_TO = process_event
-    process_IN_CLOSE_WRITE = process_event
-    process_IN_CREATE = process_event
+    finally:
+        if journal is not None:
+            journal.close()
 
 
 class CopyingDicomManager(managers.ThreadedDicomManager):
-    def __init__(self, timeout, dest_dir):
+    routing_keys = ('StudyDate', 'StudyID', 'SeriesNumber')
+    # Rename series directories as soon as they're complete, or once
+    # nothing's come in for a while, judging by how fast that scanner sends
+    predict_completion = True
+    adaptive_timeouts = True
+
+    def __init__(self, timeout, dest_dir, strategies='auto'):
         super(CopyingDicomManager, self).__init__(timeout)
         self.dest_dir = dest_dir
+        if strategies == 'auto':
+            strategies = materialize.AUTO
+        self.strategies = strategies
 
     def handler_key(self, dcm):
         return '{0}-{1}-{2}'.format(
             dcm.StudyDate, dcm.StudyID, dcm.SeriesNumber)
 
-    def handle_file(self, filename):
-        try:
-            dcm = dicom.read_file(filename)
-        except dicom.filereader.InvalidDicomError:
-            logger.warn('Not a dicom: {0}'.format(filename))
-            return
-        self.handle_dicom(dcm, filename)
-
     def build_handler(self, dcm, filename):
         logger.debug(
             'Building a handler from {0}'.format(filename))
@@ -121,14 +123,19 @@ class CopyingDicomManager(managers.ThreadedDicomManager):
             manager=self,
             name=self.handler_key(dcm),
             timeout=self.timeout,
-            dest_dir=self.dest_dir)
+            dest_dir=self.dest_dir,
+            strategies=self.strategies)
 
 
 class CopyingDicomHandler(handlers.ThreadedDicomHandler):
-    def __init__(self, manager, name, timeout, dest_dir):
+    def __init__(
+            self, manager, name, timeout, dest_dir,
+            strategies=materialize.AUTO):
         self.dest_root = dest_dir
         self.temp_dir = os.path.join(dest_dir, '.'+name)
         self.final_dir = os.path.join(dest_dir, name)
+        # Picks link/reflink/... on the first file, then sticks with it
+        self.materializer = materialize.Materializer(strategies)
         super(CopyingDicomHandler, self).__init__(manager, name, timeout)
 
     def on_start(self):
@@ -141,9 +148,15 @@ class CopyingDicomHandler(handlers.ThreadedDicomHandler):
     def on_handle(self, dcm, filename):
         logger.debug('{0}: Copy {1} -> {2}'.format(
             self, filename, self.temp_dir))
-        shutil.copy(filename, self.temp_dir)
+        dest = os.path.join(self.temp_dir, os.path.basename(filename))
+        if os.path.exists(dest):
+            # Left over from a run that died before journaling it
+            os.remove(dest)
+        self.materializer.materialize(filename, self.temp_dir)
 
     def on_finish(self):
+        logger.info('{0}: Materialized with {1}'.format(
+            self, self.materializer.strategy))
         logger.info('{0}: Move {1} -> {2}'.format(
             self, self.temp_dir, self.final_dir))
         os.rename(self.temp_dir, self.final_dir)
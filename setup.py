@@ -32,6 +32,6 @@ setup(
     author_email=metadata['author_email'],
     license=metadata['license'],
     url=metadata['url'],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     cmdclass = {'test': PyTest}
     )
\ No newline at end of file
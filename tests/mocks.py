@@ -15,4 +15,201 @@ class FakeDicom(object):
         return 0
 
     def __str__(self):
-        return "FakeDicom(%s)" % (self.key)
\ No newline at end of file
+        return "FakeDicom(%s)" % (self.key)
+
+def sample_path(name):
+    """ Path to one of pydicom's sample dicoms. """
+    import os
+    import dicom
+    return os.path.join(
+        os.path.dirname(dicom.__file__), 'testfiles', name)
+
+
+class FakeFTPServer(object):
+    """
+    Just enough of an FTP server to test uploads against: remembers
+    directories, stored files, and how many sessions logged in.
+    """
+
+    def __init__(self):
+        import threading
+        self.dirs = set([''])
+        self.files = {}
+        self.logins = 0
+        self.open_sessions = 0
+        self.max_open_sessions = 0
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def client(self):
+        return FakeFTP(self)
+
+    def drop_sessions(self):
+        """ Time out every session, like a server's idle timeout. """
+        with self.lock:
+            for session in self.sessions:
+                session.dropped = True
+
+
+class FakeFTP(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.dropped = False
+
+    def _check(self):
+        import ftplib
+        if self.dropped:
+            raise ftplib.error_temp('421 Timeout.')
+
+    def connect(self, host, port):
+        with self.server.lock:
+            self.server.open_sessions += 1
+            self.server.max_open_sessions = max(
+                self.server.max_open_sessions, self.server.open_sessions)
+            self.server.sessions.append(self)
+
+    def login(self, user, password):
+        with self.server.lock:
+            self.server.logins += 1
+
+    def voidcmd(self, cmd):
+        self._check()
+        return '200 OK'
+
+    def mkd(self, path):
+        import ftplib
+        self._check()
+        with self.server.lock:
+            if path in self.server.dirs:
+                raise ftplib.error_perm('550 File exists')
+            self.server.dirs.add(path)
+
+    def storbinary(self, cmd, f):
+        import posixpath
+        self._check()
+        path = cmd.split(' ', 1)[1]
+        data = f.read()
+        with self.server.lock:
+            assert posixpath.dirname(path) in self.server.dirs
+            self.server.files[path] = data
+
+    def rename(self, from_path, to_path):
+        import ftplib
+        self._check()
+        with self.server.lock:
+            if to_path in self.server.dirs:
+                raise ftplib.error_perm('550 File exists')
+            self.server.dirs.remove(from_path)
+            self.server.dirs.add(to_path)
+            for path in list(self.server.files):
+                if path.startswith(from_path + '/'):
+                    new_path = to_path + path[len(from_path):]
+                    self.server.files[new_path] = self.server.files.pop(path)
+
+    def quit(self):
+        self.close()
+
+    def close(self):
+        with self.server.lock:
+            self.server.open_sessions -= 1
+
+
+class LocalFTPServer(object):
+    """
+    A real, if tiny, FTP server on localhost, for testing against what
+    ftplib actually does. It serves root, with just the commands
+    FTPConnectionPool uses, and like real servers it says 421 and hangs
+    up on sessions idle for idle_timeout seconds.
+    """
+
+    def __init__(self, root, idle_timeout=None):
+        import threading
+        import SocketServer
+        server = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                server._serve(self.request)
+        self.root = root
+        self.idle_timeout = idle_timeout
+        self.logins = 0
+        self._server = SocketServer.ThreadingTCPServer(
+            ('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _serve(self, conn):
+        import os
+        import socket
+        conn.settimeout(self.idle_timeout)
+        lines = conn.makefile('rb')
+
+        def reply(line):
+            conn.sendall(line + '\r\n')
+        reply('220 Hello')
+        passive = rename_from = None
+        while True:
+            try:
+                line = lines.readline()
+            except socket.timeout:
+                reply('421 Timeout.')
+                return
+            if not line:
+                return
+            command, _, arg = line.rstrip('\r\n').partition(' ')
+            command = command.upper()
+            path = os.path.join(self.root, arg)
+            if command == 'USER':
+                reply('331 Password, please')
+            elif command == 'PASS':
+                self.logins += 1
+                reply('230 Logged in')
+            elif command in ('TYPE', 'NOOP'):
+                reply('200 OK')
+            elif command == 'MKD':
+                if os.path.exists(path):
+                    reply('550 File exists')
+                else:
+                    os.mkdir(path)
+                    reply('257 "{0}" created'.format(arg))
+            elif command == 'RNFR':
+                rename_from = path
+                reply('350 Go on')
+            elif command == 'RNTO':
+                if os.path.exists(path):
+                    reply('550 File exists')
+                else:
+                    os.rename(rename_from, path)
+                    reply('250 Renamed')
+            elif command == 'PASV':
+                passive = socket.socket()
+                passive.bind(('127.0.0.1', 0))
+                passive.listen(1)
+                host, port = passive.getsockname()
+                reply('227 Passive ({0},{1},{2})'.format(
+                    host.replace('.', ','), port >> 8, port & 0xff))
+            elif command == 'STOR':
+                reply('150 Send it')
+                data, _ = passive.accept()
+                with open(path, 'wb') as f:
+                    while True:
+                        chunk = data.recv(65536)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                data.close()
+                passive.close()
+                reply('226 Stored')
+            elif command == 'QUIT':
+                reply('221 Bye')
+                return
+            else:
+                reply('502 Not implemented')
@@ -0,0 +1,71 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import json
+from StringIO import StringIO
+
+import dicom
+from dicom import UID
+
+from benchmarks import corpus, timing, suite
+
+
+def small_corpus(tmpdir):
+    return corpus.build_corpus(str(tmpdir), scale=0.05)
+
+
+def test_corpus_kinds(tmpdir):
+    c = small_corpus(tmpdir)
+    syntaxes = {}
+    series = set()
+    for kind in corpus.KINDS:
+        assert c.files[kind]
+        ds = dicom.read_file(c.files[kind][0])
+        syntaxes[kind] = ds.file_meta.TransferSyntaxUID
+        series.update(dicom.read_file(f).SeriesNumber for f in c.files[kind])
+    assert syntaxes['deflated'] == UID.DeflatedExplicitVRLittleEndian
+    assert syntaxes['deep'] == UID.ImplicitVRLittleEndian
+    assert len(series) == sum(n for n, per in corpus.DEFAULT_COUNTS.values())
+    mr = dicom.read_file(c.files['mr'][0])
+    assert len(mr.PixelData) == mr.NumberOfFrames * mr.Rows * mr.Columns * 2
+
+
+def test_corpus_is_reproducible(tmpdir):
+    a = corpus.build_corpus(str(tmpdir.join('a')), scale=0.05, kinds=['ct'])
+    b = corpus.build_corpus(str(tmpdir.join('b')), scale=0.05, kinds=['ct'])
+    for first, second in zip(a.files['ct'], b.files['ct']):
+        assert open(first, 'rb').read() == open(second, 'rb').read()
+
+
+def test_run_all_emits_json(tmpdir):
+    c = small_corpus(tmpdir)
+    results = timing.run_all(c, ['read.full.ct', 'pipeline.'], repeat=1)
+    assert sorted(results['results']) == [
+        'pipeline.pooled', 'pipeline.threaded', 'read.full.ct']
+    ct = results['results']['read.full.ct']
+    assert ct['ops'] == len(c.files['ct'])
+    assert len(ct['runs']) == 1
+    out = StringIO()
+    timing.dump(results, out)
+    assert json.loads(out.getvalue())['meta']['files'] == len(c)
+
+
+def test_imports_defer_heavy_modules(tmpdir):
+    # The import benchmarks fail if a deferred module gets imported
+    results = timing.run_all(small_corpus(tmpdir), ['import.'], repeat=1)
+    assert sorted(results['results']) == [
+        'import.baseline', 'import.dicom', 'import.yadda.managers']
+
+
+def test_compare_flags_regressions():
+    def results(**per_op):
+        return {'results': dict(
+            (name, {'per_op': value}) for name, value in per_op.items())}
+    old = results(fast=1.0, slow=1.0, gone=1.0)
+    new = results(fast=0.5, slow=1.5, new=1.0)
+    rows = dict((row[0], row) for row in timing.compare(old, new))
+    assert sorted(rows) == ['fast', 'slow']
+    assert not rows['fast'][4]
+    assert rows['slow'][4]
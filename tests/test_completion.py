@@ -0,0 +1,207 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import time
+
+import dicom
+from dicom.dataset import Dataset
+from yadda import managers, handlers
+from yadda.completion import (
+    InstanceBitmap, SeriesCompletion, InstanceCountLearner,
+    expected_instances)
+
+from mocks import sample_path
+
+
+def instance(number, images=None, protocol='fmri', acquisition=None):
+    ds = Dataset()
+    if number is not None:
+        ds.InstanceNumber = number
+    if images is not None:
+        ds.ImagesInAcquisition = images
+    if acquisition is not None:
+        ds.AcquisitionNumber = acquisition
+    ds.StationName = 'MR1'
+    ds.ProtocolName = protocol
+    return ds
+
+
+def test_bitmap():
+    bits = InstanceBitmap()
+    assert bits.add(3)
+    assert not bits.add(3)
+    assert bits.add(1000)
+    assert 3 in bits and 1000 in bits and 4 not in bits
+    assert (len(bits), bits.max) == (2, 1000)
+
+
+def test_expected_instances():
+    assert expected_instances(instance(1, images=40)) == 40
+    ds = instance(1)
+    assert expected_instances(ds) is None
+    ds.NumberOfTemporalPositions = 10
+    ds.NumberOfSlices = 30
+    assert expected_instances(ds) == 300
+
+
+def test_complete_once_every_instance_is_here():
+    completion = SeriesCompletion()
+    assert not completion.add(instance(3, images=3))
+    assert not completion.add(instance(1, images=3))
+    assert completion.add(instance(2, images=3))
+    assert completion.stats()['expected_from'] == 'header'
+
+
+def test_more_acquisitions_disable_prediction():
+    completion = SeriesCompletion(acquisition_grace=1.5)
+    for number in (1, 2):
+        assert not completion.add(instance(number, 3, acquisition=1))
+    assert completion.add(instance(3, 3, acquisition=1))
+    assert completion.grace == 1.5
+    assert not completion.add(instance(4, 3, acquisition=2))
+    assert completion.confused
+    completion = SeriesCompletion()
+    assert not completion.add(instance(4, 3, acquisition=2))
+    assert completion.confused
+    # Counts that aren't per acquisition needn't wait
+    ds = instance(1)
+    ds.NumberOfTemporalPositions = 1
+    ds.NumberOfSlices = 1
+    completion = SeriesCompletion()
+    assert completion.add(ds) and not completion.grace
+
+
+def test_unexpected_instances_disable_prediction():
+    completion = SeriesCompletion()
+    for number in (1, 4, 2, 3):
+        assert not completion.add(instance(number, images=3))
+    assert completion.confused
+    completion = SeriesCompletion()
+    assert not completion.add(instance(None, images=1))
+    # A resend could otherwise finish the series a file early
+    completion = SeriesCompletion()
+    for number in (1, 1, 2):
+        assert not completion.add(instance(number, images=2))
+    assert completion.confused
+
+
+def test_huge_instance_numbers_stay_small():
+    for images in (None, 10):
+        completion = SeriesCompletion()
+        completion.add(instance(1, images=images))
+        assert not completion.add(instance(2000000001, images=images))
+        assert completion.confused
+        assert len(completion.instances._bits) < 16
+
+
+def test_learned_counts_need_agreement():
+    learner = InstanceCountLearner(agree=2)
+
+    def run_series(count):
+        completion = SeriesCompletion(learner)
+        done = [completion.add(instance(n)) for n in range(1, count + 1)]
+        learner.series_finished(completion)
+        return done
+
+    assert not any(run_series(5))
+    assert not any(run_series(5))
+    assert run_series(5) == [False] * 4 + [True]
+    assert learner.expected(('MR1', '', 'fmri')) == 5
+
+
+class RecordingHandler(handlers.ThreadedDicomHandler):
+
+    def on_handle(self, dcm, filename):
+        self.manager.handled.append(filename)
+
+
+class PooledRecordingHandler(handlers.PooledDicomHandler):
+
+    def on_handle(self, dcm, filename):
+        self.manager.handled.append(filename)
+
+
+class CompletingManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+    predict_completion = True
+    acquisition_grace = 0.1
+    handler_class = RecordingHandler
+
+    def __init__(self, timeout):
+        super(CompletingManager, self).__init__(timeout)
+        self.handled = []
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return self.handler_class(self, self.handler_key(dcm), self.timeout)
+
+
+class PooledCompletingManager(managers.PooledDicomManager):
+    routing_keys = ('SeriesNumber',)
+    predict_completion = True
+    acquisition_grace = 0.1
+    handler_key = CompletingManager.__dict__['handler_key']
+
+    def __init__(self, timeout):
+        super(PooledCompletingManager, self).__init__(timeout, workers=2)
+        self.handled = []
+
+    def build_handler(self, dcm, filename):
+        return PooledRecordingHandler(
+            self, self.handler_key(dcm), self.timeout)
+
+
+def make_series(tmpdir, count, acquisitions=1, **header):
+    ds = dicom.read_file(sample_path('CT_small.dcm'))
+    ds.ImagesInAcquisition = count
+    for keyword, value in header.items():
+        setattr(ds, keyword, value)
+    filenames = []
+    for number in range(1, count * acquisitions + 1):
+        ds.InstanceNumber = number
+        ds.AcquisitionNumber = (number - 1) // count + 1
+        filename = str(tmpdir.join('im{0}.dcm'.format(number)))
+        ds.save_as(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_managers_finish_complete_series_early(tmpdir):
+    filenames = make_series(tmpdir, 4)
+    for manager_class in (CompletingManager, PooledCompletingManager):
+        manager = manager_class(timeout=30)
+        started = time.time()
+        for filename in filenames:
+            manager.handle_file(filename)
+        manager.wait_for_handlers()
+        assert time.time() - started < 5
+        assert manager.handled == filenames
+        stats = manager.stats()
+        assert not stats['active'] and len(stats['finished']) == 1
+        manager.stop()
+
+
+def test_routing_reads_include_completion_keys(tmpdir):
+    filename = make_series(
+        tmpdir, 1, NumberOfTemporalPositions=5, NumberOfSlices=6)[0]
+    dcm = CompletingManager(30).read_dicom(filename)
+    del dcm.ImagesInAcquisition
+    assert expected_instances(dcm) == 30
+
+
+def test_managers_wait_out_more_acquisitions(tmpdir):
+    filenames = make_series(tmpdir, 2, acquisitions=2)
+    for manager_class in (CompletingManager, PooledCompletingManager):
+        manager = manager_class(timeout=0.5)
+        manager.acquisition_grace = 0.3
+        for filename in filenames:
+            manager.handle_file(filename)
+        manager.wait_for_handlers()
+        assert manager.handled == filenames
+        stats = manager.stats()
+        assert len(stats['finished']) == 1
+        manager.stop()
@@ -0,0 +1,120 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import shutil
+
+import pytest
+
+from yadda import managers
+from yadda.dedup import RecentKeys, Deduplicator
+
+from mocks import sample_path
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_recent_keys_expire():
+    clock = FakeClock()
+    keys = RecentKeys(max_entries=10, max_age=5, clock=clock)
+    assert keys.add('a')
+    assert not keys.add('a')
+    clock.now += 4
+    assert not keys.add('a')  # seeing it again resets its age
+    clock.now += 4
+    assert 'a' in keys
+    clock.now += 2
+    assert 'a' not in keys
+    assert keys.add('a')
+
+
+def test_recent_keys_drop_least_recently_seen():
+    clock = FakeClock()
+    keys = RecentKeys(max_entries=3, max_age=60, clock=clock)
+    for key in 'abc':
+        keys.add(key)
+        clock.now += 1
+    keys.add('a')
+    keys.add('d')
+    assert len(keys) == 3
+    assert 'b' not in keys
+    assert 'a' in keys
+
+
+def test_file_is_new_until_it_changes(tmpdir):
+    path = tmpdir.join('f')
+    path.write('x')
+    dedup = Deduplicator()
+    assert dedup.file_is_new(str(path))
+    assert not dedup.file_is_new(str(path))
+    path.write('xy')
+    assert dedup.file_is_new(str(path))
+    assert dedup.file_is_new(str(tmpdir.join('missing')))
+    assert dedup.stats()['files_skipped'] == 1
+
+
+class CountingManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
+    def __init__(self, dedup):
+        super(CountingManager, self).__init__(0)
+        self.dedup = dedup
+        self.handled = []
+
+    def handle_dicom(self, dcm, filename):
+        self.handled.append(filename)
+
+
+def test_manager_skips_repeats(tmpdir):
+    first = str(tmpdir.join('first.dcm'))
+    resent = str(tmpdir.join('resent.dcm'))
+    shutil.copy(sample_path('CT_small.dcm'), first)
+    shutil.copy(sample_path('CT_small.dcm'), resent)
+    manager = CountingManager(Deduplicator())
+    for filename in (first, first, resent):
+        manager.handle_file(filename)
+    assert manager.handled == [first, resent]
+
+    manager = CountingManager(Deduplicator(by_instance_uid=True))
+    for filename in (first, first, resent):
+        manager.handle_file(filename)
+    assert manager.handled == [first]
+    assert manager.stats()['dedup']['instances_skipped'] == 1
+
+
+class FlakyManager(CountingManager):
+    def __init__(self, dedup):
+        super(FlakyManager, self).__init__(dedup)
+        self.failures = ['read', 'handoff']
+
+    def read_dicom(self, filename):
+        if self.failures and self.failures[0] == 'read':
+            self.failures.pop(0)
+            raise IOError('transient')
+        return super(FlakyManager, self).read_dicom(filename)
+
+    def handle_dicom(self, dcm, filename):
+        if self.failures and self.failures[0] == 'handoff':
+            self.failures.pop(0)
+            raise IOError('transient')
+        super(FlakyManager, self).handle_dicom(dcm, filename)
+
+
+def test_failed_files_are_retried(tmpdir):
+    path = str(tmpdir.join('flaky.dcm'))
+    shutil.copy(sample_path('CT_small.dcm'), path)
+    manager = FlakyManager(Deduplicator(by_instance_uid=True))
+    for i in range(2):
+        with pytest.raises(IOError):
+            manager.handle_file(path)
+    manager.handle_file(path)
+    manager.handle_file(path)
+    assert manager.handled == [path]
@@ -0,0 +1,58 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import threading
+from yadda import eventloop
+
+
+def test_call_later_runs_in_time_order():
+    loop = eventloop.EventLoop()
+    calls = []
+    loop.call_later(0.02, calls.append, 'b')
+    loop.call_later(0.01, calls.append, 'a')
+    loop.call_soon(calls.append, 'soon')
+    loop.run_until(lambda: len(calls) == 3)
+    assert calls == ['soon', 'a', 'b']
+    loop.close()
+
+
+def test_cancelled_handles_dont_run():
+    loop = eventloop.EventLoop()
+    calls = []
+    handle = loop.call_later(0, calls.append, 'nope')
+    handle.cancel()
+    loop.call_later(0.01, calls.append, 'yep')
+    loop.run_until(lambda: calls)
+    assert calls == ['yep']
+    loop.close()
+
+
+def test_add_reader():
+    loop = eventloop.EventLoop()
+    r, w = os.pipe()
+    got = []
+
+    def read():
+        got.append(os.read(r, 10))
+    loop.add_reader(r, read)
+    os.write(w, b'hi')
+    loop.run_until(lambda: got)
+    assert got == [b'hi']
+    assert loop.remove_reader(r)
+    loop.close()
+    os.close(r)
+    os.close(w)
+
+
+def test_call_soon_threadsafe_wakes_loop():
+    loop = eventloop.EventLoop()
+    thread = threading.Thread(
+        target=lambda: loop.call_soon_threadsafe(loop.stop))
+    loop.call_soon(thread.start)
+    loop.run_forever()
+    thread.join()
+    assert not loop.is_running()
+    loop.close()
@@ -0,0 +1,107 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import time
+import ftplib
+
+import pytest
+from yadda import ftp
+
+from mocks import FakeFTPServer, LocalFTPServer
+
+
+def make_pool(server, max_connections=2):
+    return ftp.FTPConnectionPool(
+        'localhost', base_dir='incoming', max_connections=max_connections,
+        ftp_factory=server.client)
+
+
+def test_pool_reuses_sessions():
+    server = FakeFTPServer()
+    server.dirs.add('incoming')
+    connections = make_pool(server)
+    for i in range(5):
+        with connections.connection() as session:
+            pass
+    assert server.logins == 1
+    connections.close()
+    assert server.open_sessions == 0
+
+
+def test_pool_drops_broken_sessions():
+    server = FakeFTPServer()
+    connections = make_pool(server)
+    with pytest.raises(ftplib.error_temp):
+        with connections.connection() as session:
+            raise ftplib.error_temp('421 Bye')
+    assert server.open_sessions == 0
+    with connections.connection() as session:
+        pass
+    assert server.logins == 2
+
+
+def test_makedir_caches_known_dirs():
+    server = FakeFTPServer()
+    server.dirs.add('incoming')
+    connections = make_pool(server)
+    assert connections.makedir('a') == 'incoming/a'
+    server.dirs.remove('incoming/a')
+    connections.makedir('a')
+    assert 'incoming/a' not in server.dirs
+
+
+def test_store_all_uses_one_session(tmpdir):
+    server = FakeFTPServer()
+    server.dirs.update(['incoming', 'incoming/a'])
+    connections = make_pool(server)
+    files = []
+    for i in range(3):
+        f = tmpdir.join('{0}.dcm'.format(i))
+        f.write(str(i))
+        files.append(str(f))
+    paths = connections.store_all(files, 'a')
+    assert paths == [
+        'incoming/a/0.dcm', 'incoming/a/1.dcm', 'incoming/a/2.dcm']
+    assert server.files['incoming/a/2.dcm'] == '2'
+    assert server.logins == 1
+
+
+@pytest.mark.parametrize('noop_after', [0, 60])
+def test_dropped_sessions_are_replaced(tmpdir, noop_after):
+    server = FakeFTPServer()
+    server.dirs.add('incoming')
+    connections = make_pool(server)
+    connections.noop_after = noop_after
+    connections.makedir('a')
+    server.drop_sessions()
+    f = tmpdir.join('1.dcm')
+    f.write('x')
+    connections.store_all([str(f)], 'a')
+    assert server.files['incoming/a/1.dcm'] == 'x'
+    assert server.logins == 2
+    assert server.open_sessions == 1
+
+
+@pytest.mark.parametrize('noop_after', [0, 60])
+def test_pool_survives_the_server_timing_out(tmpdir, noop_after):
+    root = tmpdir.mkdir('root')
+    root.mkdir('incoming')
+    server = LocalFTPServer(str(root), idle_timeout=0.2)
+    try:
+        connections = ftp.FTPConnectionPool(
+            server.host, server.port, base_dir='incoming',
+            noop_after=noop_after)
+        connections.makedir('a')
+        # Long enough for the server to hang up on our idle session
+        time.sleep(0.5)
+        f = tmpdir.join('1.dcm')
+        f.write('dicom!')
+        connections.store_all([str(f)], 'a')
+        connections.rename('a', 'b')
+        connections.close()
+    finally:
+        server.close()
+    assert root.join('incoming', 'b', '1.dcm').read() == 'dicom!'
+    assert server.logins == 2
@@ -5,7 +5,8 @@
 
 import pytest
 import time
-from yadda import handlers
+import threading
+from yadda import handlers, pool, eventloop
 
 
 class DummyManager(object):
@@ -43,8 +44,8 @@ def test_threaded_handler_joins():
     h.start()
     assert h.startered
     h.handle_dicom("Foo")
-    assert h.handlered
     h.join()
+    assert h.handlered
     assert h.finished
 
 def test_threaded_handler_terminates():
@@ -59,6 +60,163 @@ def test_threaded_handler_terminates():
     assert h.finished
     assert (time.clock() - start) < timeout
     assert not h.handlered
+    with pytest.raises(handlers.HandlerClosedError):
+        h.handle_dicom("Foo")
+
+
+class OrderedHandler(handlers.ThreadedDicomHandler):
+    def __init__(self, manager, name, timeout, high_water_mark=None):
+        super(OrderedHandler, self).__init__(
+            manager, name, timeout, high_water_mark)
+        self.handled = []
+        self.release = threading.Event()
+
+    def on_handle(self, dcm):
+        self.release.wait(5)
+        self.handled.append(dcm)
+
+
+def test_threaded_handler_keeps_order():
+    h = OrderedHandler(DummyManager(), "test", 10)
+    h.release.set()
+    h.start()
+    for i in range(50):
+        h.handle_dicom(i)
+    h.terminate()
+    h.join()
+    assert h.handled == list(range(50))
+
+
+def test_threaded_handler_applies_backpressure():
+    h = OrderedHandler(DummyManager(), "test", 10, high_water_mark=2)
+    h.start()
+    for i in range(3):
+        h.handle_dicom(i)  # one being handled, two waiting
+    assert h.queue_depth == 2
+    blocked = threading.Thread(target=h.handle_dicom, args=(3,))
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    h.release.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    h.terminate()
+    h.join()
+    assert h.handled == [0, 1, 2, 3]
+
 
 
 
+class DummyPoolManager(DummyManager):
+    def __init__(self):
+        self.pool = pool.WorkerPool(2)
+        self.pool.start()
+        self.removed = []
+
+    def remove_handler(self, h):
+        self.removed.append(h)
+
+
+class TestPooledHandler(handlers.PooledDicomHandler):
+    def __init__(self, manager, name, timeout):
+        super(TestPooledHandler, self).__init__(manager, name, timeout)
+        self.calls = []
+
+    def on_start(self):
+        self.calls.append('start')
+
+    def on_handle(self, dcm):
+        self.calls.append(dcm)
+
+    def on_finish(self):
+        self.calls.append('finish')
+
+
+def test_pooled_handler_runs_hooks_in_order():
+    mgr = DummyPoolManager()
+    h = TestPooledHandler(mgr, "test", 0)
+    with pytest.raises(RuntimeError):
+        h.handle_dicom("foo")
+    h.start()
+    for i in range(10):
+        h.handle_dicom(i)
+    h.finish()
+    h.join(5)
+    assert not h.is_alive()
+    assert h.calls == ['start'] + list(range(10)) + ['finish']
+    assert mgr.removed == [h]
+    with pytest.raises(RuntimeError):
+        h.handle_dicom("foo")
+    mgr.pool.stop()
+
+
+class DummyLoopManager(DummyManager):
+    def __init__(self):
+        self.loop = eventloop.EventLoop()
+        self.removed = []
+
+    def remove_handler(self, h):
+        self.removed.append(h)
+
+
+class TestAsyncHandler(handlers.AsyncDicomHandler):
+    def __init__(self, manager, name, timeout):
+        super(TestAsyncHandler, self).__init__(manager, name, timeout)
+        self.calls = []
+
+    def on_start(self):
+        self.calls.append('start')
+
+    def on_handle(self, dcm):
+        self.calls.append(dcm)
+
+    def on_finish(self):
+        self.calls.append('finish')
+
+
+def test_async_handler_times_out():
+    mgr = DummyLoopManager()
+    h = TestAsyncHandler(mgr, "test", 0.01)
+    with pytest.raises(RuntimeError):
+        h.handle_dicom("foo")
+    h.start()
+    h.handle_dicom(1)
+    h.handle_dicom(2)
+    assert h.is_alive()
+    mgr.loop.run_until(lambda: not h.is_alive())
+    assert h.calls == ['start', 1, 2, 'finish']
+    assert mgr.removed == [h]
+    mgr.loop.close()
+
+
+def test_async_handler_terminates():
+    mgr = DummyLoopManager()
+    h = TestAsyncHandler(mgr, "test", 10)
+    h.start()
+    h.terminate()
+    h.terminate()
+    assert h.calls == ['start', 'finish']
+    assert not h.is_alive()
+    mgr.loop.close()
+
+
+def test_delivering_handler_reports_stats():
+    from yadda import transports
+
+    class NullTransport(transports.Transport):
+        def send(self, name, filename):
+            return 1
+
+    delivery = transports.Delivery(NullTransport(), batch_size=2)
+    h = handlers.DeliveringDicomHandler(DummyManager(), "s", 10, delivery)
+    h.start()
+    for i in range(5):
+        h.handle_dicom(None, str(i))
+    h.terminate()
+    h.join()
+    delivery.stop()
+    stats = h.stats()
+    assert stats['name'] == 's'
+    assert stats['files'] == 5
+    assert stats['queue_depth'] == 0
+    assert stats['finished']
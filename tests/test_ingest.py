@@ -0,0 +1,115 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import time
+
+import pytest
+import dicom
+from yadda import managers, ingest
+
+from mocks import sample_path
+
+
+class RecordingManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
+    def __init__(self):
+        super(RecordingManager, self).__init__(0)
+        self.handled = []
+
+    def handle_dicom(self, dcm, filename):
+        self.handled.append((int(dcm.SeriesNumber), filename))
+
+
+def make_tree(tmpdir, series=3, per_series=4):
+    """ sub_<n>/ directories of CT_small copies, plus a non-dicom. """
+    ds = dicom.read_file(sample_path('CT_small.dcm'))
+    for i in range(series * per_series):
+        directory = tmpdir.join('sub_{0}'.format(i % 2))
+        directory.ensure(dir=True)
+        ds.SeriesNumber = i % series
+        ds.InstanceNumber = i
+        ds.save_as(str(directory.join('im{0:03d}.dcm'.format(i))))
+    tmpdir.join('README').write('not a dicom')
+    return str(tmpdir)
+
+
+def test_walk_files_is_sorted(tmpdir):
+    top = make_tree(tmpdir)
+    files = list(ingest.walk_files(top))
+    assert len(files) == 13
+    assert files[0] == os.path.join(top, 'README')
+    sub_0 = [f for f in files if os.sep + 'sub_0' + os.sep in f]
+    assert sub_0 == sorted(sub_0)
+    assert files.index(sub_0[-1]) < files.index(
+        os.path.join(top, 'sub_1', 'im001.dcm'))
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_ingest_hands_over_in_walk_order(tmpdir, processes):
+    top = make_tree(tmpdir)
+    manager = RecordingManager()
+    reports = []
+    counts = ingest.ingest(
+        manager, [top], processes=processes, chunksize=2,
+        progress=reports.append)
+    assert (counts.files, counts.dicoms, counts.skipped, counts.errors) == \
+        (13, 12, 1, 0)
+    walked = [f for f in ingest.walk_files(top) if f.endswith('.dcm')]
+    assert [filename for series, filename in manager.handled] == walked
+    for series, filename in manager.handled:
+        assert dicom.read_file(filename).SeriesNumber == series
+    assert reports[-1] is counts
+    assert counts.finished_at is not None
+
+
+def test_ingest_counts_unreadable_files(tmpdir):
+    truncated = tmpdir.join('truncated.dcm')
+    header = open(sample_path('CT_small.dcm'), 'rb').read()[:200]
+    truncated.write(header, 'wb')
+    manager = RecordingManager()
+    counts = ingest.ingest(
+        manager, [str(truncated)], processes=1, progress=None)
+    assert (counts.files, counts.dicoms, counts.errors) == (1, 0, 1)
+    assert manager.handled == []
+
+
+class CountingPaths(object):
+    """ Paths, counting how many have been taken. """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.taken = 0
+
+    def __iter__(self):
+        for path in self.paths:
+            self.taken += 1
+            yield path
+
+
+class SlowManager(RecordingManager):
+
+    def __init__(self, paths):
+        super(SlowManager, self).__init__()
+        self.paths = paths
+        self.ahead = []
+
+    def handle_dicom(self, dcm, filename):
+        self.ahead.append(self.paths.taken - len(self.handled))
+        time.sleep(0.005)
+        super(SlowManager, self).handle_dicom(dcm, filename)
+
+
+def test_ingest_reads_a_bounded_amount_ahead(tmpdir):
+    files = [f for f in ingest.walk_files(make_tree(tmpdir))
+             if f.endswith('.dcm')]
+    paths = CountingPaths(files * 5)
+    manager = SlowManager(paths)
+    counts = ingest.ingest(
+        manager, paths, processes=2, chunksize=2, read_ahead=3,
+        progress=None)
+    assert counts.dicoms == 60
+    assert max(manager.ahead) <= (3 + 1) * 2
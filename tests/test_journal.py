@@ -0,0 +1,231 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import time
+import errno
+import threading
+
+import pytest
+
+import dicom
+from yadda import managers, handlers, journal
+from yadda.journal import (
+    Journal, JournalFailedError, SEEN, HANDLED, FINISHED, IGNORED)
+
+from mocks import sample_path
+
+
+def write_records(path, records):
+    with open(str(path), 'wb') as f:
+        for record in records:
+            f.write(journal.encode_record(record))
+
+
+def test_replay_tracks_unfinished_series(tmpdir):
+    path = tmpdir.join('journal')
+    write_records(path, [
+        (SEEN, 'a', '/a1'), (SEEN, 'a', '/a2'), (HANDLED, 'a', '/a1'),
+        (SEEN, 'b', '/b1'), (HANDLED, 'b', '/b1'), (FINISHED, 'b', None),
+        (IGNORED, None, '/README')])
+    j = Journal(str(path))
+    try:
+        assert list(j.state.unfinished) == ['a']
+        assert j.state.pending('a') == ['/a2']
+        assert j.state.handled('a') == ['/a1']
+        assert j.state.seen == set(['/a1', '/a2', '/b1', '/README'])
+    finally:
+        j.close()
+
+
+def test_torn_record_is_skipped(tmpdir):
+    path = tmpdir.join('journal')
+    write_records(path, [(SEEN, 'a', '/a1')])
+    path.write('["handled", "a", "/a', 'ab')
+    j = Journal(str(path))
+    j.close()
+    assert j.state.pending('a') == ['/a1']
+
+
+def test_records_are_batched(tmpdir):
+    path = str(tmpdir.join('journal'))
+    j = Journal(path, flush_interval=10, batch_size=50)
+    for i in range(200):
+        j.file_seen('a', '/a{0}'.format(i))
+    # A full batch goes out without waiting for flush_interval
+    deadline = time.time() + 2
+    while not j.flushes and time.time() < deadline:
+        time.sleep(0.01)
+    assert 1 <= j.flushes <= 4
+    j.close()
+    assert len(list(journal.read_records(path))) == 200
+
+
+def test_filenames_round_trip_as_bytes(tmpdir):
+    path = str(tmpdir.join('journal'))
+    filename = '/data/caf\xe9/\xff.dcm'
+    j = Journal(path)
+    j.file_seen('a', filename)
+    j.close()
+    assert list(journal.read_records(path)) == [(SEEN, 'a', filename)]
+
+
+class FullFile(object):
+    """ A journal file on a full disk. """
+
+    def write(self, data):
+        raise IOError(errno.ENOSPC, 'No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_writes_are_kept_and_reported(tmpdir):
+    j = Journal(str(tmpdir.join('journal')), flush_interval=0.01)
+    j._file.close()
+    j._file = FullFile()
+    j.file_seen('a', '/a1')
+    with pytest.raises(JournalFailedError):
+        j.flush()
+    assert j._pending == [(SEEN, 'a', '/a1')]
+    with pytest.raises(JournalFailedError):
+        j.file_handled('a', '/a1')
+    with pytest.raises(JournalFailedError):
+        j.close()
+    assert not j._flusher.is_alive()
+
+
+def test_compact_keeps_state(tmpdir):
+    path = str(tmpdir.join('journal'))
+    j = Journal(path)
+    for i in range(10):
+        j.file_seen('done', '/d{0}'.format(i))
+        j.file_handled('done', '/d{0}'.format(i))
+    j.series_finished('done')
+    j.file_seen('a', '/a1')
+    j.file_seen('a', '/a2')
+    j.file_handled('a', '/a1')
+    j.compact(keep=lambda f: f != '/d3')
+    j.file_handled('a', '/a2')
+    j.close()
+    records = list(journal.read_records(path))
+    assert len(records) == 13
+    replayed = Journal(path)
+    replayed.close()
+    assert replayed.state.handled('a') == ['/a1', '/a2']
+    assert replayed.state.seen == j.state.seen
+    assert '/d3' not in replayed.state.seen
+
+
+class RecordingHandler(handlers.ThreadedDicomHandler):
+
+    def on_handle(self, dcm, filename):
+        self.manager.handled.append(filename)
+
+    def on_finish(self):
+        self.manager.finished.append(self.name)
+
+
+class RecordingManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
+    def __init__(self):
+        super(RecordingManager, self).__init__(0.05)
+        self.handled = []
+        self.finished = []
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return RecordingHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def make_series(tmpdir, series, count):
+    ds = dicom.read_file(sample_path('CT_small.dcm'))
+    ds.SeriesNumber = series
+    filenames = []
+    for i in range(count):
+        filename = str(tmpdir.join('s{0}_{1}.dcm'.format(series, i)))
+        ds.save_as(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_recover_resumes_where_it_left_off(tmpdir):
+    source = tmpdir.mkdir('source')
+    path = str(tmpdir.join('journal'))
+    done = make_series(source, 1, 2)
+    half = make_series(source, 2, 3)
+    all_handled = make_series(source, 3, 2)
+    write_records(path, [
+        (SEEN, '1', done[0]), (SEEN, '1', done[1]),
+        (HANDLED, '1', done[0]), (HANDLED, '1', done[1]),
+        (FINISHED, '1', None),
+        (SEEN, '2', half[0]), (SEEN, '2', half[1]),
+        (HANDLED, '2', half[0]),
+        (SEEN, '3', all_handled[0]),
+        (HANDLED, '3', all_handled[0]), (SEEN, '3', all_handled[1]),
+        (HANDLED, '3', all_handled[1])])
+    new = make_series(source, 4, 1)
+    source.join('README').write('not a dicom')
+    manager = RecordingManager()
+    j = Journal(path)
+    manager.recover(j, [str(source)])
+    manager.wait_for_handlers()
+    j.close()
+    assert sorted(manager.handled) == sorted(half[1:] + new)
+    assert sorted(manager.finished) == ['2', '3', '4']
+    replayed = Journal(path)
+    replayed.close()
+    assert not replayed.state.unfinished
+    assert str(source.join('README')) in replayed.state.seen
+
+
+class GatedHandler(handlers.PooledDicomHandler):
+
+    def __init__(self, *args):
+        super(GatedHandler, self).__init__(*args)
+        self.gate = threading.Event()
+
+    def on_finish(self):
+        self.gate.wait()
+
+
+class GatedManager(managers.PooledDicomManager):
+
+    def handler_key(self, obj):
+        return 'K'
+
+    def build_handler(self, dcm, filename):
+        return GatedHandler(self, 'K', self.timeout)
+
+
+def test_finishing_handler_leaves_its_successor_alone(tmpdir):
+    path = str(tmpdir.join('journal'))
+    j = Journal(path)
+    manager = GatedManager(0.05, workers=2, tick=0.01)
+    manager.journal = j
+    manager.handle_dicom('dcm', '/f1')
+    first = manager._series_handlers['K']
+    # Times out, and sits in on_finish
+    deadline = time.time() + 2
+    while 'K' in manager._series_handlers and time.time() < deadline:
+        time.sleep(0.01)
+    manager.handle_dicom('dcm', '/f2')
+    second = manager._series_handlers['K']
+    assert second is not first
+    first.gate.set()
+    first.join(2)
+    j.flush()
+    replayed = Journal(path)
+    replayed.close()
+    assert replayed.state.unfinished.keys() == [second.series_id]
+    assert replayed.state.handled(second.series_id) == ['/f2']
+    second.gate.set()
+    manager.stop()
+    j.close()
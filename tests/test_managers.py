@@ -4,7 +4,9 @@
 # Copyright 2014 Board of Regents of the University of Wisconsin System
 
 import pytest
-from yadda import managers
+from yadda import managers, handlers
+
+from mocks import sample_path
 
 
 class DummyManager(managers.ThreadedDicomManager):
@@ -30,7 +32,7 @@ class DummyHandler(object):
     def run(self):
         pass
 
-    def handle_dicom(self, dicom):
+    def handle_dicom(self, dicom, *args):
         self.handle_count += 1
 
     def join(self, seconds):
@@ -55,3 +57,162 @@ def test_manager_starts_and_stops():
 
     with pytest.raises(KeyError):
         handler = mgr._series_handlers['foo']
+
+
+class RoutingManager(DummyManager):
+    routing_keys = ('SeriesNumber',)
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return DummyHandler(self, self.handler_key(dcm), 0)
+
+
+def test_handle_file_uses_routing_read():
+    mgr = RoutingManager(0)
+    dcm = mgr.read_dicom(sample_path('CT_small.dcm'))
+    assert 'PixelData' not in dcm
+    mgr.handle_file(sample_path('CT_small.dcm'))
+    assert mgr._series_handlers['1'].handle_count == 1
+
+
+def test_handle_file_skips_non_dicoms():
+    mgr = RoutingManager(0)
+    mgr.handle_file(sample_path('README.txt'))
+    assert not mgr._series_handlers
+
+
+class PooledManager(managers.PooledDicomManager):
+
+    def handler_key(self, obj):
+        return obj[0]
+
+    def build_handler(self, dcm):
+        return PooledHandler(self, self.handler_key(dcm), self.timeout)
+
+
+class PooledHandler(handlers.PooledDicomHandler):
+    def __init__(self, manager, name, timeout):
+        super(PooledHandler, self).__init__(manager, name, timeout)
+        self.handled = []
+        self.finished = False
+
+    def on_handle(self, dcm):
+        self.handled.append(dcm)
+
+    def on_finish(self):
+        self.finished = True
+
+
+def test_pooled_manager_times_out_series():
+    mgr = PooledManager(0.05, workers=2, tick=0.01)
+    mgr.handle_dicom('a1')
+    mgr.handle_dicom('b1')
+    mgr.handle_dicom('a2')
+    a = mgr._series_handlers['a']
+    b = mgr._series_handlers['b']
+    mgr.wait_for_handlers()
+    assert not mgr._series_handlers
+    assert a.finished and b.finished
+    assert a.handled == ['a1', 'a2']
+    assert b.handled == ['b1']
+    mgr.handle_dicom('a3')
+    a_again = mgr._series_handlers['a']
+    assert a_again is not a
+    mgr.stop()
+    assert a_again.finished
+    assert a_again.handled == ['a3']
+    assert len(mgr.timers) == 0
+
+
+class AsyncManager(managers.AsyncDicomManager):
+    routing_keys = ('SeriesNumber',)
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return AsyncHandler(self, self.handler_key(dcm), self.timeout)
+
+
+class AsyncHandler(handlers.AsyncDicomHandler):
+    def __init__(self, manager, name, timeout):
+        super(AsyncHandler, self).__init__(manager, name, timeout)
+        self.handled = []
+        self.finished = False
+
+    def on_handle(self, dcm, filename):
+        self.handled.append(filename)
+
+    def on_finish(self):
+        self.finished = True
+
+
+def test_async_manager_handles_inotify_events(tmpdir):
+    from yadda.vendor import pyinotify
+
+    class Processor(pyinotify.ProcessEvent):
+        def my_init(self, manager):
+            self.manager = manager
+
+        def process_IN_CLOSE_WRITE(self, event):
+            self.manager.handle_file(event.pathname)
+
+    mgr = AsyncManager(0.05)
+    wm = pyinotify.WatchManager()
+    wm.add_watch(str(tmpdir), pyinotify.IN_CLOSE_WRITE)
+    mgr.watch(wm, Processor(manager=mgr))
+    dest = str(tmpdir.join('ct.dcm'))
+    with open(sample_path('CT_small.dcm'), 'rb') as src:
+        with open(dest, 'wb') as out:
+            out.write(src.read())
+    mgr.loop.run_until(lambda: mgr._series_handlers)
+    handler = mgr._series_handlers['1']
+    mgr.wait_for_handlers()
+    assert handler.finished
+    assert handler.handled == [dest]
+    mgr.stop()
+    mgr.loop.close()
+
+
+class ThreadedManager(managers.ThreadedDicomManager):
+    def handler_key(self, dcm):
+        return dcm[0]
+
+    def build_handler(self, dcm):
+        return ThreadedHandler(self, self.handler_key(dcm), self.timeout)
+
+
+class ThreadedHandler(handlers.ThreadedDicomHandler):
+    def on_start(self):
+        self.handled = []
+
+    def on_handle(self, dcm):
+        self.handled.append(dcm)
+
+
+def test_threaded_manager_replaces_finishing_handler():
+    mgr = ThreadedManager(10)
+    mgr.handle_dicom('a1')
+    first = mgr._series_handlers['a']
+    first.terminate()
+    mgr.handle_dicom('a2')
+    second = mgr._series_handlers['a']
+    assert second is not first
+    assert first.handled == ['a1']
+    mgr.stop()
+    assert second.handled == ['a2']
+
+
+def test_manager_stats():
+    mgr = ThreadedManager(10)
+    mgr.handle_dicom('a1')
+    stats = mgr.stats()
+    assert list(stats['active']) == ['a']
+    assert stats['active']['a']['name'] == 'a'
+    assert stats['finished'] == []
+    mgr.stop()
+    stats = mgr.stats()
+    assert stats['active'] == {}
+    assert [s['name'] for s in stats['finished']] == ['a']
@@ -0,0 +1,143 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import errno
+
+import pytest
+
+from yadda import materialize
+
+
+def source_file(tmpdir, data='dicom!'):
+    src = tmpdir.mkdir('src').join('1.dcm')
+    src.write(data)
+    return src
+
+
+def test_link_shares_the_inode(tmpdir):
+    src = source_file(tmpdir)
+    dest = tmpdir.mkdir('dest')
+    m = materialize.Materializer()
+    path = m.materialize(str(src), str(dest))
+    assert path == str(dest.join('1.dcm'))
+    assert m.strategy == 'link'
+    assert os.stat(path).st_ino == src.stat().ino
+
+
+@pytest.mark.parametrize('strategy', [
+    'reflink', 'copy_file_range', 'sendfile', 'copy'])
+def test_copying_strategies(tmpdir, strategy):
+    data = 'x' * 100000
+    src = source_file(tmpdir, data)
+    dest = tmpdir.mkdir('dest').join('out.dcm')
+    try:
+        getattr(materialize, strategy)(str(src), str(dest))
+    except EnvironmentError as e:
+        pytest.skip('{0} not supported here: {1}'.format(strategy, e))
+    assert dest.read() == data
+
+
+def test_rename_moves(tmpdir):
+    src = source_file(tmpdir)
+    dest = tmpdir.mkdir('dest')
+    materialize.Materializer('rename').materialize(str(src), str(dest))
+    assert not src.check()
+    assert dest.join('1.dcm').read() == 'dicom!'
+
+
+def test_falls_back_and_sticks(tmpdir, monkeypatch):
+    calls = []
+
+    def no_link(src, dest):
+        calls.append('link')
+        raise OSError(errno.EXDEV, 'Cross-device link')
+
+    def copy(src, dest):
+        calls.append('copy')
+        materialize.copy(src, dest)
+
+    monkeypatch.setitem(materialize.STRATEGIES, 'link', no_link)
+    monkeypatch.setitem(materialize.STRATEGIES, 'copy', copy)
+    src_dir = tmpdir.mkdir('src')
+    dest = tmpdir.mkdir('dest')
+    m = materialize.Materializer(('link', 'copy'))
+    for i in range(3):
+        f = src_dir.join('{0}.dcm'.format(i))
+        f.write(str(i))
+        m.materialize(str(f), str(dest))
+    assert calls == ['link', 'copy', 'copy', 'copy']
+    assert m.strategy == 'copy'
+    assert dest.join('2.dcm').read() == '2'
+
+
+def test_other_errors_only_skip_the_file(tmpdir, monkeypatch):
+    failures = [errno.ENOSPC]
+    calls = []
+
+    def flaky_link(src, dest):
+        calls.append('link')
+        if failures:
+            raise OSError(failures.pop(), 'No space left on device')
+        materialize.link(src, dest)
+
+    monkeypatch.setitem(materialize.STRATEGIES, 'link', flaky_link)
+    src_dir = tmpdir.mkdir('src')
+    dest = tmpdir.mkdir('dest')
+    m = materialize.Materializer(('link', 'copy'))
+    for i in range(2):
+        f = src_dir.join('{0}.dcm'.format(i))
+        f.write(str(i))
+        m.materialize(str(f), str(dest))
+    assert calls == ['link', 'link']
+    assert m.strategy == 'link'
+
+
+def test_existing_files_survive_failures(tmpdir, monkeypatch):
+    def broken(src, dest):
+        with open(dest, 'wb') as f:
+            f.write('par')
+        raise IOError(errno.EIO, 'Input/output error')
+
+    monkeypatch.setitem(materialize.STRATEGIES, 'broken', broken)
+    src = source_file(tmpdir, 'new')
+    dest = tmpdir.mkdir('dest')
+    dest.join('1.dcm').write('good')
+    with pytest.raises(EnvironmentError):
+        materialize.Materializer('broken').materialize(str(src), str(dest))
+    assert dest.join('1.dcm').read() == 'good'
+    assert dest.listdir() == [dest.join('1.dcm')]
+    # ... and are replaced once there's something to replace them with
+    m = materialize.Materializer(('broken', 'link'))
+    m.materialize(str(src), str(dest))
+    assert dest.join('1.dcm').read() == 'new'
+    assert dest.listdir() == [dest.join('1.dcm')]
+
+
+def test_rule_out_once_per_strategy():
+    m = materialize.Materializer(('link', 'reflink', 'copy'))
+    m._rule_out('link')
+    m._rule_out('link')
+    assert m._candidates == ['reflink', 'copy']
+
+
+def test_short_copy_raises(tmpdir):
+    src = source_file(tmpdir, 'x' * 1000)
+    dest = tmpdir.join('out.dcm')
+    with pytest.raises(EnvironmentError):
+        materialize._kernel_copy(
+            str(src), str(dest), lambda infd, outfd, n: 0)
+
+
+def test_last_strategy_failure_raises(tmpdir):
+    dest = tmpdir.mkdir('dest')
+    m = materialize.Materializer('copy')
+    with pytest.raises(EnvironmentError):
+        m.materialize(str(tmpdir.join('missing.dcm')), str(dest))
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        materialize.Materializer(('link', 'teleport'))
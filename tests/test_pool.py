@@ -0,0 +1,82 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import pytest
+import threading
+from yadda import pool
+
+
+def test_worker_pool_runs_tasks():
+    p = pool.WorkerPool(3)
+    p.start()
+    results = []
+    lock = threading.Lock()
+
+    def append(x):
+        with lock:
+            results.append(x)
+    for i in range(20):
+        p.submit(append, i)
+    p.stop()
+    assert sorted(results) == list(range(20))
+
+
+def test_worker_pool_survives_errors():
+    p = pool.WorkerPool(1)
+    p.start()
+    results = []
+
+    def fail():
+        raise ValueError("boom")
+    p.submit(fail)
+    p.submit(results.append, 1)
+    p.stop()
+    assert results == [1]
+
+
+def test_worker_pool_needs_workers():
+    with pytest.raises(ValueError):
+        pool.WorkerPool(0)
+
+
+def test_timer_wheel_fires_when_due():
+    wheel = pool.TimerWheel(tick=1, slots=4)
+    fired = []
+    wheel.schedule('a', 2.5, lambda: fired.append('a'))
+    wheel.advance(wheel._epoch + 2)
+    assert fired == []
+    wheel.advance(wheel._epoch + 3)
+    assert fired == ['a']
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_touch_pushes_deadline_back():
+    wheel = pool.TimerWheel(tick=1, slots=4)
+    fired = []
+    wheel.schedule('a', 1, lambda: fired.append('a'))
+    wheel._timers['a'][0] = wheel._epoch + 9  # as if touched later on
+    wheel.advance(wheel._epoch + 5)
+    assert fired == []
+    wheel.advance(wheel._epoch + 9)
+    assert fired == ['a']
+
+
+def test_timer_wheel_cancel():
+    wheel = pool.TimerWheel(tick=1, slots=4)
+    fired = []
+    wheel.schedule('a', 1, lambda: fired.append('a'))
+    assert wheel.cancel('a')
+    assert not wheel.touch('a', 1)
+    wheel.advance(wheel._epoch + 5)
+    assert fired == []
+
+
+def test_timer_wheel_thread():
+    wheel = pool.TimerWheel(tick=0.01)
+    done = threading.Event()
+    wheel.start()
+    wheel.schedule('a', 0.02, done.set)
+    assert done.wait(2)
+    wheel.stop()
@@ -0,0 +1,60 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import pytest
+import dicom
+from dicom.filereader import InvalidDicomError
+from yadda import readers
+
+from mocks import sample_path
+
+ROUTING_KEYS = ('StudyDate', 'StudyID', 'SeriesNumber')
+
+
+def test_key_spec_finds_largest_tag():
+    spec = readers.RoutingKeySpec(ROUTING_KEYS)
+    assert spec.max_tag == 0x00200011  # SeriesNumber
+    assert not spec.stop_when(dicom.tag.Tag(0x00200011), 'IS', 2)
+    assert spec.stop_when(dicom.tag.Tag(0x00200012), 'IS', 2)
+
+
+def test_key_spec_rejects_unknown_keyword():
+    with pytest.raises(ValueError):
+        readers.RoutingKeySpec(['NotAKeyword'])
+
+
+def test_routing_header_matches_full_read():
+    filename = sample_path('CT_small.dcm')
+    full = dicom.read_file(filename)
+    header = readers.read_routing_header(filename, ROUTING_KEYS)
+    for key in ROUTING_KEYS:
+        assert getattr(header, key) == getattr(full, key)
+    assert header.file_meta.TransferSyntaxUID == \
+        full.file_meta.TransferSyntaxUID
+    assert 'PixelData' not in header
+    assert max(header.keys()) <= 0x00200011
+
+
+def test_routing_header_implicit_vr():
+    filename = sample_path('rtplan.dcm')
+    header = readers.read_routing_header(filename, ['SeriesNumber'])
+    assert header.SeriesNumber == dicom.read_file(filename).SeriesNumber
+
+
+def test_read_dicom_without_spec_reads_everything():
+    dcm = readers.read_dicom(sample_path('CT_small.dcm'))
+    assert 'PixelData' in dcm
+
+
+def test_read_dicom_memory_map():
+    filename = sample_path('CT_small.dcm')
+    dcm = readers.read_dicom(filename, memory_map=True)
+    assert isinstance(dcm.PixelData, memoryview)
+    assert dcm.PixelData.tobytes() == dicom.read_file(filename).PixelData
+
+
+def test_routing_header_rejects_non_dicoms():
+    with pytest.raises(InvalidDicomError):
+        readers.read_routing_header(sample_path('README.txt'), ROUTING_KEYS)
@@ -0,0 +1,132 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import time
+import threading
+
+from dicom.dataset import Dataset
+from yadda import managers, handlers
+from yadda.registry import SeriesRegistry
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(i,))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_each_key_is_created_once():
+    registry = SeriesRegistry(stripes=4)
+    created = []
+
+    def create(key):
+        created.append(key)
+        # Give other threads every chance to race us
+        time.sleep(0.001)
+        return object()
+
+    def use(i):
+        for key in range(20):
+            registry.get_or_create(key, lambda: create(key))
+    run_threads(8, use)
+    assert sorted(created) == range(20)
+    assert len(registry) == 20
+
+
+def test_discard_only_removes_the_same_handler():
+    registry = SeriesRegistry()
+    old, new = object(), object()
+    registry.add('a', old)
+    assert registry.discard('a', old)
+    registry.add('a', new)
+    assert not registry.discard('a', old)
+    assert registry['a'] is new
+
+
+def test_closed_registry_creates_nothing():
+    registry = SeriesRegistry()
+    registry.add('a', 1)
+    assert registry.close() == [1]
+    assert registry.get_or_create('a', lambda: 2) == (1, False)
+    assert registry.get_or_create('b', lambda: 2) == (None, False)
+    assert 'b' not in registry
+
+
+class CountingHandler(handlers.ThreadedDicomHandler):
+    def on_handle(self, dcm, filename):
+        self.manager.handled.append(filename)
+
+
+class CountingManager(managers.ThreadedDicomManager):
+    def __init__(self, timeout):
+        super(CountingManager, self).__init__(timeout)
+        self.handled = []
+        self.built = []
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        self.built.append(self.handler_key(dcm))
+        return CountingHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def test_many_producers_one_manager():
+    manager = CountingManager(60)
+    datasets = []
+    for number in range(10):
+        ds = Dataset()
+        ds.SeriesNumber = number
+        datasets.append(ds)
+
+    def feed(i):
+        for j in range(100):
+            manager.handle_dicom(
+                datasets[(i + j) % 10], '{0}-{1}'.format(i, j))
+    run_threads(8, feed)
+    manager.stop()
+    manager.wait()
+    assert sorted(manager.built) == [str(i) for i in range(10)]
+    assert len(manager.handled) == len(set(manager.handled)) == 800
+    assert not manager._series_handlers
+    manager.handle_dicom(datasets[0], 'late')
+    assert not manager._series_handlers
+
+
+def test_wait_until_empty():
+    registry = SeriesRegistry()
+    assert registry.wait_until_empty(0)
+    handler = object()
+    registry.add('a', handler)
+    assert not registry.wait_until_empty(0.01)
+    timer = threading.Timer(0.05, registry.discard, ('a', handler))
+    timer.start()
+    assert registry.wait_until_empty(5)
+    timer.join()
+
+
+class SlowHandler(CountingHandler):
+    def on_finish(self):
+        time.sleep(0.2)
+        self.manager.handled.append('finished')
+
+
+class SlowManager(CountingManager):
+    def build_handler(self, dcm, filename):
+        return SlowHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def test_wait_for_handlers_waits_for_slow_ones():
+    manager = SlowManager(0.01)
+    ds = Dataset()
+    ds.SeriesNumber = 1
+    manager.handle_dicom(ds, 'a')
+    manager.wait_for_handlers()
+    assert manager.handled == ['a', 'finished']
+    assert not manager._series_handlers
+    manager.stop()
@@ -0,0 +1,114 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import threading
+
+from dicom.dataset import Dataset
+from yadda import managers, handlers
+from yadda.scheduling import (
+    Priorities, FairScheduler, URGENT, NORMAL, BULK)
+
+
+def dataset(**values):
+    ds = Dataset()
+    for keyword, value in values.items():
+        setattr(ds, keyword, value)
+    return ds
+
+
+def test_first_matching_rule_wins():
+    priorities = Priorities([
+        (URGENT, {'SeriesDescription': '*localizer*'}),
+        (BULK, {'Modality': 'MR', 'SeriesDescription': '*dti*'}),
+        (URGENT, {'StationName': 'ER*'}),
+    ])
+    assert priorities.keys == ('SeriesDescription', 'Modality', 'StationName')
+    assert priorities.priority_for(
+        dataset(SeriesDescription='3-plane LOCALIZER')) == URGENT
+    assert priorities.priority_for(
+        dataset(Modality='MR', SeriesDescription='DTI 64dir')) == BULK
+    assert priorities.priority_for(
+        dataset(Modality='CT', SeriesDescription='DTI 64dir')) == NORMAL
+    assert priorities.priority_for(dataset(StationName='ER_CT1')) == URGENT
+    assert priorities.priority_for(dataset()) == NORMAL
+
+
+def drain(scheduler):
+    got = []
+    scheduler.close()
+    while True:
+        task = scheduler.get()
+        if task is None:
+            return got
+        got.append(task)
+
+
+def test_priorities_go_first():
+    scheduler = FairScheduler()
+    for i in range(3):
+        scheduler.put(('bulk', i), BULK)
+        scheduler.put(('normal', i))
+    scheduler.put(('urgent', 0), URGENT)
+    assert drain(scheduler) == [
+        ('urgent', 0), ('normal', 0), ('normal', 1), ('normal', 2),
+        ('bulk', 0), ('bulk', 1), ('bulk', 2)]
+
+
+def test_sources_share_by_weight():
+    scheduler = FairScheduler(weights={'a': 2})
+    for i in range(10):
+        scheduler.put(('a', i), source='a')
+    for i in range(3):
+        scheduler.put(('b', i), source='b')
+    got = drain(scheduler)
+    assert [source for source, i in got[:9]].count('a') == 6
+    # Each source's tasks stay in order
+    assert [i for source, i in got if source == 'a'] == range(10)
+    stats = FairScheduler().stats()
+    assert stats == {'queued': 0, 'priorities': {}, 'sources': {}}
+    assert scheduler.stats()['sources']['b']['tasks'] == 3
+
+
+class OrderHandler(handlers.PooledDicomHandler):
+    def on_handle(self, dcm, filename):
+        self.manager.gate.wait()
+        self.manager.handled.append(self.name)
+
+
+class FairManager(managers.PooledDicomManager):
+    routing_keys = ('SeriesNumber',)
+    fair_scheduling = True
+    priority_rules = ((URGENT, {'SeriesDescription': '*localizer*'}),)
+
+    def __init__(self, *args, **kwargs):
+        super(FairManager, self).__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.handled = []
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return OrderHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def test_urgent_series_jump_the_queue():
+    manager = FairManager(30, workers=1)
+    try:
+        assert 'SeriesDescription' in manager.routing_spec.keys
+        for i in range(20):
+            manager.handle_dicom(
+                dataset(SeriesNumber=1, SeriesDescription='DTI'), str(i))
+        manager.handle_dicom(
+            dataset(SeriesNumber=2, SeriesDescription='Localizer'), 'loc')
+        assert manager._series_handlers['2'].priority == URGENT
+    finally:
+        manager.gate.set()
+        manager.stop()
+    # The worker was stuck on the first DTI dicom; the localizer's next
+    assert manager.handled.index('2') <= 1
+    stats = manager.stats()['scheduler']
+    assert stats['priorities'][URGENT]['tasks'] == 3
+    assert '//' in stats['sources']
@@ -0,0 +1,96 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import time
+import signal
+from collections import defaultdict
+
+import pytest
+
+import dicom
+from yadda import managers, handlers
+from yadda.sharding import ShardedDicomManager, ShardDiedError, shard_for
+
+from mocks import sample_path
+
+
+def test_shard_for_is_stable():
+    assert shard_for('1.2.3', 16) == shard_for('1.2.3', 16)
+    assert 0 <= shard_for(('a', 1), 3) < 3
+    assert len(set(shard_for(str(i), 4) for i in range(100))) == 4
+
+
+class LoggingHandler(handlers.ThreadedDicomHandler):
+
+    def on_handle(self, dcm, filename):
+        with open(self.manager.log, 'a') as f:
+            f.write('{0} {1} {2}\n'.format(os.getpid(), self.name, filename))
+
+
+class LoggingManager(managers.ThreadedDicomManager):
+    routing_keys = ('SeriesNumber',)
+
+    def __init__(self, log):
+        super(LoggingManager, self).__init__(0.05)
+        self.log = log
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return LoggingHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def test_series_stay_in_one_shard(tmpdir):
+    ds = dicom.read_file(sample_path('CT_small.dcm'))
+    filenames = []
+    for i in range(24):
+        ds.SeriesNumber = i % 6
+        filename = str(tmpdir.join('im{0}.dcm'.format(i)))
+        ds.save_as(filename)
+        filenames.append(filename)
+    tmpdir.join('README').write('not a dicom')
+    log = str(tmpdir.join('log'))
+    sharded = ShardedDicomManager(lambda: LoggingManager(log), shards=3)
+    sharded.start()
+    for filename in filenames + [str(tmpdir.join('README'))]:
+        sharded.handle_file(filename)
+    sharded.stop()
+    handled = [line.split() for line in open(log)]
+    assert sorted(filename for pid, key, filename in handled) == \
+        sorted(filenames)
+    pids = defaultdict(set)
+    for pid, key, filename in handled:
+        pids[key].add(pid)
+    assert sorted(pids) == [str(i) for i in range(6)]
+    assert all(len(p) == 1 for p in pids.values())
+    assert len(set.union(*pids.values())) > 1
+
+
+def test_dead_shards_are_reported(tmpdir):
+    log = str(tmpdir.join('log'))
+    sharded = ShardedDicomManager(lambda: LoggingManager(log), shards=2)
+    sharded.poll_interval = 0.05
+    sharded.start()
+    victim = sharded._processes[shard_for('a', 2)]
+    os.kill(victim.pid, signal.SIGKILL)
+    victim.join()
+    with pytest.raises(ShardDiedError):
+        sharded.handle_file('a')
+    started = time.time()
+    with pytest.raises(ShardDiedError):
+        sharded.stop()
+    assert time.time() - started < 5
+    assert not sharded._processes
+
+
+def test_async_managers_are_refused():
+    sharded = ShardedDicomManager(
+        lambda: managers.AsyncDicomManager(1), shards=1)
+    sharded.poll_interval = 0.05
+    sharded.start()
+    with pytest.raises(ShardDiedError):
+        sharded.stop()
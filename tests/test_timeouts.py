@@ -0,0 +1,118 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import random
+
+from dicom.dataset import Dataset
+from yadda import managers, handlers
+from yadda.timeouts import P2Quantile, AdaptiveTimeouts
+
+
+def test_p2_tracks_quantiles():
+    rand = random.Random(42)
+    values = [rand.expovariate(1.0) for i in range(20000)]
+    for p in (0.5, 0.9, 0.99):
+        sketch = P2Quantile(p)
+        for value in values:
+            sketch.add(value)
+        exact = sorted(values)[int(p * len(values))]
+        assert abs(sketch.value() - exact) / exact < 0.05
+
+
+def test_p2_with_few_values():
+    sketch = P2Quantile(0.5)
+    assert sketch.value() is None
+    for value in (3, 1, 2):
+        sketch.add(value)
+    assert sketch.value() == 2
+
+
+def test_timeouts_follow_each_source():
+    timeouts = AdaptiveTimeouts(
+        30, min_timeout=1.0, max_timeout=120.0, min_samples=10)
+    for i in range(9):
+        timeouts.observe('ct', 0.01)
+    assert timeouts.timeout_for('ct') == 30
+    timeouts.observe('ct', 0.01)
+    assert timeouts.timeout_for('ct') == 1.0
+    for i in range(100):
+        timeouts.observe('fmri', 2.0)
+    assert timeouts.timeout_for('fmri') == 6.0
+    for i in range(100):
+        timeouts.observe('slow', 100.0)
+    assert timeouts.timeout_for('slow') == 120.0
+    assert timeouts.timeout_for('unknown') == 30
+    assert timeouts.stats()['fmri']['gaps'] == 100
+
+
+class StubHandler(handlers.PooledDicomHandler):
+    pass
+
+
+class AdaptiveManager(managers.PooledDicomManager):
+    routing_keys = ('SeriesNumber',)
+    adaptive_timeouts = True
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm, filename):
+        return StubHandler(self, self.handler_key(dcm), self.timeout)
+
+
+def test_manager_sets_handler_timeouts():
+    manager = AdaptiveManager(30)
+    try:
+        assert 'StationName' in manager.routing_spec.keys
+        for i in range(12):
+            ds = Dataset()
+            ds.SeriesNumber = 1
+            ds.StationName = 'CT1'
+            manager.handle_dicom(ds, 'f{0}'.format(i))
+        handler = manager._series_handlers['1']
+        assert handler.timeout == manager.min_timeout
+        stats = manager.stats()['timeouts']
+        assert stats['/CT1/']['gaps'] == 11
+    finally:
+        manager.stop()
+
+
+class ClosingHandler(object):
+    timeout = None
+
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.name = name
+        self.closed = False
+
+    def start(self):
+        pass
+
+    def handle_dicom(self, dcm, *args):
+        if self.closed:
+            raise handlers.HandlerClosedError(self.name)
+
+    def join(self, timeout=None):
+        self.manager.remove_handler(self)
+
+
+class ThreadedAdaptiveManager(managers.ThreadedDicomManager):
+    adaptive_timeouts = True
+
+    def handler_key(self, dcm):
+        return str(dcm.SeriesNumber)
+
+    def build_handler(self, dcm):
+        return ClosingHandler(self, self.handler_key(dcm))
+
+
+def test_closing_handlers_record_no_gap():
+    manager = ThreadedAdaptiveManager(30)
+    ds = Dataset()
+    ds.SeriesNumber = 1
+    manager.handle_dicom(ds)
+    manager._series_handlers['1'].closed = True
+    manager.handle_dicom(ds)
+    assert manager.timeouts.stats() == {}
@@ -0,0 +1,152 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import threading
+from yadda import transports, ftp
+
+from mocks import FakeFTPServer
+
+
+class RecordingTransport(transports.Transport):
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def open_series(self, name):
+        self.events.append(('open', name))
+
+    def send_batch(self, name, filenames):
+        with self.lock:
+            self.events.append(('send', name, tuple(filenames)))
+        return 10 * len(filenames)
+
+    def close_series(self, name):
+        self.events.append(('close', name))
+
+    def fail_series(self, name):
+        self.events.append(('fail', name))
+
+
+def sent_files(transport):
+    return [f for e in transport.events if e[0] == 'send' for f in e[2]]
+
+
+def test_delivery_batches_by_size():
+    transport = RecordingTransport()
+    delivery = transports.Delivery(
+        transport, workers=2, batch_size=4, batch_window=10)
+    series = delivery.open('s')
+    for i in range(8):
+        series.add(str(i))
+    series.close()
+    delivery.stop()
+    sends = [e for e in transport.events if e[0] == 'send']
+    assert len(sends) == 2
+    assert sorted(sent_files(transport)) == [str(i) for i in range(8)]
+    assert transport.events[0] == ('open', 's')
+    assert transport.events[-1] == ('close', 's')
+    stats = series.stats.snapshot()
+    assert stats['files'] == 8
+    assert stats['bytes'] == 80
+    assert stats['batches'] == 2
+    assert stats['queued'] == 0 and stats['in_flight'] == 0
+    assert stats['finished']
+    assert delivery.finished[-1] is series.stats
+
+
+def test_delivery_flushes_after_window():
+    transport = RecordingTransport()
+    delivery = transports.Delivery(
+        transport, workers=1, batch_size=100, batch_window=0.01)
+    series = delivery.open('s')
+    series.add('a')
+    series.add('b')
+    done = threading.Event()
+    for i in range(200):
+        if sent_files(transport):
+            break
+        done.wait(0.01)
+    assert sent_files(transport) == ['a', 'b']
+    series.close()
+    delivery.stop()
+
+
+def test_delivery_counts_errors():
+    class FailingTransport(RecordingTransport):
+        def send_batch(self, name, filenames):
+            raise IOError("nope")
+    delivery = transports.Delivery(FailingTransport(), batch_size=1)
+    series = delivery.open('s')
+    series.add('a')
+    series.close()
+    delivery.stop()
+    stats = series.stats.snapshot()
+    assert stats['errors'] == 1
+    assert stats['files'] == 0
+    assert delivery.transport.events[-1] == ('fail', 's')
+
+
+def test_failed_local_series_isnt_published(tmpdir):
+    dest = tmpdir.mkdir('dest')
+    transport = transports.LocalCopyTransport(str(dest))
+    delivery = transports.Delivery(transport, batch_size=1)
+    # The same series failing twice keeps both failures
+    for i in range(2):
+        series = delivery.open('s')
+        series.add(str(tmpdir.join('missing.dcm')))
+        series.close()
+    delivery.stop()
+    assert not dest.join('s').check()
+    assert not dest.join('.s').check()
+    assert len(dest.listdir('.s.failed-*')) == 2
+
+
+def test_failed_ftp_series_isnt_published():
+    server = FakeFTPServer()
+    server.dirs.add('incoming')
+    connections = ftp.FTPConnectionPool(
+        'localhost', base_dir='incoming', ftp_factory=server.client)
+    transport = transports.FTPTransport(connections)
+    for i in range(2):
+        transport.open_series('s')
+        transport.fail_series('s')
+    transport.close()
+    assert 'incoming/.s' not in server.dirs
+    assert len([d for d in server.dirs
+                if d.startswith('incoming/.s.failed-')]) == 2
+
+
+def test_local_copy_transport(tmpdir):
+    src = tmpdir.mkdir('src')
+    dest = tmpdir.mkdir('dest')
+    f = src.join('1.dcm')
+    f.write('dicom!')
+    transport = transports.LocalCopyTransport(str(dest))
+    transport.open_series('s')
+    assert dest.join('.s').check(dir=1)
+    assert transport.send_batch('s', [str(f)]) == 6
+    transport.close_series('s')
+    assert dest.join('s', '1.dcm').read() == 'dicom!'
+
+
+def test_ftp_transport(tmpdir):
+    server = FakeFTPServer()
+    server.dirs.add('incoming')
+    connections = ftp.FTPConnectionPool(
+        'localhost', base_dir='incoming', ftp_factory=server.client)
+    delivery = transports.Delivery(
+        transports.FTPTransport(connections), workers=2, batch_size=3)
+    series = delivery.open('s')
+    for i in range(7):
+        f = tmpdir.join('{0}.dcm'.format(i))
+        f.write('x')
+        series.add(str(f))
+    series.close()
+    delivery.stop()
+    assert len(server.files) == 7
+    assert 'incoming/s/6.dcm' in server.files
+    assert 'incoming/.s' not in server.dirs
+    assert server.open_sessions == 0
@@ -0,0 +1,158 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+import os
+import time
+import shutil
+import threading
+
+import pytest
+from yadda.vendor import pyinotify
+from yadda.watcher import FileWatcher, WATCH_MASK
+
+from mocks import sample_path
+
+
+def event(mask, pathname, is_dir=False):
+    return pyinotify.Event({
+        'wd': 1, 'mask': mask, 'cookie': 0, 'name': os.path.basename(pathname),
+        'path': os.path.dirname(pathname), 'pathname': pathname,
+        'dir': is_dir})
+
+
+@pytest.fixture
+def watcher(request):
+    seen = []
+    w = FileWatcher(callback=seen.append, settle=0.2, tick=0.02)
+    w.seen = seen
+    request.addfinalizer(w.stop)
+    return w
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_events_coalesce_until_close(watcher):
+    watcher(event(pyinotify.IN_CREATE, '/in/a'))
+    for i in range(5):
+        watcher(event(pyinotify.IN_MODIFY, '/in/a'))
+    assert watcher.seen == []
+    assert watcher.pending == 1
+    watcher(event(pyinotify.IN_CLOSE_WRITE, '/in/a'))
+    watcher(event(pyinotify.IN_MOVED_TO, '/in/b'))
+    watcher(event(pyinotify.IN_CREATE, '/in/sub', is_dir=True))
+    assert watcher.seen == ['/in/a', '/in/b']
+    time.sleep(0.3)
+    assert watcher.seen == ['/in/a', '/in/b']
+    assert watcher.stats()['events'] == 9
+
+
+def test_unclosed_files_settle(watcher):
+    watcher(event(pyinotify.IN_CREATE, '/in/linked'))
+    watcher(event(pyinotify.IN_CREATE, '/in/deleted'))
+    watcher(event(pyinotify.IN_DELETE, '/in/deleted'))
+    assert wait_for(lambda: watcher.seen)
+    time.sleep(0.1)
+    assert watcher.seen == ['/in/linked']
+    assert watcher.settled == 1
+    assert watcher.pending == 0
+
+
+def test_callback_errors_are_counted():
+    def fail(path):
+        raise ValueError(path)
+    w = FileWatcher(callback=fail)
+    try:
+        w(event(pyinotify.IN_CLOSE_WRITE, '/in/a'))
+        assert w.errors == 1
+    finally:
+        w.stop()
+
+
+def test_reads_each_written_file_once(tmpdir, watcher):
+    wm = pyinotify.WatchManager()
+    notifier = pyinotify.ThreadedNotifier(wm, watcher)
+    wm.add_watch(str(tmpdir), WATCH_MASK, rec=True, auto_add=True)
+    notifier.start()
+    try:
+        data = open(sample_path('CT_small.dcm'), 'rb').read()
+        written = str(tmpdir.join('written.dcm'))
+        with open(written, 'wb') as f:
+            for i in range(0, len(data), 1024):
+                f.write(data[i:i + 1024])
+                f.flush()
+        moved = str(tmpdir.join('moved.dcm'))
+        shutil.copy(sample_path('CT_small.dcm'), str(tmpdir.join('.tmp')))
+        os.rename(str(tmpdir.join('.tmp')), moved)
+        assert wait_for(lambda: len(watcher.seen) >= 3)
+    finally:
+        notifier.stop()
+    assert sorted(watcher.seen) == sorted(
+        [written, str(tmpdir.join('.tmp')), moved])
+    assert watcher.events > len(watcher.seen)
+
+
+def test_overflow_rescans_what_changed(tmpdir, watcher):
+    tmpdir.join('before').write('there before we started')
+    wm = pyinotify.WatchManager()
+    watcher.watch(wm, str(tmpdir))
+    time.sleep(0.05)
+    tmpdir.join('handled').write('x')
+    watcher(event(pyinotify.IN_CLOSE_WRITE, str(tmpdir.join('handled'))))
+    # Events for these got dropped
+    time.sleep(0.05)
+    tmpdir.join('missed').write('x')
+    tmpdir.mkdir('sub').join('missed').write('x')
+    watcher(pyinotify.Event({'mask': pyinotify.IN_Q_OVERFLOW}))
+    assert wait_for(lambda: len(watcher.seen) == 3)
+    assert watcher.seen[0] == str(tmpdir.join('handled'))
+    assert sorted(watcher.seen[1:]) == [
+        str(tmpdir.join('missed')), str(tmpdir.join('sub', 'missed'))]
+    assert wait_for(lambda: watcher.rescans == 1)
+    assert (watcher.overflows, watcher.rescanned) == (1, 2)
+    assert wm.get_wd(str(tmpdir.join('sub'))) is not None
+    assert watcher.rescan() == 0
+
+
+def test_rescan_goes_by_marks_from_the_overflow(tmpdir, watcher):
+    wm = pyinotify.WatchManager()
+    watcher.watch(wm, str(tmpdir))
+    time.sleep(0.05)
+    tmpdir.join('missed').write('x')
+    # What process_IN_Q_OVERFLOW takes before any later event
+    with watcher._lock:
+        marks = watcher._snapshot_marks()
+    time.sleep(0.05)
+    tmpdir.join('later').write('x')
+    watcher(event(pyinotify.IN_CLOSE_WRITE, str(tmpdir.join('later'))))
+    assert watcher.rescan(marks) == 1
+    # It's new enough that it's left to settle
+    assert wait_for(lambda: len(watcher.seen) == 2)
+    assert watcher.seen == [
+        str(tmpdir.join('later')), str(tmpdir.join('missed'))]
+
+
+def test_slow_callbacks_dont_hold_up_settling():
+    gate = threading.Event()
+    seen = []
+
+    def callback(path):
+        if path == '/in/slow':
+            gate.wait(5)
+        seen.append(path)
+    w = FileWatcher(callback=callback, settle=0.05, tick=0.01)
+    try:
+        w(event(pyinotify.IN_CREATE, '/in/slow'))
+        time.sleep(0.1)
+        w(event(pyinotify.IN_CREATE, '/in/fast'))
+        assert wait_for(lambda: seen == ['/in/fast'])
+    finally:
+        gate.set()
+        w.stop()
+    assert seen == ['/in/fast', '/in/slow']
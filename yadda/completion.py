@@ -0,0 +1,220 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Telling when a series is complete, so handlers needn't sit out their whole
+idle timeout before finishing.
+
+Headers often say how many instances a series will have: ImagesInAcquisition,
+or NumberOfTemporalPositions times NumberOfSlices. A SeriesCompletion
+keeps a bitmap of the InstanceNumbers it's been handed, and calls the series
+complete once it holds every number from 1 to the expected count. If an
+instance shows up that doesn't fit (an InstanceNumber past the count, one
+it's already seen, or none at all), it stops predicting, and the idle
+timeout decides as it always has. Without an expected count, numbers past
+MAX_INSTANCES count as not fitting, so the bitmap stays small.
+
+ImagesInAcquisition counts one acquisition, and a series can have several:
+their instances usually run on past the first acquisition's count. So a
+count from it isn't trusted once an AcquisitionNumber past 1, or a second
+AcquisitionNumber, shows up, and a series completed by it is only called
+done after acquisition_grace more seconds with nothing else arriving; an
+instance that arrives in that time doesn't fit, and we stop predicting.
+
+Optionally, an InstanceCountLearner can supply a count for series whose
+headers don't give one, from what earlier series of the same protocol on
+the same station turned out to have. That's a guess rather than a proof,
+so it's off unless a manager asks for it.
+
+Managers turn all this on with predict_completion; see ThreadedDicomManager.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# What a routing read needs to include for completion to work
+COMPLETION_KEYS = (
+    'InstanceNumber', 'ImagesInAcquisition', 'AcquisitionNumber',
+    'NumberOfTemporalPositions', 'NumberOfSlices')
+# ... and for learned counts
+PROTOCOL_KEYS = ('StationName', 'SeriesDescription', 'ProtocolName')
+
+# The largest InstanceNumber we'll keep track of when headers don't say
+#   how many to expect; that's a 12.5 kB bitmap
+MAX_INSTANCES = 100000
+
+# How long a series completed by its ImagesInAcquisition count waits for
+#   another acquisition
+ACQUISITION_GRACE = 2.0
+
+
+def _int_value(dcm, keyword):
+    try:
+        return int(dcm.get(keyword))
+    except (TypeError, ValueError):
+        return None
+
+
+def expected_instances(dcm):
+    """
+    How many instances dcm's header says its series has, or None if it
+    doesn't say.
+    """
+    images = _int_value(dcm, 'ImagesInAcquisition')
+    if images > 0:
+        return images
+    positions = _int_value(dcm, 'NumberOfTemporalPositions')
+    slices = _int_value(dcm, 'NumberOfSlices')
+    if positions > 0 and slices > 0:
+        return positions * slices
+    return None
+
+
+def protocol_key(dcm):
+    return tuple(str(dcm.get(keyword, '')) for keyword in PROTOCOL_KEYS)
+
+
+class InstanceBitmap(object):
+    """ A set of small positive ints, one bit each. """
+
+    def __init__(self):
+        self._bits = bytearray()
+        self.count = 0
+        self.max = 0
+
+    def add(self, number):
+        """ Add number; returns False if it was already there. """
+        byte, bit = divmod(number, 8)
+        if byte >= len(self._bits):
+            self._bits.extend(bytearray(byte + 1 - len(self._bits)))
+        mask = 1 << bit
+        if self._bits[byte] & mask:
+            return False
+        self._bits[byte] |= mask
+        self.count += 1
+        if number > self.max:
+            self.max = number
+        return True
+
+    def __contains__(self, number):
+        byte, bit = divmod(number, 8)
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return self.count
+
+
+class SeriesCompletion(object):
+    """
+    Tracks one series' instances; add() says when they're all here.
+    Once it's complete, handlers should finish if nothing more arrives in
+    grace seconds.
+    """
+
+    def __init__(self, learner=None, acquisition_grace=ACQUISITION_GRACE):
+        self.learner = learner
+        self.acquisition_grace = acquisition_grace
+        self.grace = 0
+        self.expected = None
+        # 'header' or 'learned', once we have an expected count
+        self.source = None
+        # Whether the count is ImagesInAcquisition, and for which
+        #   AcquisitionNumber
+        self.per_acquisition = False
+        self.acquisition = None
+        self.instances = InstanceBitmap()
+        self.complete = False
+        # Set when an instance doesn't fit, and we stop predicting
+        self.confused = False
+        self.protocol = None
+
+    def add(self, dcm):
+        """ Count dcm; returns True if the series is now complete. """
+        if self.confused:
+            return False
+        if self.expected is None and not self.instances:
+            self._expect(dcm)
+        number = _int_value(dcm, 'InstanceNumber')
+        limit = self.expected
+        if limit is None:
+            limit = MAX_INSTANCES
+        if self.per_acquisition and (
+                self.acquisition > 1 or
+                _int_value(dcm, 'AcquisitionNumber') != self.acquisition):
+            self._confuse("More than one acquisition")
+        elif number is None or number < 1:
+            self._confuse("No usable InstanceNumber")
+        elif number > limit:
+            self._confuse("Instance {0} is past {1}".format(number, limit))
+        elif not self.instances.add(number):
+            self._confuse("Instance {0} came twice".format(number))
+        else:
+            # Every number is in 1..expected and there are expected of
+            # them, so they're all here
+            self.complete = (
+                self.expected is not None and
+                len(self.instances) == self.expected)
+        return self.complete
+
+    def _confuse(self, why):
+        logger.debug("{0}; not predicting completion".format(why))
+        self.confused = True
+        self.complete = False
+
+    def _expect(self, dcm):
+        self.expected = expected_instances(dcm)
+        if _int_value(dcm, 'ImagesInAcquisition') > 0:
+            self.per_acquisition = True
+            self.grace = self.acquisition_grace
+            self.acquisition = _int_value(dcm, 'AcquisitionNumber')
+        if self.expected is not None:
+            self.source = 'header'
+        elif self.learner is not None:
+            self.protocol = protocol_key(dcm)
+            self.expected = self.learner.expected(self.protocol)
+            if self.expected is not None:
+                self.source = 'learned'
+
+    def stats(self):
+        return {
+            'instances': len(self.instances),
+            'expected': self.expected,
+            'expected_from': self.source,
+            'complete': self.complete,
+        }
+
+
+class InstanceCountLearner(object):
+    """
+    Remembers how many instances finished series had, per protocol (see
+    protocol_key()), and offers a count once the last `agree` series of a
+    protocol all had the same one. Only series whose instances ran
+    1..n without gaps count.
+    """
+
+    def __init__(self, agree=2, max_protocols=1000):
+        self.agree = agree
+        self.max_protocols = max_protocols
+        self._counts = {}
+
+    def series_finished(self, completion):
+        if completion.protocol is None or completion.source == 'header':
+            return
+        instances = completion.instances
+        if completion.confused or not instances or \
+                len(instances) != instances.max:
+            return
+        if len(self._counts) >= self.max_protocols:
+            self._counts.clear()
+        recent = self._counts.setdefault(completion.protocol, [])
+        recent.append(len(instances))
+        del recent[:-self.agree]
+
+    def expected(self, protocol):
+        recent = self._counts.get(protocol)
+        if recent and len(recent) == self.agree and len(set(recent)) == 1:
+            return recent[0]
+        return None
@@ -0,0 +1,147 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Skipping files we've just handled.
+
+inotify tells us about a file more than once (IN_CREATE, IN_CLOSE_WRITE,
+IN_MOVED_TO all go to handle_file()), and scanners and PACS like to send
+the same instance again. A Deduplicator in front of a manager's
+handle_file() drops the repeats before they're parsed or sent anywhere:
+first by (path, size, mtime), which costs one stat(), then, optionally,
+by SOPInstanceUID once the header's been read.
+
+Checking a file marks it seen, so two events for it at once can't both
+get through; if it then can't be handled, forget_file() and
+forget_dicom() unmark it, so a retry isn't skipped.
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class RecentKeys(object):
+    """
+    A bounded set of recently seen keys. Keys are forgotten max_age
+    seconds after they were last seen, and the least recently seen go
+    first once there are more than max_entries. Thread-safe.
+    """
+
+    def __init__(self, max_entries=10000, max_age=600.0, clock=time.time):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        # key -> when it was last seen, oldest first
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """
+        Remember key. Returns True if it's new, False if we'd seen it in
+        the last max_age seconds.
+        """
+        now = self.clock()
+        with self._lock:
+            last_seen = self._seen.pop(key, None)
+            self._seen[key] = now
+            self._expire(now)
+        return last_seen is None or now - last_seen > self.max_age
+
+    def discard(self, key):
+        """ Forget key, if we remember it. """
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def _expire(self, now):
+        # Call with self._lock held
+        seen = self._seen
+        while len(seen) > self.max_entries:
+            seen.popitem(last=False)
+        cutoff = now - self.max_age
+        while seen:
+            key, last_seen = next(seen.iteritems())
+            if last_seen >= cutoff:
+                break
+            del seen[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            last_seen = self._seen.get(key)
+        return last_seen is not None and \
+            self.clock() - last_seen <= self.max_age
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class Deduplicator(object):
+    """
+    Decides whether a manager should bother with a file. Set a manager's
+    dedup to one of these.
+
+    With by_instance_uid, dicoms are also dropped if their SOPInstanceUID
+    was seen recently. That needs SOPInstanceUID in the header the manager
+    reads; with routing_keys that stop before (0008,0018), add it to them.
+    """
+
+    def __init__(self, max_entries=10000, max_age=600.0, by_instance_uid=False,
+                 clock=time.time):
+        self.by_instance_uid = by_instance_uid
+        self.files = RecentKeys(max_entries, max_age, clock)
+        self.instances = RecentKeys(max_entries, max_age, clock)
+        self.files_skipped = 0
+        self.instances_skipped = 0
+
+    def file_is_new(self, filename):
+        """
+        False if we've seen filename recently, with the same size and
+        mtime. Files we can't stat are new: reading them will say what's
+        wrong.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return True
+        if self.files.add((filename, st.st_size, st.st_mtime)):
+            return True
+        self.files_skipped += 1
+        return False
+
+    def forget_file(self, filename):
+        """ Undo file_is_new(filename), for a file we couldn't handle. """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return
+        self.files.discard((filename, st.st_size, st.st_mtime))
+
+    def dicom_is_new(self, dcm):
+        """ False if dcm's SOPInstanceUID was seen recently. """
+        if not self.by_instance_uid:
+            return True
+        uid = dcm.get('SOPInstanceUID')
+        if uid is None or self.instances.add(str(uid)):
+            return True
+        self.instances_skipped += 1
+        return False
+
+    def forget_dicom(self, dcm):
+        """ Undo dicom_is_new(dcm), for a dicom we couldn't hand off. """
+        uid = dcm.get('SOPInstanceUID')
+        if self.by_instance_uid and uid is not None:
+            self.instances.discard(str(uid))
+
+    def stats(self):
+        return {
+            'files_skipped': self.files_skipped,
+            'instances_skipped': self.instances_skipped,
+            'files_remembered': len(self.files),
+            'instances_remembered': len(self.instances),
+        }
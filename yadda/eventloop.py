@@ -0,0 +1,163 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+A small select()-based event loop for AsyncDicomManager.
+
+Everything that touches the manager and its handlers runs on the loop's
+thread, one callback at a time, so there's no locking. Method names follow
+asyncio's (call_soon, call_later, add_reader, ...) so code written against
+this loop reads the same as asyncio code.
+"""
+
+import os
+import errno
+import fcntl
+import heapq
+import select
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Handle(object):
+    """ A callback scheduled on an EventLoop. cancel() it to skip it. """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _run(self):
+        try:
+            self.callback(*self.args)
+        except Exception:
+            logger.exception("Error in event loop callback %r" % (
+                self.callback))
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+
+class EventLoop(object):
+
+    def __init__(self):
+        self._ready = deque()
+        self._scheduled = []
+        self._readers = {}
+        self._stopping = False
+        self._running = False
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.add_reader(self._wake_r, self._drain_wakeups)
+
+    def time(self):
+        return time.time()
+
+    def call_soon(self, callback, *args):
+        handle = Handle(None, callback, args)
+        self._ready.append(handle)
+        return handle
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ call_soon() for use from threads other than the loop's. """
+        handle = self.call_soon(callback, *args)
+        self._wake()
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        handle = Handle(when, callback, args)
+        heapq.heappush(self._scheduled, handle)
+        return handle
+
+    def add_reader(self, fd, callback, *args):
+        self._readers[fd] = Handle(None, callback, args)
+
+    def remove_reader(self, fd):
+        return self._readers.pop(fd, None) is not None
+
+    def is_running(self):
+        return self._running
+
+    def stop(self):
+        """ Stop run_forever() after the current pass through the loop. """
+        self._stopping = True
+        self._wake()
+
+    def run_forever(self):
+        self.run_until(lambda: False)
+
+    def run_until(self, done):
+        """ Run the loop until stop() is called or done() returns True. """
+        self._running = True
+        try:
+            while not (self._stopping or done()):
+                self.run_once()
+        finally:
+            self._stopping = False
+            self._running = False
+
+    def run_once(self, timeout=None):
+        """
+        Wait for I/O or the next timer (but no longer than timeout), then
+        run everything that's ready.
+        """
+        if self._ready:
+            timeout = 0
+        elif self._scheduled:
+            wait = max(0, self._scheduled[0].when - self.time())
+            if timeout is None or wait < timeout:
+                timeout = wait
+        try:
+            readable, _, _ = select.select(
+                list(self._readers), [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+        for fd in readable:
+            handle = self._readers.get(fd)
+            if handle is not None:
+                self._ready.append(handle)
+        now = self.time()
+        while self._scheduled and self._scheduled[0].when <= now:
+            self._ready.append(heapq.heappop(self._scheduled))
+        # Only run what's ready now; callbacks added while we run wait
+        # for the next pass, so I/O can't be starved.
+        for i in range(len(self._ready)):
+            handle = self._ready.popleft()
+            if not handle.cancelled:
+                handle._run()
+
+    def close(self):
+        self.remove_reader(self._wake_r)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'x')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
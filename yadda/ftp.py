@@ -0,0 +1,202 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+FTP plumbing for handlers that upload series to a server.
+
+An FTPConnectionPool holds logged-in sessions to one server, shared by
+every handler a manager builds, so a study with 40 series doesn't do 40
+connect-and-login handshakes. Sessions never cwd -- everything uses paths
+relative to base_dir -- so any session can do any series' work.
+
+Servers drop sessions that sit idle too long, so a session that's been
+idle for noop_after seconds gets a NOOP before it's handed out, and is
+replaced if that fails. If an operation still finds its session dropped
+(a 421, or the connection closing), it's tried once more on a new one.
+
+yadda.transports.FTPTransport uses a pool to deliver series.
+"""
+
+import os
+import time
+import socket
+import posixpath
+import threading
+import logging
+import ftplib
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# What using a session the server has dropped gets us
+DROPPED_ERRORS = (ftplib.error_temp, EOFError, socket.error)
+
+
+class FTPConnectionPool(object):
+    """
+    Up to max_connections logged-in sessions to one FTP server.
+
+    acquire() hands out an idle session (or logs in a new one, if we're
+    under max_connections), blocking when every session is in use.
+    Sessions idle for noop_after seconds are checked first.
+    """
+
+    def __init__(
+            self, host, port=21, user='anonymous', password='',
+            base_dir=None, max_connections=4, ftp_factory=ftplib.FTP,
+            noop_after=5.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.base_dir = base_dir or ''
+        self.max_connections = max_connections
+        self.ftp_factory = ftp_factory
+        self.noop_after = noop_after
+        # (session, when it went idle)
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._known_dirs = set()
+
+    def __str__(self):
+        return "FTPConnectionPool({0}:{1})".format(self.host, self.port)
+
+    def _connect(self):
+        logger.debug('{0}: Connecting'.format(self))
+        ftp = self.ftp_factory()
+        ftp.connect(self.host, self.port)
+        logger.debug('{0}: Logging in as {1}'.format(self, self.user))
+        ftp.login(self.user, self.password)
+        return ftp
+
+    def acquire(self, fresh=False):
+        """ A session; a newly logged-in one, if fresh. """
+        self._slots.acquire()
+        idle = None
+        with self._lock:
+            if self._idle and not fresh:
+                idle = self._idle.popleft()
+        if idle is not None:
+            ftp, idle_since = idle
+            if time.time() - idle_since < self.noop_after or \
+                    self._alive(ftp):
+                return ftp
+        try:
+            return self._connect()
+        except:
+            self._slots.release()
+            raise
+
+    def _alive(self, ftp):
+        try:
+            ftp.voidcmd('NOOP')
+            return True
+        except (ftplib.Error,) + DROPPED_ERRORS as e:
+            logger.debug('{0}: idle session is gone ({1})'.format(self, e))
+            _close_quietly(ftp)
+            return False
+
+    def release(self, ftp, broken=False):
+        """
+        Give a session back. Broken sessions get closed instead of reused.
+        """
+        if broken:
+            _close_quietly(ftp)
+        else:
+            with self._lock:
+                self._idle.append((ftp, time.time()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, fresh=False):
+        ftp = self.acquire(fresh)
+        try:
+            yield ftp
+        except (ftplib.Error, EnvironmentError, EOFError):
+            self.release(ftp, broken=True)
+            raise
+        except:
+            self.release(ftp)
+            raise
+        else:
+            self.release(ftp)
+
+    def _with_session(self, work):
+        """
+        work(session), on a new session if the server turns out to have
+        dropped the one we got.
+        """
+        try:
+            with self.connection() as ftp:
+                return work(ftp)
+        except DROPPED_ERRORS as e:
+            logger.info('{0}: session dropped ({1}); reconnecting'.format(
+                self, e))
+        with self.connection(fresh=True) as ftp:
+            return work(ftp)
+
+    def remote_path(self, *parts):
+        return posixpath.join(self.base_dir, *parts)
+
+    def makedir(self, name):
+        """
+        Make base_dir/name, unless we already know it's there.
+        """
+        path = self.remote_path(name)
+        if path in self._known_dirs:
+            return path
+
+        def mkd(ftp):
+            try:
+                ftp.mkd(path)
+            except ftplib.error_perm as e:
+                # 550 is what servers say when it already exists
+                if not str(e).startswith('550'):
+                    raise
+                logger.debug('{0}: {1} already exists'.format(self, path))
+        self._with_session(mkd)
+        self._known_dirs.add(path)
+        return path
+
+    def store(self, filename, remote_dir):
+        """ Upload filename into remote_dir (relative to base_dir). """
+        return self.store_all([filename], remote_dir)[0]
+
+    def store_all(self, filenames, remote_dir):
+        """ Upload filenames into remote_dir over a single session. """
+        paths = [self.remote_path(remote_dir, os.path.basename(filename))
+                 for filename in filenames]
+
+        def stor(ftp):
+            for filename, path in zip(filenames, paths):
+                with open(filename, 'rb') as f:
+                    ftp.storbinary('STOR ' + path, f)
+        self._with_session(stor)
+        return paths
+
+    def rename(self, from_name, to_name):
+        from_path = self.remote_path(from_name)
+        self._with_session(
+            lambda ftp: ftp.rename(from_path, self.remote_path(to_name)))
+        self._known_dirs.discard(from_path)
+
+    def close(self):
+        """ Log out of every idle session. """
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for ftp, idle_since in idle:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+
+def _close_quietly(ftp):
+    try:
+        ftp.close()
+    except Exception:
+        pass
@@ -7,21 +7,94 @@
 Handlers are responsible for taking a dicoms and doing something with them.
 In general, you'll want to subclass ThreadedDicomHandler and override
 the on_start(), on_handle(), and on_finish() methods in your subclass.
+Each ThreadedDicomHandler works through its own queue of dicoms, in order.
+
+PooledDicomHandler has the same hooks, but instead of being a thread, it's
+a little bit of per-series state whose hooks run on its manager's worker
+pool. Use it (with PooledDicomManager) when you have lots of series going
+at once.
+
+AsyncDicomHandler runs its hooks as callbacks on an AsyncDicomManager's
+event loop, with its idle timeout as a loop timer.
+
+DeliveringDicomHandler is a ThreadedDicomHandler that sends each file on
+to a yadda.transports.Delivery, so you don't have to write the hooks at all.
+
+If the manager has a journal, handlers record each file once on_handle()
+returns for it and the series once on_finish() returns.
+
+A handler with a completion (a yadda.completion.SeriesCompletion; managers
+with predict_completion give every handler one) finishes as soon as
+it's been handed every instance its series should have (plus the
+completion's grace, if it has one), without waiting out its timeout.
 """
 
 import threading
 import logging
+import time
+import Queue
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
 
+class HandlerClosedError(RuntimeError):
+    """
+    Raised by handle_dicom() when a handler has already started finishing.
+    Managers should wait for it to go away and make a new one.
+    """
+    pass
+
+
+_TERMINATE = object()
+
+
+def series_id(handler):
+    """
+    What the journal records handler's files against: the manager gives
+    each handler its own, so a handler that's still finishing can't mark
+    the next handler for the same series key finished too.
+    """
+    return getattr(handler, 'series_id', None) or handler.name
+
+
+def _record_handled(handler, args):
+    journal = getattr(handler.manager, 'journal', None)
+    if journal is not None and args and handler.journal_handled:
+        journal.file_handled(series_id(handler), args[0])
+
+
+def _record_finished(handler):
+    journal = getattr(handler.manager, 'journal', None)
+    if journal is not None:
+        journal.series_finished(series_id(handler))
+
+
 class ThreadedDicomHandler(threading.Thread):
+    """
+    A thread that handles one series.
 
-    def __init__(self, manager, name, timeout):
+    handle_dicom() just queues the dicom up; the handler's thread calls
+    on_handle() for each one, in the order they came in, so slow handling
+    of one series doesn't hold up whoever's feeding us dicoms. Once
+    high_water_mark dicoms are waiting, handle_dicom() blocks until the
+    thread catches up.
+    """
+
+    high_water_mark = 1000
+    # Set to False if on_handle() returning doesn't mean the file's done
+    journal_handled = True
+    completion = None
+
+    def __init__(self, manager, name, timeout, high_water_mark=None):
         super(ThreadedDicomHandler, self).__init__(name=name)
         self.timeout = timeout
         self.manager = manager
+        if high_water_mark is not None:
+            self.high_water_mark = high_water_mark
         self.notifier = threading.Condition()
+        self._queue = Queue.Queue(self.high_water_mark)
+        self._stop = False
 
     def start(self):
         self._stop = False
@@ -46,14 +119,47 @@ class ThreadedDicomHandler(threading.Thread):
 
     def run(self):
         logger.debug("%s - running" % (self))
-        with self.notifier:
-            while not self._stop:
-                self._stop = True
-                self.notifier.wait(self.timeout)
+        try:
+            while self._handle_next():
+                pass
             self.on_finish()
+            _record_finished(self)
+        finally:
             self.manager.remove_handler(self)
         logger.debug("%s: successfully shut down" % (self))
 
+    def _handle_next(self):
+        """
+        Wait up to timeout for a dicom and handle it. Returns False when
+        it's time to finish.
+        """
+        timeout = self.timeout
+        if self.completion is not None and self.completion.complete:
+            # Everything's here; finish once the queue's empty and the
+            # completion's grace has passed
+            timeout = min(timeout, self.completion.grace)
+        try:
+            item = self._queue.get(True, timeout)
+        except Queue.Empty:
+            with self.notifier:
+                # Something may have been queued just as we timed out
+                if self._queue.empty():
+                    self._stop = True
+                    return False
+            return True
+        if item is _TERMINATE:
+            return False
+        dcm, args, kwargs = item
+        try:
+            self.on_handle(dcm, *args, **kwargs)
+        except Exception:
+            logger.exception("%s: error handling dicom" % (self))
+        else:
+            _record_handled(self, args)
+            if self.completion is not None and self.completion.add(dcm):
+                logger.debug("%s: complete" % (self))
+        return True
+
     def on_finish(self):
         """
         Actually finish handling dicoms.
@@ -64,17 +170,32 @@ class ThreadedDicomHandler(threading.Thread):
         logger.debug("%s - finishing" % (self))
 
     def terminate(self):
+        """
+        Finish up after handling any dicoms already queued.
+        """
         with self.notifier:
+            if self._stop:
+                return
             self._stop = True
-            self.notifier.notify()
+            self._queue.put(_TERMINATE)
 
     def handle_dicom(self, dcm, *args, **kwargs):
-        if not self.is_alive():
-            raise RuntimeError("%s got handle_dicom before alive!" % (self))
         with self.notifier:
-            self._stop = False
-            self.on_handle(dcm, *args, **kwargs)
-            self.notifier.notify()
+            if self._stop:
+                raise HandlerClosedError("%s is finishing" % (self))
+            if not self.is_alive():
+                raise RuntimeError(
+                    "%s got handle_dicom before alive!" % (self))
+            self._queue.put((dcm, args, kwargs))
+
+    @property
+    def queue_depth(self):
+        """ The number of dicoms waiting to be handled. """
+        return self._queue.qsize()
+
+    def stats(self):
+        """ A dict describing what this handler's up to. """
+        return {'name': self.name, 'queue_depth': self.queue_depth}
 
     def on_handle(self, dcm, *args, **kwargs):
         """
@@ -85,3 +206,282 @@ class ThreadedDicomHandler(threading.Thread):
 
     def __str__(self):
         return self.name
+
+
+class DeliveringDicomHandler(ThreadedDicomHandler):
+    """
+    Sends each dicom's file on through a yadda.transports.Delivery.
+
+    Managers should hand it dicoms as handle_dicom(dcm, filename). Its
+    stats() include the delivery's counters: files, bytes, latency from
+    hand-off to this handler to delivery (handoff_latency), and how much
+    is queued where.
+
+    on_handle() only queues a file for delivery, so with a journal, a
+    series that didn't finish is delivered again in full.
+    """
+
+    journal_handled = False
+
+    def __init__(self, manager, name, timeout, delivery, **kwargs):
+        super(DeliveringDicomHandler, self).__init__(
+            manager, name, timeout, **kwargs)
+        self.delivery = delivery
+        self.series = None
+
+    def on_start(self):
+        self.series = self.delivery.open(self.name)
+
+    def handle_dicom(self, dcm, filename, *args, **kwargs):
+        kwargs.setdefault('received_at', time.time())
+        super(DeliveringDicomHandler, self).handle_dicom(
+            dcm, filename, *args, **kwargs)
+
+    def on_handle(self, dcm, filename, received_at=None):
+        self.series.add(filename, received_at)
+
+    def on_finish(self):
+        self.series.close()
+
+    def stats(self):
+        stats = self.series.stats.snapshot()
+        stats.update(super(DeliveringDicomHandler, self).stats())
+        return stats
+
+
+class PooledDicomHandler(object):
+    """
+    A series handler whose on_* hooks run on a PooledDicomManager's
+    worker pool.
+
+    Hooks for one handler run one at a time, in the order the work came in:
+    on_start(), then on_handle() for each dicom, then on_finish(). Work for
+    different handlers is interleaved across the pool's workers, one hook
+    call at a time, so a long series can't hog a worker.
+
+    The manager owns the idle timeout; when it fires, the manager calls
+    finish(). With fair_scheduling, the manager also sets priority and
+    source, which decide when the pool gets to our hooks.
+    """
+
+    journal_handled = True
+    completion = None
+    priority = None
+    source = None
+
+    def __init__(self, manager, name, timeout):
+        self.manager = manager
+        self.name = name
+        self.timeout = timeout
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._started = False
+        self._finishing = False
+        self._done = threading.Event()
+
+    def start(self):
+        logger.info(
+            "%s: waiting for dicoms. Timeout: %s" %
+            (self, self.timeout))
+        self._started = True
+        self._submit(self.on_start)
+
+    def on_start(self):
+        """
+        Code to run before handling any dicoms. Runs on a worker thread.
+
+        Override this in subclasses.
+
+        """
+        logger.debug("{0} on_start".format(self))
+
+    def handle_dicom(self, dcm, *args, **kwargs):
+        if not self._started:
+            raise RuntimeError("%s got handle_dicom before start!" % (self))
+        if self._finishing:
+            raise RuntimeError("%s got handle_dicom after finish!" % (self))
+        self._submit(self._handle, dcm, *args, **kwargs)
+
+    def _handle(self, dcm, *args, **kwargs):
+        self.on_handle(dcm, *args, **kwargs)
+        _record_handled(self, args)
+        if self.completion is not None and self.completion.add(dcm):
+            logger.debug("%s: complete" % (self))
+            self.manager.series_complete(self)
+
+    def on_handle(self, dcm, *args, **kwargs):
+        """
+        Do the internal handling of the dicom. Override this method in
+        subclasses.
+        """
+        logger.debug("%s - handling dicom" % (self))
+
+    def finish(self):
+        """
+        Queue up on_finish(), after any dicoms we've already been handed.
+        """
+        with self._lock:
+            if self._finishing:
+                return
+            self._finishing = True
+        self._submit(self._finish)
+
+    terminate = finish
+
+    def _finish(self):
+        try:
+            self.on_finish()
+            _record_finished(self)
+        finally:
+            self.manager.remove_handler(self)
+            self._done.set()
+            logger.debug("%s: successfully shut down" % (self))
+
+    def on_finish(self):
+        """
+        Actually finish handling dicoms.
+
+        Override this method in subclasses.
+
+        """
+        logger.debug("%s - finishing" % (self))
+
+    def is_alive(self):
+        return self._started and not self._done.is_set()
+
+    def stats(self):
+        """ A dict describing what this handler's up to. """
+        with self._lock:
+            return {'name': self.name, 'queue_depth': len(self._pending)}
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def _submit(self, fx, *args, **kwargs):
+        with self._lock:
+            self._pending.append((fx, args, kwargs))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.manager.pool.submit_fair(
+            self.priority, self.source, self._run_next)
+
+    def _run_next(self):
+        with self._lock:
+            fx, args, kwargs = self._pending.popleft()
+        try:
+            fx(*args, **kwargs)
+        except Exception:
+            logger.exception("%s: %s failed" % (self, fx.__name__))
+        with self._lock:
+            if not self._pending:
+                self._scheduled = False
+                return
+        # Back of the line, so other series get a turn
+        self.manager.pool.submit_fair(
+            self.priority, self.source, self._run_next)
+
+    def __str__(self):
+        return self.name
+
+
+class AsyncDicomHandler(object):
+    """
+    A series handler that lives on an AsyncDicomManager's event loop.
+
+    on_start(), on_handle(), and on_finish() are called on the loop's
+    thread, so they must not block for long -- every other series waits
+    while they run. Hooks that need to wait on something should schedule
+    the rest of their work with self.loop (call_later, add_reader, ...).
+    """
+
+    journal_handled = True
+    completion = None
+
+    def __init__(self, manager, name, timeout):
+        self.manager = manager
+        self.loop = manager.loop
+        self.name = name
+        self.timeout = timeout
+        self._timer = None
+        self._alive = False
+
+    def start(self):
+        logger.info(
+            "%s: waiting for dicoms. Timeout: %s" %
+            (self, self.timeout))
+        self.on_start()
+        self._alive = True
+        self._reset_timer()
+
+    def on_start(self):
+        """
+        Code to run before handling any dicoms.
+
+        Override this in subclasses.
+
+        """
+        logger.debug("{0} on_start".format(self))
+
+    def handle_dicom(self, dcm, *args, **kwargs):
+        if not self._alive:
+            raise RuntimeError("%s got handle_dicom while not alive!" % (self))
+        self._reset_timer()
+        self.on_handle(dcm, *args, **kwargs)
+        _record_handled(self, args)
+        if self.completion is not None and self.completion.add(dcm):
+            logger.debug("%s: complete" % (self))
+            if self.completion.grace:
+                self._reset_timer(self.completion.grace)
+            else:
+                self._finish()
+
+    def on_handle(self, dcm, *args, **kwargs):
+        """
+        Do the internal handling of the dicom. Override this method in
+        subclasses.
+        """
+        logger.debug("%s - handling dicom" % (self))
+
+    def terminate(self):
+        if self._alive:
+            self._finish()
+
+    def _reset_timer(self, delay=None):
+        if delay is None:
+            delay = self.timeout
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self.loop.call_later(delay, self._finish)
+
+    def _finish(self):
+        self._alive = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        try:
+            self.on_finish()
+            _record_finished(self)
+        finally:
+            self.manager.remove_handler(self)
+            logger.debug("%s: successfully shut down" % (self))
+
+    def on_finish(self):
+        """
+        Actually finish handling dicoms.
+
+        Override this method in subclasses.
+
+        """
+        logger.debug("%s - finishing" % (self))
+
+    def is_alive(self):
+        return self._alive
+
+    def stats(self):
+        """ A dict describing what this handler's up to. """
+        return {'name': self.name, 'queue_depth': 0}
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,268 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Bulk ingest: feed a whole directory tree of dicoms to a manager.
+
+Parsing headers is most of the work of routing a file, and it's CPU-bound,
+so ingest() fans it out to a pool of processes. The main process only walks
+the tree and hands parsed headers to the manager. Headers come back in the
+order the files were found (walk_files() sorts each directory), so every
+series sees its files in the same order on every run. Only a few chunks of
+files are read ahead of the manager, so a manager that's slow to take
+them doesn't leave parsed headers piling up here.
+
+Workers read just the manager's routing_keys (or whole files without
+pixel data, if it has none), so a custom read_dicom() on the manager isn't
+used here.
+"""
+
+import os
+import time
+import logging
+import itertools
+import multiprocessing
+from collections import deque
+
+from dicom.filereader import InvalidDicomError, read_file
+from dicom.dataset import Dataset, FileDataset
+from dicom.dataelem import RawDataElement
+from dicom.tag import BaseTag
+
+from yadda.readers import read_dicom
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # the backport, from PyPI
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+
+
+def walk_files(top):
+    """
+    Yield the path of every regular file under top, sorted by name within
+    each directory and depth first. Uses scandir when it's available: it
+    tells files from directories without a stat() per entry.
+    """
+    if scandir is None:
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if os.path.isfile(path):
+                    yield path
+        return
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(scandir(directory), key=lambda e: e.name)
+        except OSError as e:
+            logger.warn("Can't list {0}: {1}".format(directory, e))
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file():
+                yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def iter_files(paths):
+    """ Files named in paths, and every file under directories in paths. """
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in walk_files(path):
+                yield filename
+        else:
+            yield path
+
+
+class IngestProgress(object):
+    """
+    Counters for an ingest run. files counts every file looked at;
+    dicoms the ones handed to the manager, skipped the ones that weren't
+    dicoms, and errors the ones that couldn't be read.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self.files = 0
+        self.dicoms = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def rate(self):
+        """ Files per second so far. """
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.files / elapsed
+
+    def stats(self):
+        return {
+            'files': self.files,
+            'dicoms': self.dicoms,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'elapsed': self.elapsed(),
+            'rate': self.rate(),
+        }
+
+    def __str__(self):
+        return ("{0} files ({1} dicoms, {2} skipped, {3} errors) "
+                "in {4:.1f}s, {5:.1f} files/sec".format(
+                    self.files, self.dicoms, self.skipped, self.errors,
+                    self.elapsed(), self.rate()))
+
+
+def log_progress(progress):
+    logger.info(str(progress))
+
+
+# Set in each worker process by _init_worker
+_key_spec = None
+
+
+def _init_worker(key_spec):
+    global _key_spec
+    _key_spec = key_spec
+
+
+def _pack_elements(ds):
+    # Raw elements as plain tuples with int tags; anything already
+    # converted goes as it is
+    return [(long(e.tag),) + e[1:] if isinstance(e, tuple) else e
+            for e in dict.values(ds)]
+
+
+def _unpack_elements(packed):
+    elements = {}
+    for e in packed:
+        if isinstance(e, tuple):
+            e = RawDataElement(BaseTag(e[0]), *e[1:])
+        elements[e.tag] = e
+    return elements
+
+
+def _pack(dcm):
+    """
+    dcm as lists of tuples: they pickle several times faster than a
+    FileDataset does, and that matters when a header only takes a few
+    times longer than that to parse.
+    """
+    return (_pack_elements(dcm.file_meta), _pack_elements(dcm),
+            dcm.preamble, dcm.is_implicit_VR, dcm.is_little_endian)
+
+
+def _unpack(filename, packed):
+    meta, elements, preamble, is_implicit_VR, is_little_endian = packed
+    # Like read_dataset, fill the dicts directly rather than through
+    # Dataset.__setitem__
+    return FileDataset(
+        filename, _unpack_elements(elements), preamble,
+        Dataset(_unpack_elements(meta)), is_implicit_VR, is_little_endian)
+
+
+def _read_header(filename):
+    """
+    Runs in a worker: returns (filename, packed dcm, error). The dcm is
+    None if the file isn't a dicom, or if reading it failed with error.
+    """
+    try:
+        if _key_spec is None:
+            dcm = read_file(filename, stop_before_pixels=True)
+        else:
+            dcm = read_dicom(filename, _key_spec)
+    except InvalidDicomError:
+        return filename, None, None
+    except Exception as e:
+        return filename, None, "{0}: {1}".format(type(e).__name__, e)
+    return filename, _pack(dcm), None
+
+
+def _read_headers(filenames):
+    return [_read_header(filename) for filename in filenames]
+
+
+def _read_in_pool(pool, filenames, chunksize, read_ahead):
+    """
+    _read_header() for each of filenames, in order, in pool. At most
+    read_ahead chunks of chunksize files are read (or being read) ahead
+    of the chunk whose results we're yielding.
+    """
+    chunks = iter(lambda: list(itertools.islice(filenames, chunksize)), [])
+    pending = deque(pool.apply_async(_read_headers, (chunk,))
+                    for chunk in itertools.islice(chunks, read_ahead))
+    while pending:
+        results = pending.popleft().get()
+        # Keep the workers busy while the manager takes this chunk
+        for chunk in itertools.islice(chunks, 1):
+            pending.append(pool.apply_async(_read_headers, (chunk,)))
+        for result in results:
+            yield result
+
+
+def ingest(manager, paths, processes=None, chunksize=32, read_ahead=None,
+           progress=log_progress, report_every=5.0):
+    """
+    Parse every file in paths (files or directories) in a pool of processes,
+    and hand the dicoms to manager.handle_dicom() in the order they were
+    found. Returns an IngestProgress.
+
+    processes defaults to the number of CPUs; with processes=1 everything
+    happens in this process. Files go to the workers chunksize at a time,
+    and at most read_ahead chunks (default: two per process) are read
+    ahead of the manager. progress is called with the IngestProgress
+    at most every report_every seconds, and once at the end.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if read_ahead is None:
+        read_ahead = 2 * processes
+    key_spec = manager.routing_spec
+    filenames = iter_files(paths)
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=(key_spec,))
+        results = _read_in_pool(pool, filenames, chunksize, read_ahead)
+    else:
+        _init_worker(key_spec)
+        results = itertools.imap(_read_header, filenames)
+    counts = IngestProgress()
+    next_report = counts.started_at + report_every
+    try:
+        for filename, packed, error in results:
+            counts.files += 1
+            if packed is not None:
+                counts.dicoms += 1
+                manager.handle_dicom(_unpack(filename, packed), filename)
+            elif error is not None:
+                counts.errors += 1
+                logger.warn("Can't read {0}: {1}".format(filename, error))
+            else:
+                counts.skipped += 1
+                logger.debug('Not a dicom: {0}'.format(filename))
+            if progress is not None and time.time() >= next_report:
+                progress(counts)
+                next_report = time.time() + report_every
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    counts.finished_at = time.time()
+    if progress is not None:
+        progress(counts)
+    return counts
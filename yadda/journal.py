@@ -0,0 +1,285 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+A journal of what a manager has done, so a restart can pick up where the
+last run left off.
+
+Managers record when they hand a file to a series (seen), handlers record
+when they're done with it (handled) and when the series is done (finished).
+Each record is one JSON list per line, appended to a file. Appending is
+just a list append under a lock: a background thread writes and fsyncs
+whatever has piled up every flush_interval seconds (or every batch_size
+records), so the journal stays off the hot path. The price is that a
+crash can lose the last flush_interval's worth of records -- those files
+get handled again, so recovery is at-least-once.
+
+If a write or fsync fails (a full disk, say), the journal is broken: the
+records it couldn't write are kept, the error is logged, and every later
+record, flush() and close() raises JournalFailedError, so nobody carries
+on as if it were durable.
+
+Opening a Journal replays the file into a JournalState; see
+ThreadedDicomManager.recover() for what managers do with it.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SEEN = 'seen'
+HANDLED = 'handled'
+FINISHED = 'finished'
+IGNORED = 'ignored'
+
+
+class JournalFailedError(IOError):
+    """ Writing the journal failed, so it can't record anything more. """
+    pass
+
+
+class JournalState(object):
+    """
+    What a journal says happened. unfinished maps each series that was
+    started but never finished to an OrderedDict of its files, in the
+    order they were seen, each True once handled. seen holds every file
+    that was ever handed to a series or ignored, so a rescan can tell
+    what's new.
+
+    Series are identified by series id (see yadda.handlers.series_id),
+    one per handler, rather than series key: a key can have a finishing
+    handler and a new one at once.
+    """
+
+    def __init__(self):
+        self.unfinished = OrderedDict()
+        self.seen = set()
+        self.records = 0
+
+    def apply(self, record):
+        event, key, filename = record
+        self.records += 1
+        if event == SEEN:
+            self.seen.add(filename)
+            series = self.unfinished.setdefault(key, OrderedDict())
+            series.setdefault(filename, False)
+        elif event == HANDLED:
+            self.seen.add(filename)
+            self.unfinished.setdefault(key, OrderedDict())[filename] = True
+        elif event == FINISHED:
+            self.unfinished.pop(key, None)
+        elif event == IGNORED:
+            self.seen.add(filename)
+
+    def pending(self, key):
+        """ Files seen in series key that were never handled. """
+        return [f for f, handled in self.unfinished[key].items()
+                if not handled]
+
+    def handled(self, key):
+        """ Files in series key that were handled. """
+        return [f for f, handled in self.unfinished[key].items() if handled]
+
+    def records_for(self, keep):
+        """
+        Records that would rebuild this state, dropping files where
+        keep(filename) is false.
+        """
+        in_flight = set()
+        for key, files in self.unfinished.items():
+            for filename, handled in files.items():
+                if not keep(filename):
+                    continue
+                in_flight.add(filename)
+                yield (SEEN, key, filename)
+                if handled:
+                    yield (HANDLED, key, filename)
+        for filename in sorted(self.seen - in_flight):
+            if keep(filename):
+                yield (IGNORED, None, filename)
+
+
+# Filenames are bytes, and needn't be UTF-8. Latin-1 maps every byte to
+#   a character, so it gets them through JSON and back unchanged
+ENCODING = 'latin-1'
+
+
+def _from_json(value):
+    if isinstance(value, unicode):
+        try:
+            return value.encode(ENCODING)
+        except UnicodeEncodeError:  # was unicode to start with
+            pass
+    return value
+
+
+def encode_record(record):
+    return json.dumps(record, encoding=ENCODING) + '\n'
+
+
+def read_records(path):
+    """
+    The records in the journal at path, oldest first. A torn last line
+    (we crashed mid-write) is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warn("{0}:{1}: skipping unreadable record".format(
+                    path, number))
+                continue
+            yield tuple(_from_json(value) for value in record)
+
+
+class Journal(object):
+    """
+    An append-only, batch-fsynced journal file. See the module docs.
+    """
+
+    def __init__(self, path, flush_interval=0.05, batch_size=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.state = JournalState()
+        for record in read_records(path):
+            self.state.apply(record)
+        logger.info("{0}: replayed {1} records, {2} unfinished series".format(
+            path, self.state.records, len(self.state.unfinished)))
+        self.flushes = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        # Held while writing, so compact() can't swap files under a flush
+        self._write_lock = threading.Lock()
+        self._closed = False
+        # Why writing failed, once it has
+        self.error = None
+        self._file = open(path, 'ab')
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name='journal-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def file_seen(self, key, filename):
+        self._append((SEEN, key, filename))
+
+    def file_handled(self, key, filename):
+        self._append((HANDLED, key, filename))
+
+    def series_finished(self, key):
+        self._append((FINISHED, key, None))
+
+    def file_ignored(self, filename):
+        self._append((IGNORED, None, filename))
+
+    def _append(self, record):
+        with self._cond:
+            if self._closed:
+                raise ValueError("{0} is closed".format(self.path))
+            self._check_failed()
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                deadline = time.time() + self.flush_interval
+                while (len(self._pending) < self.batch_size and
+                       not self._closed):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed and not self._pending:
+                    return
+            try:
+                self._write_pending()
+            except JournalFailedError:
+                # Logged, and raised by anything that uses us from now on
+                return
+
+    def _write_pending(self):
+        with self._write_lock:
+            self._write_pending_locked()
+
+    def _write_pending_locked(self):
+        with self._cond:
+            self._check_failed()
+            records, self._pending = self._pending, []
+        if not records:
+            return
+        try:
+            self._file.write(''.join(encode_record(r) for r in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except (IOError, OSError) as exc:
+            logger.error("{0}: writing failed: {1}".format(self.path, exc))
+            with self._cond:
+                self._pending[:0] = records
+                self.error = exc
+            self._check_failed()
+        self.flushes += 1
+        for record in records:
+            self.state.apply(record)
+
+    def _check_failed(self):
+        if self.error is not None:
+            raise JournalFailedError("{0}: writing failed: {1}".format(
+                self.path, self.error))
+
+    def flush(self):
+        """ Write and fsync everything recorded so far. """
+        self._write_pending()
+
+    def compact(self, keep=lambda filename: True):
+        """
+        Rewrite the journal with just enough records to rebuild its
+        state, forgetting files where keep(filename) is false. The new
+        file replaces the old one atomically.
+        """
+        with self._write_lock:
+            self._write_pending_locked()
+            state = JournalState()
+            temp_path = self.path + '.compacting'
+            with open(temp_path, 'wb') as f:
+                for record in self.state.records_for(keep):
+                    state.apply(record)
+                    f.write(encode_record(record))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_path, self.path)
+            _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self.state = state
+        logger.info("{0}: compacted to {1} records".format(
+            self.path, state.records))
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        self._file.close()
+        self._check_failed()
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -6,10 +6,33 @@
 """
 Managers manage a pool of handlers, taking care of creation and destruction
 as well as handing off incoming files to the appropriate one.
+
+ThreadedDicomManager runs a thread per series; PooledDicomManager runs
+every series on a fixed-size pool of workers; AsyncDicomManager runs
+everything -- file events included -- on a single event loop.
+
+Give a manager a yadda.journal.Journal with recover() and it records what
+it's done as it goes, so after a restart it can finish what it started.
 """
 
+import os
+import time
 import threading
 import logging
+from collections import deque
+
+from dicom.filereader import InvalidDicomError
+
+from yadda.readers import RoutingKeySpec, read_dicom
+from yadda.handlers import HandlerClosedError, series_id
+from yadda.completion import (
+    SeriesCompletion, InstanceCountLearner, COMPLETION_KEYS, PROTOCOL_KEYS,
+    ACQUISITION_GRACE)
+from yadda.timeouts import AdaptiveTimeouts
+from yadda.registry import SeriesRegistry
+from yadda.scheduling import Priorities, FairScheduler, NORMAL
+from yadda.pool import WorkerPool, TimerWheel
+from yadda.eventloop import EventLoop
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +42,50 @@ class ThreadedDicomManager(object):
     Superclass for dicom managers -- the things that will get dicoms,
     build handlers for them, and pass the dicoms on to them.
 
+    Set routing_keys to the DICOM keywords handler_key() uses, and
+    handle_file() will only parse dicom headers up through those keys.
+    Leave it as None to read whole files. Set memory_map to have whole
+    files memory-mapped (see dicom.filebase.DicomMMapFile): values are
+    read lazily, but pixel data show up as memoryviews rather than
+    strings, every queued dicom holds a file descriptor and a mapping, and
+    a file truncated while it's mapped can kill the process with SIGBUS.
+    So only turn it on for handlers that can cope, reading files that are
+    done being written. routing_spec is the yadda.readers.RoutingKeySpec
+    routing reads use (routing_keys plus whatever the options below need
+    to see), or None; use it to read files for the manager elsewhere.
+
+    Set dedup to a yadda.dedup.Deduplicator to have handle_file() skip
+    files (and, optionally, instances) it's handed off recently.
+
+    Set predict_completion to have handlers finish as soon as their series
+    has every instance its headers say it will (see yadda.completion),
+    rather than always waiting out the timeout; set learn_instance_counts
+    as well to guess counts for headers that don't give them from earlier
+    series of the same protocol. Series whose count is ImagesInAcquisition
+    wait acquisition_grace seconds more for another acquisition.
+
+    Set adaptive_timeouts to give each handler an idle timeout learned
+    from the gaps between files from its source (the source_keys values;
+    see yadda.timeouts), between min_timeout and max_timeout. timeout is
+    used until a source has enough history. Handlers' timeout attributes
+    are updated on every hand-off.
+
     """
 
+    routing_keys = None
+    memory_map = False
+    finished_stats_kept = 100
+    journal = None
+    dedup = None
+    predict_completion = False
+    learn_instance_counts = False
+    acquisition_grace = ACQUISITION_GRACE
+    adaptive_timeouts = False
+    source_keys = (
+        'SourceApplicationEntityTitle', 'StationName', 'ProtocolName')
+    min_timeout = 1.0
+    max_timeout = 300.0
+
     def __init__(self, timeout):
         """
         Build a new DicomManager.
@@ -30,28 +95,196 @@ class ThreadedDicomManager(object):
         """
         self.timeout = timeout
         self._stop = False
-        self._series_handlers = {}
+        self._stopped = threading.Event()
+        self._series_handlers = SeriesRegistry()
         self._mutex = threading.Condition()
+        self.finished_stats = deque(maxlen=self.finished_stats_kept)
+        self.instance_counts = None
+        if self.learn_instance_counts:
+            self.instance_counts = InstanceCountLearner()
+        self.timeouts = None
+        # handler -> when it was last handed a dicom
+        self._last_arrival = {}
+        if self.adaptive_timeouts:
+            self.timeouts = AdaptiveTimeouts(
+                timeout, self.min_timeout, self.max_timeout)
+        self.routing_spec = None
+        if self.routing_keys is not None:
+            keys = tuple(self.routing_keys)
+            if self.predict_completion:
+                keys += COMPLETION_KEYS
+                if self.learn_instance_counts:
+                    keys += PROTOCOL_KEYS
+            if self.adaptive_timeouts:
+                keys += tuple(self.source_keys)
+            self.routing_spec = RoutingKeySpec(keys)
 
     def wait(self):
-        with self._mutex:
-            while not self._stop:
-                self._mutex.wait(self.timeout)
+        # Returns as soon as stop() is called; the timeout is only there
+        # because Python 2 can't interrupt an untimed wait with Ctrl-C
+        while not self._stopped.wait(1.0):
+            pass
+
+    def read_dicom(self, filename):
+        """
+        Read filename into a dicom object for handle_file().
+
+        Override this if you need something other than a routing read
+        (or a full read, if routing_keys is None).
+
+        """
+        return read_dicom(
+            filename, self.routing_spec, memory_map=self.memory_map)
+
+    def handle_file(self, filename):
+        dedup = self.dedup
+        if dedup is None:
+            self._handle_file(filename)
+            return
+        if not dedup.file_is_new(filename):
+            logger.debug('Already seen: {0}'.format(filename))
+            return
+        done = False
+        try:
+            done = self._handle_file(filename)
+        finally:
+            if not done:
+                dedup.forget_file(filename)
+
+    def _handle_file(self, filename):
+        # Returns whether filename is taken care of, so dedup can skip it
+        try:
+            dcm = self.read_dicom(filename)
+        except InvalidDicomError:
+            logger.warn('Not a dicom: {0}'.format(filename))
+            if self.journal is not None:
+                self.journal.file_ignored(filename)
+            return False
+        dedup = self.dedup
+        if dedup is None:
+            self.handle_dicom(dcm, filename)
+            return True
+        if not dedup.dicom_is_new(dcm):
+            logger.debug('Already seen this instance: {0}'.format(filename))
+            return True
+        handed = False
+        try:
+            self.handle_dicom(dcm, filename)
+            handed = True
+        finally:
+            if not handed:
+                dedup.forget_dicom(dcm)
+        return True
 
     def handle_dicom(self, dcm, *args, **kwargs):
-        with self._mutex:
-            if self._stop:
+        # No manager-wide lock here: feeding threads only contend when
+        # they start a handler for series on the same registry stripe
+        if self._stop:
+            logger.warn("Trying to process while stopped!")
+            return
+        key = self.handler_key(dcm)
+        while True:
+            handler, created = self._series_handlers.get_or_create(
+                key, lambda: self._setup_handler(dcm, *args, **kwargs))
+            if handler is None:
                 logger.warn("Trying to process while stopped!")
                 return
+            if created:
+                logger.debug("Set up handler for key: {0}".format(key))
+            # Seen again by each handler we try, so it's never only seen by
+            # one that's finishing
+            self._journal_seen(handler, args)
+            try:
+                handler.handle_dicom(dcm, *args, **kwargs)
+                # Not before: a handler that's timing out would record a
+                # timeout-long gap for the source
+                self._arrived(handler, dcm)
+                return
+            except HandlerClosedError:
+                # It timed out under us; once it's gone, start a new one
+                logger.debug("{0} is finishing; waiting for it".format(
+                    handler))
+                handler.join()
+
+    def source_key(self, dcm):
+        """ Which source dcm came from, for adaptive_timeouts. """
+        return tuple(str(dcm.get(keyword, '')) for keyword in self.source_keys)
+
+    def _arrived(self, handler, dcm):
+        # Call once handler has (or surely will have) taken dcm
+        if self.timeouts is None:
+            return
+        source = self.source_key(dcm)
+        now = time.time()
+        last = self._last_arrival.get(handler)
+        if last is not None:
+            self.timeouts.observe(source, now - last)
+        self._last_arrival[handler] = now
+        handler.timeout = self.timeouts.timeout_for(source)
+
+    def _journal_seen(self, handler, args):
+        # Handlers record handled files by their first argument, so that's
+        # what we record too
+        if self.journal is not None and args:
+            self.journal.file_seen(series_id(handler), args[0])
+
+    def recover(self, journal, source_dirs=()):
+        """
+        Start recording to journal, after picking up where its last run
+        left off: files it saw but never handled are handled again, series
+        that had everything handled but never finished get a handler so
+        they finish, and files in source_dirs it has never seen (they came
+        in while we were down) are handled as new.
+
+        Files are passed around by name, so handlers must be built from
+        handle_dicom(dcm, filename) calls, as handle_file() makes them.
+        """
+        from yadda.ingest import walk_files  # pulls in multiprocessing
+        # Forget files that are gone; it also keeps the journal from
+        # growing without bound over restarts
+        journal.compact(keep=os.path.exists)
+        state = journal.state
+        plan = [(key, state.pending(key), state.handled(key))
+                for key in state.unfinished]
+        seen = set(state.seen)
+        self.journal = journal
+        for key, pending, handled in plan:
+            logger.info("Resuming {0}: {1} files to go, {2} done".format(
+                key, len(pending), len(handled)))
+            for filename in pending:
+                self._recover_file(filename)
+            if handled and not pending:
+                self._recover_file(handled[-1], resume=True)
+            # Its files are recorded against this run's handlers now
+            journal.series_finished(key)
+        for source_dir in source_dirs:
+            for filename in walk_files(source_dir):
+                if filename not in seen:
+                    self._recover_file(filename)
+
+    def _recover_file(self, filename, resume=False):
+        try:
+            if resume:
+                handler = self._resume_series(
+                    self.read_dicom(filename), filename)
+                # So the series stays unfinished until this handler's done
+                self.journal.file_seen(series_id(handler), filename)
+                self.journal.file_handled(series_id(handler), filename)
+            else:
+                self.handle_file(filename)
+        except (IOError, OSError, InvalidDicomError) as e:
+            logger.warn("Can't recover {0}: {1}".format(filename, e))
+
+    def _resume_series(self, dcm, *args):
+        """
+        Start a handler for dcm's series without handing it dcm, so a
+        series whose files were all handled still gets to finish. Returns
+        the series' handler.
+        """
         key = self.handler_key(dcm)
-        with self._mutex:
-            if key not in self._series_handlers:
-                logger.debug("Setting up handler for key: {0}".format(key))
-                self._series_handlers[key] = self._setup_handler(
-                    dcm, *args, **kwargs)
-            self._mutex.notify()
-        handler = self._series_handlers[key]
-        handler.handle_dicom(dcm, *args, **kwargs)
+        handler, created = self._series_handlers.get_or_create(
+            key, lambda: self._setup_handler(dcm, *args))
+        return handler
 
     def handler_key(self, dcm):
         """
@@ -73,22 +306,300 @@ class ThreadedDicomManager(object):
 
     def _setup_handler(self, dcm, *args, **kwargs):
         dsh = self.build_handler(dcm, *args, **kwargs)
+        self._prepare_handler(dsh, dcm)
         dsh.start()
         return dsh
 
+    def _prepare_handler(self, handler, dcm):
+        # Anything handler needs before it starts
+        handler.series_id = '{0}#{1}'.format(
+            handler.name, os.urandom(8).encode('hex'))
+        if self.predict_completion:
+            handler.completion = SeriesCompletion(
+                self.instance_counts, self.acquisition_grace)
+
     def remove_handler(self, handler):
         logger.debug("Removing handler %s" % (handler.name))
+        self._record_finished(handler)
+        self._series_handlers.discard(handler.name, handler)
+
+    def _record_finished(self, handler):
+        self._last_arrival.pop(handler, None)
+        completion = getattr(handler, 'completion', None)
+        if completion is not None and self.instance_counts is not None:
+            self.instance_counts.series_finished(completion)
+        stats = getattr(handler, 'stats', None)
+        if stats is not None:
+            self.finished_stats.append(stats())
+
+    def stats(self):
+        """
+        What's going on, for spotting bottlenecks: 'active' maps each
+        in-progress series' key to its handler's stats(), and 'finished'
+        lists the stats of the last finished_stats_kept finished series.
+        """
+        handlers = self._series_handlers.items()
+        active = {}
+        for key, handler in handlers:
+            stats = getattr(handler, 'stats', None)
+            active[key] = stats() if stats is not None else {}
+        stats = {'active': active, 'finished': list(self.finished_stats)}
+        if self.dedup is not None:
+            stats['dedup'] = self.dedup.stats()
+        if self.timeouts is not None:
+            stats['timeouts'] = dict(
+                ('/'.join(source), source_stats) for source, source_stats
+                in self.timeouts.stats().items())
+        return stats
+
+    def wait_for_handlers(self):
+        """
+        Block until every handler has finished, including any started
+        while we wait.
+        """
+        registry = self._series_handlers
+        # A handler that's done may still want joining before it goes
+        for handler in registry.values():
+            handler.join(0)
+        # Handlers discard themselves as they finish; the timeout is only
+        # there because Python 2 can't interrupt an untimed wait with Ctrl-C
+        while not registry.wait_until_empty(1.0):
+            pass
+
+    def stop(self):
+        self._stop = True
+        # Once the registry's closed, nothing can start a handler we'd miss
+        handlers = self._series_handlers.close()
+        # Handlers notice they're terminated at their own pace (Python 2's
+        # timed waits poll), so tell them all before waiting for any
+        for handler in handlers:
+            handler.terminate()
+        for handler in handlers:
+            handler.join()
+        self._stopped.set()
+
+
+class PooledDicomManager(ThreadedDicomManager):
+    """
+    A manager for PooledDicomHandlers: series are cheap state objects whose
+    hooks run on a fixed-size WorkerPool, and a single TimerWheel fires
+    their idle timeouts.
+
+    Subclass it just like ThreadedDicomManager -- override handler_key()
+    and build_handler() -- but have build_handler() return a
+    PooledDicomHandler.
+
+    Set fair_scheduling to have the pool pick which series' hooks to run
+    next by priority and source, rather than first come first served (see
+    yadda.scheduling). Each series gets a priority from priority_rules, a
+    list of (priority, {keyword: pattern}) pairs, or default_priority if
+    none match. Within a priority, sources (the source_keys values) share
+    the workers in proportion to source_weights (source -> weight; 1 if
+    not given). stats() then includes the scheduler's queue waits.
+
+    """
+
+    fair_scheduling = False
+    priority_rules = ()
+    default_priority = NORMAL
+    source_weights = None
+
+    def __init__(self, timeout, workers=4, tick=0.1):
+        """
+        Build a new PooledDicomManager.
+        timeout: How long a series can go without a new dicom before it's
+        finished.
+        workers: The number of threads to run handler hooks on.
+        tick: The resolution of series timeouts, in seconds.
+        """
+        super(PooledDicomManager, self).__init__(timeout)
+        self.priorities = None
+        scheduler = None
+        if self.fair_scheduling:
+            self.priorities = Priorities(
+                self.priority_rules, self.default_priority)
+            scheduler = FairScheduler(
+                self.source_weights, self.default_priority)
+            if self.routing_spec is not None:
+                self.routing_spec = RoutingKeySpec(
+                    self.routing_spec.keys + self.priorities.keys +
+                    tuple(self.source_keys))
+        self.pool = WorkerPool(workers, scheduler=scheduler)
+        self.timers = TimerWheel(tick)
+        self._finishing = set()
+        self.pool.start()
+        self.timers.start()
+
+    def handle_dicom(self, dcm, *args, **kwargs):
+        key = self.handler_key(dcm)
+        # Handing off is just a queue append, so we can do it under the
+        # lock, and a handler can't time out between lookup and hand-off.
+        with self._mutex:
+            if self._stop:
+                logger.warn("Trying to process while stopped!")
+                return
+            handler = self._series_handlers.get(key)
+            if handler is None:
+                logger.debug("Setting up handler for key: {0}".format(key))
+                handler = self._setup_handler(dcm, *args, **kwargs)
+                self._series_handlers.add(key, handler)
+                self._arrived(handler, dcm)
+                self.timers.schedule(
+                    handler, handler.timeout, lambda: self._expire(handler))
+            else:
+                self._arrived(handler, dcm)
+                self.timers.touch(handler, handler.timeout)
+            self._journal_seen(handler, args)
+            handler.handle_dicom(dcm, *args, **kwargs)
+
+    def _resume_series(self, dcm, *args):
+        key = self.handler_key(dcm)
+        with self._mutex:
+            handler = self._series_handlers.get(key)
+            if handler is None:
+                handler = self._setup_handler(dcm, *args)
+                self._series_handlers.add(key, handler)
+                self.timers.schedule(
+                    handler, handler.timeout, lambda: self._expire(handler))
+            return handler
+
+    def _prepare_handler(self, handler, dcm):
+        super(PooledDicomManager, self)._prepare_handler(handler, dcm)
+        if self.priorities is not None:
+            handler.priority = self.priorities.priority_for(dcm)
+            handler.source = self.source_key(dcm)
+
+    def stats(self):
+        stats = super(PooledDicomManager, self).stats()
+        if self.fair_scheduling:
+            scheduler = self.pool.scheduler.stats()
+            scheduler['sources'] = dict(
+                ('/'.join(source), source_stats) for source, source_stats
+                in scheduler['sources'].items())
+            stats['scheduler'] = scheduler
+        return stats
+
+    def _expire(self, handler):
+        logger.debug("%s timed out" % (handler))
+        self._retire(handler)
+
+    def series_complete(self, handler):
+        """
+        Finish handler now (or after its completion's grace), rather than
+        when it times out.
+        """
+        grace = handler.completion.grace
+        if not grace:
+            self._retire(handler)
+            return
+        with self._mutex:
+            if self._series_handlers.get(handler.name) is handler:
+                self.timers.schedule(
+                    handler, grace, lambda: self._expire(handler))
+
+    def _retire(self, handler):
         with self._mutex:
-            del self._series_handlers[handler.name]
+            self._series_handlers.discard(handler.name, handler)
+            self._finishing.add(handler)
+            self.timers.cancel(handler)
+        handler.finish()
+
+    def remove_handler(self, handler):
+        logger.debug("Removing handler %s" % (handler.name))
+        self._record_finished(handler)
+        with self._mutex:
+            self._series_handlers.discard(handler.name, handler)
+            self._finishing.discard(handler)
+            self._mutex.notify_all()
 
     def wait_for_handlers(self):
-        for handler in self._series_handlers.values():
-            handler.join(self.timeout)
+        """ Block until every handler has run on_finish(). """
+        # remove_handler() wakes us; the timeout is only there because
+        # Python 2 can't interrupt an untimed wait with Ctrl-C
+        with self._mutex:
+            while self._series_handlers or self._finishing:
+                self._mutex.wait(1.0)
 
     def stop(self):
         with self._mutex:
             self._stop = True
-            self._mutex.notify()
-        for handler in self._series_handlers.values():
-            handler.terminate()
+            handlers = self._series_handlers.close()
+        for handler in handlers:
+            self._retire(handler)
+        for handler in handlers:
             handler.join()
+        self.timers.stop()
+        self.pool.stop()
+        self._stopped.set()
+
+
+class AsyncDicomManager(ThreadedDicomManager):
+    """
+    A manager for AsyncDicomHandlers, running on an EventLoop.
+
+    Handlers, their timeouts, and (via watch()) inotify events all run as
+    callbacks on one loop, so nothing here needs a lock and there's no
+    thread per series. Call handle_file()/handle_dicom() from the loop's
+    thread; from other threads, go through loop.call_soon_threadsafe().
+
+    """
+
+    def __init__(self, timeout, loop=None):
+        """
+        Build a new AsyncDicomManager.
+        timeout: How long a series can go without a new dicom before it's
+        finished.
+        loop: The EventLoop to run on; we make one if you don't.
+        """
+        super(AsyncDicomManager, self).__init__(timeout)
+        if loop is None:
+            loop = EventLoop()
+        self.loop = loop
+
+    def watch(self, watch_manager, processor):
+        """
+        Process inotify events on our loop: when watch_manager's inotify fd
+        is readable, events go to processor (a pyinotify.ProcessEvent that
+        will probably call handle_file()).
+        """
+        from yadda.vendor import pyinotify
+        notifier = pyinotify.Notifier(watch_manager, processor)
+
+        def read_inotify():
+            notifier.read_events()
+            notifier.process_events()
+        self.loop.add_reader(watch_manager.get_fd(), read_inotify)
+        return notifier
+
+    def wait(self):
+        self.loop.run_until(lambda: self._stop)
+
+    def handle_dicom(self, dcm, *args, **kwargs):
+        if self._stop:
+            logger.warn("Trying to process while stopped!")
+            return
+        key = self.handler_key(dcm)
+        handler = self._series_handlers.get(key)
+        if handler is None:
+            logger.debug("Setting up handler for key: {0}".format(key))
+            handler = self._setup_handler(dcm, *args, **kwargs)
+            self._series_handlers.add(key, handler)
+        self._arrived(handler, dcm)
+        self._journal_seen(handler, args)
+        handler.handle_dicom(dcm, *args, **kwargs)
+
+    def remove_handler(self, handler):
+        logger.debug("Removing handler %s" % (handler.name))
+        self._record_finished(handler)
+        self._series_handlers.discard(handler.name, handler)
+
+    def wait_for_handlers(self):
+        """ Run the loop until every handler has finished. """
+        self.loop.run_until(lambda: not self._series_handlers)
+
+    def stop(self):
+        self._stop = True
+        for handler in self._series_handlers.close():
+            handler.terminate()
+        self._stopped.set()
+        self.loop.stop()
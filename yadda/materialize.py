@@ -0,0 +1,243 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Ways to make a file show up in another directory, cheapest first.
+
+shutil.copy() pulls every byte up through userspace (and copies permission
+bits we don't want). If the destination is on the same filesystem, a hard
+link is free; if not, the kernel can often copy without us touching the
+data. Each strategy here raises EnvironmentError when it can't work for a
+pair of paths, and a Materializer tries them in order, then sticks with
+the first one that works.
+
+Only errors that say a strategy can't work here (CAPABILITY_ERRNOS) rule
+it out for good. Anything else -- a missing file, a full disk, an I/O
+error -- might not happen with the next file, so that file alone moves on
+down the list.
+
+A file that's already at the destination is only replaced once there's a
+good copy to replace it with: strategies write to a temporary name beside
+it, which is renamed over it.
+"""
+
+import os
+import errno
+import fcntl
+import shutil
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+logger = logging.getLogger(__name__)
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+CHUNK_SIZE = 1 << 30
+
+# Errors that mean a strategy can't work between these directories at all
+CAPABILITY_ERRNOS = frozenset([
+    errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL,
+    errno.ENOTTY])
+# ... and, for hard links, ones that mean we can't link these files
+LINK_ERRNOS = frozenset([errno.EPERM, errno.EMLINK])
+
+_libc = None
+
+
+def _libc_function(name, restype, argtypes):
+    """
+    A libc function, or None if there isn't one. libc is loaded on first
+    use: finding it runs ldconfig, which is too slow to do on import.
+    """
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        except OSError:
+            _libc = False
+    fx = getattr(_libc, name, None) if _libc else None
+    if fx is not None:
+        fx.restype = restype
+        fx.argtypes = argtypes
+    return fx
+
+
+def _sendfile():
+    return _libc_function(
+        'sendfile', ctypes.c_ssize_t,
+        [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+
+
+def _copy_file_range():
+    return _libc_function(
+        'copy_file_range', ctypes.c_ssize_t,
+        [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+         ctypes.c_size_t, ctypes.c_uint])
+
+
+def _kernel_copy(src, dest, copy_chunk):
+    with open(src, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        with open(dest, 'wb') as outfile:
+            copied = 0
+            while copied < size:
+                n = copy_chunk(
+                    infile.fileno(), outfile.fileno(),
+                    min(CHUNK_SIZE, size - copied))
+                if n < 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, os.strerror(err))
+                if n == 0:
+                    break
+                copied += n
+    if copied < size:
+        # The source shrank, or the filesystem won't say why it stopped;
+        # either way dest isn't a copy
+        raise OSError(errno.EIO, "Copied {0} of {1} bytes of {2}".format(
+            copied, size, src))
+    return copied
+
+
+def link(src, dest):
+    """ Hard link: free, but only on the same filesystem. """
+    os.link(src, dest)
+
+
+def rename(src, dest):
+    """
+    Move the file. Free on the same filesystem, but the source is gone
+    afterwards, so it's never picked automatically.
+    """
+    if os.stat(src).st_dev != os.stat(os.path.dirname(dest) or '.').st_dev:
+        raise OSError(errno.EXDEV, "Won't move across filesystems")
+    os.rename(src, dest)
+
+
+def reflink(src, dest):
+    """ Copy-on-write clone (btrfs, xfs, ...). """
+    with open(src, 'rb') as infile:
+        with open(dest, 'wb') as outfile:
+            try:
+                fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            except IOError as e:
+                raise OSError(e.errno, e.strerror)
+
+
+def copy_file_range(src, dest):
+    """ In-kernel copy with copy_file_range(2). """
+    fx = _copy_file_range()
+    if fx is None:
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    _kernel_copy(
+        src, dest, lambda infd, outfd, n: fx(infd, None, outfd, None, n, 0))
+
+
+def sendfile(src, dest):
+    """ In-kernel copy with sendfile(2). """
+    fx = _sendfile()
+    if fx is None:
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    _kernel_copy(src, dest, lambda infd, outfd, n: fx(outfd, infd, None, n))
+
+
+def copy(src, dest):
+    """ Plain old copy of the data, without permission bits. """
+    shutil.copyfile(src, dest)
+
+
+STRATEGIES = {
+    'link': link,
+    'rename': rename,
+    'reflink': reflink,
+    'copy_file_range': copy_file_range,
+    'sendfile': sendfile,
+    'copy': copy,
+}
+
+AUTO = ('link', 'reflink', 'copy_file_range', 'sendfile', 'copy')
+
+
+class Materializer(object):
+    """
+    Puts files into one destination using the first strategy that works.
+
+    The strategy gets picked on the first file and reused after that, so
+    make one Materializer per destination (per series, say). If the chosen
+    strategy turns out not to work here, we move on down the list; see
+    the module docs. Thread-safe.
+    """
+
+    def __init__(self, strategies=AUTO):
+        if isinstance(strategies, basestring):
+            strategies = (strategies,)
+        unknown = [s for s in strategies if s not in STRATEGIES]
+        if unknown:
+            raise ValueError("Unknown strategies: {0}".format(unknown))
+        self._candidates = list(strategies)
+        self._lock = threading.Lock()
+        self.strategy = None
+
+    def materialize(self, src, dest):
+        """
+        Make dest a copy of src. If dest is a directory, put the file in it
+        under the same name. Returns dest's path.
+        """
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        target = dest
+        if os.path.lexists(dest):
+            target = '{0}.{1}.partial'.format(
+                dest, os.urandom(4).encode('hex'))
+        with self._lock:
+            candidates = list(self._candidates)
+        for index, name in enumerate(candidates):
+            try:
+                STRATEGIES[name](src, target)
+            except EnvironmentError as e:
+                # Unless someone else got there first, target is ours
+                if e.errno != errno.EEXIST:
+                    self._remove_partial(target)
+                if index == len(candidates) - 1:
+                    raise
+                if _cant_work(name, e):
+                    logger.debug("Can't {0} {1} -> {2} ({3}); trying {4}"
+                                 .format(name, src, dest, e,
+                                         candidates[index + 1]))
+                    self._rule_out(name)
+                else:
+                    logger.debug("{0} {1} -> {2} failed ({3}); trying {4} "
+                                 "for this file".format(
+                                     name, src, dest, e,
+                                     candidates[index + 1]))
+                continue
+            if target != dest:
+                os.rename(target, dest)
+            with self._lock:
+                if self.strategy != name:
+                    logger.debug("Materializing with {0}".format(name))
+                    self.strategy = name
+            return dest
+
+    def _rule_out(self, name):
+        # Threads that fail at once mustn't rule out a strategy each
+        with self._lock:
+            if name in self._candidates and len(self._candidates) > 1:
+                self._candidates.remove(name)
+
+    def _remove_partial(self, dest):
+        try:
+            os.remove(dest)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def _cant_work(name, error):
+    """ Does error mean strategy name can't work here at all? """
+    return error.errno in CAPABILITY_ERRNOS or \
+        (name == 'link' and error.errno in LINK_ERRNOS)
@@ -0,0 +1,181 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Shared execution machinery for pooled managers: a fixed-size pool of
+worker threads to run handler callbacks on, and a timer wheel to fire
+series-idle timeouts without a thread (or a Condition) per series.
+"""
+
+import threading
+import logging
+import time
+import math
+
+from yadda.scheduling import FairScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """
+    A fixed number of daemon threads running callables off a shared queue.
+
+    Tasks run in the order they were submitted, unless they're given
+    priorities and sources with submit_fair(); see yadda.scheduling.
+    With more than one worker, two tasks may run at the same time --
+    anything that needs ordering (like a series' dicoms) needs to
+    serialize itself.
+    """
+
+    def __init__(self, size, name='yadda-worker', scheduler=None):
+        if size < 1:
+            raise ValueError("A WorkerPool needs at least one worker")
+        self.size = size
+        self.name = name
+        if scheduler is None:
+            scheduler = FairScheduler()
+        self.scheduler = scheduler
+        self._workers = []
+
+    def start(self):
+        for i in range(self.size):
+            worker = threading.Thread(
+                target=self._work, name="{0}-{1}".format(self.name, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, fx, *args, **kwargs):
+        self.scheduler.put((fx, args, kwargs))
+
+    def submit_fair(self, priority, source, fx, *args, **kwargs):
+        """ submit(), with a priority and source for the scheduler. """
+        self.scheduler.put((fx, args, kwargs), priority, source)
+
+    def stop(self, wait=True):
+        """
+        Stop the workers once they've run everything submitted.
+        """
+        self.scheduler.close()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+
+    def _work(self):
+        while True:
+            task = self.scheduler.get()
+            if task is None:
+                return
+            fx, args, kwargs = task
+            try:
+                fx(*args, **kwargs)
+            except Exception:
+                logger.exception("%s: task %r failed" % (self.name, fx))
+
+
+class TimerWheel(object):
+    """
+    A hashed timing wheel: one thread, many timeouts.
+
+    Timers are keyed by any hashable object. schedule() files a timer into
+    the slot for its deadline; touch() just moves the deadline, and the
+    timer gets re-filed lazily when the wheel comes around to its old slot.
+    That keeps the per-dicom cost of pushing back a series' idle timeout to
+    a dict lookup.
+
+    Callbacks run on the wheel's thread, so they should be quick -- hand
+    real work off to a WorkerPool.
+    """
+
+    def __init__(self, tick=0.1, slots=256, name='yadda-timers'):
+        self.tick = tick
+        self.name = name
+        self._slots = [set() for i in range(slots)]
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._epoch = time.time()
+        self._ticks = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, key, delay, callback):
+        """ Call callback() once delay seconds have passed. """
+        deadline = time.time() + delay
+        with self._lock:
+            self._timers[key] = [deadline, callback]
+            self._file(key, deadline)
+
+    def touch(self, key, delay):
+        """
+        Push key's deadline back to delay seconds from now. Returns False
+        if there's no such timer (it's fired or been cancelled).
+        """
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                return False
+            timer[0] = time.time() + delay
+            return True
+
+    def cancel(self, key):
+        with self._lock:
+            return self._timers.pop(key, None) is not None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _tick_for(self, deadline):
+        return int(math.ceil((deadline - self._epoch) / self.tick))
+
+    def _file(self, key, deadline):
+        # Never file into a slot we've already passed this time around
+        tick = max(self._tick_for(deadline), self._ticks)
+        self._slots[tick % len(self._slots)].add(key)
+
+    def advance(self, now=None):
+        """
+        Fire every timer that's due as of now. The wheel's thread calls
+        this every tick; it's public so tests can drive the wheel by hand.
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            target = int((now - self._epoch) / self.tick)
+            while self._ticks <= target:
+                slot = self._slots[self._ticks % len(self._slots)]
+                for key in list(slot):
+                    slot.discard(key)
+                    timer = self._timers.get(key)
+                    if timer is None:
+                        continue
+                    if timer[0] <= now:
+                        del self._timers[key]
+                        due.append(timer[1])
+                    else:
+                        self._file(key, timer[0])
+                self._ticks += 1
+        for callback in due:
+            try:
+                callback()
+            except Exception:
+                logger.exception("%s: timer callback failed" % (self.name))
+
+    def _run(self):
+        while not self._stopping.wait(self.tick):
+            self.advance()
@@ -0,0 +1,84 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Readers get dicoms off the disk for managers.
+
+Most managers only need a couple of header values (study date, series
+number, and the like) to decide which handler a file belongs to. Reading
+the whole file -- pixel data and all -- just to get those is a waste, so
+read_routing_header() parses only as far as the last tag it's been asked
+for, and then stops.
+"""
+
+import logging
+
+from dicom.filereader import read_partial, read_file
+from dicom.datadict import tag_for_name
+from dicom.tag import Tag
+
+logger = logging.getLogger(__name__)
+
+FILE_META_GROUP = 0x0002
+
+
+class RoutingKeySpec(object):
+    """
+    The set of tags a manager needs to route a dicom to its handler.
+
+    keys can be DICOM keywords ('SeriesNumber') or anything Tag() accepts.
+    Reading stops at the first data element past the largest tag named
+    here; file meta (group 2) tags are always read, so they don't count.
+    """
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.tags = tuple(self._to_tag(key) for key in self.keys)
+        dataset_tags = [t for t in self.tags if t.group != FILE_META_GROUP]
+        self.max_tag = None
+        if dataset_tags:
+            self.max_tag = max(dataset_tags)
+
+    def _to_tag(self, key):
+        if isinstance(key, basestring):
+            tag = tag_for_name(key)
+            if tag is None:
+                raise ValueError("Unknown DICOM keyword: {0}".format(key))
+            return Tag(tag)
+        return Tag(key)
+
+    def stop_when(self, tag, VR, length):
+        """ A stop_when callback for dicom.filereader.read_partial. """
+        return self.max_tag is None or tag > self.max_tag
+
+    def __repr__(self):
+        return "RoutingKeySpec({0!r})".format(self.keys)
+
+
+def read_routing_header(filename, key_spec, force=False):
+    """
+    Read only the part of filename's header that key_spec needs.
+
+    key_spec is a RoutingKeySpec or a list of keys to build one from.
+    Returns a FileDataset that holds the file meta information and every
+    top-level element up to and including key_spec.max_tag. Raises
+    dicom.filereader.InvalidDicomError if filename doesn't look like a dicom.
+    """
+    if not isinstance(key_spec, RoutingKeySpec):
+        key_spec = RoutingKeySpec(key_spec)
+    with open(filename, 'rb') as fp:
+        return read_partial(fp, stop_when=key_spec.stop_when, force=force)
+
+
+def read_dicom(filename, key_spec=None, force=False, memory_map=False):
+    """
+    Read filename for routing: the header through key_spec if we have one,
+    otherwise the whole file. With memory_map, a whole-file read maps the
+    file instead of copying it, and OB/OW/OF/UN values (pixel data, mostly)
+    come back as memoryviews into it.
+    """
+    if key_spec is None:
+        return read_file(filename, force=force, memory_map=memory_map)
+    return read_routing_header(filename, key_spec, force=force)
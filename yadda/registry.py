@@ -0,0 +1,126 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+The map from series key to handler that managers keep.
+
+With many threads feeding a ThreadedDicomManager, one lock around that map
+is where they all queue up, and it's held while a new handler runs
+on_start(), which can take a while. SeriesRegistry doesn't lock lookups at
+all: a dict get is atomic under the GIL, and almost every file goes to a
+handler that already exists. Adding and removing handlers take one of
+`stripes` locks, picked by the key's hash, so a slow on_start() only holds
+up series that hash to the same stripe, and two threads can't both create
+a handler for one key.
+
+Handlers are removed with discard(key, handler), which only removes
+the entry if it's still that handler, so a finishing handler can't take its
+replacement with it. close() takes every stripe, so once it returns no new
+handler can be created, and what it returns is every handler there is.
+wait_until_empty() waits for the last handler to be discarded.
+"""
+
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SeriesRegistry(object):
+    """ Handlers by key; see the module docs. Thread-safe. """
+
+    def __init__(self, stripes=16):
+        self._handlers = {}
+        self._locks = [threading.Lock() for i in range(stripes)]
+        self._emptied = threading.Condition(threading.Lock())
+        self.closed = False
+
+    def _lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def get(self, key, default=None):
+        return self._handlers.get(key, default)
+
+    def __getitem__(self, key):
+        return self._handlers[key]
+
+    def __contains__(self, key):
+        return key in self._handlers
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def items(self):
+        """ A snapshot of (key, handler) pairs. """
+        return self._handlers.items()
+
+    def values(self):
+        """ A snapshot of the handlers. """
+        return self._handlers.values()
+
+    def get_or_create(self, key, create):
+        """
+        key's handler, calling create() to make one if there isn't one.
+        Returns (handler, created); handler is None if we're closed and
+        there wasn't one.
+        """
+        handler = self._handlers.get(key)
+        if handler is not None:
+            return handler, False
+        with self._lock_for(key):
+            handler = self._handlers.get(key)
+            if handler is not None:
+                return handler, False
+            if self.closed:
+                return None, False
+            handler = create()
+            self._handlers[key] = handler
+            return handler, True
+
+    def add(self, key, handler):
+        """ Make handler key's handler, if there isn't one. """
+        self.get_or_create(key, lambda: handler)
+
+    def discard(self, key, handler):
+        """ Remove key if handler is its handler; returns whether it was. """
+        with self._lock_for(key):
+            if self._handlers.get(key) is not handler:
+                return False
+            del self._handlers[key]
+        if not self._handlers:
+            with self._emptied:
+                self._emptied.notify_all()
+        return True
+
+    def wait_until_empty(self, timeout=None):
+        """
+        Block until there are no handlers, or for up to timeout seconds;
+        returns whether there are none.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._emptied:
+            while self._handlers:
+                if deadline is None:
+                    self._emptied.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._emptied.wait(remaining)
+            return True
+
+    def close(self):
+        """
+        Stop creating handlers, and return a snapshot of every handler.
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self.closed = True
+            return self._handlers.values()
+        finally:
+            for lock in self._locks:
+                lock.release()
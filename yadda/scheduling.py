@@ -0,0 +1,246 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Deciding which series' work a pooled manager's workers do next.
+
+By default a WorkerPool runs tasks in the order they come in, so a
+5,000-image DTI series with its hooks queued up ahead of a 30-image
+localizer makes the localizer wait behind it. A FairScheduler is the
+pool's queue instead, and picks tasks two ways:
+
+- By priority: a task with a lower priority number always goes before one
+  with a higher one. Since a pooled handler has at most one hook call
+  queued at a time, an URGENT series waits for at most one hook call per
+  worker, however much else is queued. Lower priorities can starve while
+  there's urgent work, so keep URGENT for small series.
+
+- Within a priority, by weighted fair queuing across sources: each source
+  gets a share of the workers in proportion to its weight, however many
+  tasks it has queued. We use self-clocked fair queuing (Golestani, 1994):
+  each task gets a finish tag of its source's last tag (or the current
+  virtual time, if that's later) plus 1 / weight, and the lowest tag
+  goes next.
+
+Priorities come from Priorities: rules matching header values, like
+"SeriesDescription *localizer* is URGENT".
+
+stats() says how long tasks waited in the queue, per priority and per
+source.
+"""
+
+import time
+import heapq
+import fnmatch
+import threading
+import logging
+from collections import deque
+
+from yadda.timeouts import P2Quantile
+
+logger = logging.getLogger(__name__)
+
+URGENT = 0
+NORMAL = 1
+BULK = 2
+
+
+class Priorities(object):
+    """
+    Assigns priorities from header values. rules is a sequence of
+    (priority, {keyword: pattern}) pairs; a dicom gets the priority of the
+    first rule whose patterns all match, or default if none do. Patterns
+    are shell-style (fnmatch) and ignore case; an empty pattern matches a
+    missing value. For example:
+
+        Priorities([
+            (URGENT, {'SeriesDescription': '*localizer*'}),
+            (BULK, {'Modality': 'MR', 'SeriesDescription': '*DTI*'}),
+        ])
+    """
+
+    def __init__(self, rules, default=NORMAL):
+        self.default = default
+        self.rules = [
+            (priority, [(keyword, pattern.lower())
+                        for keyword, pattern in patterns.items()])
+            for priority, patterns in rules]
+
+    @property
+    def keys(self):
+        """ The keywords rules look at, for a RoutingKeySpec. """
+        keys = []
+        for priority, patterns in self.rules:
+            for keyword, pattern in patterns:
+                if keyword not in keys:
+                    keys.append(keyword)
+        return tuple(keys)
+
+    def priority_for(self, dcm):
+        for priority, patterns in self.rules:
+            if all(fnmatch.fnmatchcase(
+                    str(dcm.get(keyword, '')).lower(), pattern)
+                    for keyword, pattern in patterns):
+                return priority
+        return self.default
+
+
+class WaitStats(object):
+    """ How long tasks have waited in a queue. """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sketch = P2Quantile(0.99)
+
+    def add(self, wait):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+        self.sketch.add(wait)
+
+    def stats(self):
+        return {
+            'tasks': self.count,
+            'mean_wait': self.total / self.count if self.count else None,
+            'p99_wait': self.sketch.value(),
+            'max_wait': self.max,
+        }
+
+
+class _Level(object):
+    """ The tasks of one priority, fair-queued by source. """
+
+    def __init__(self):
+        self.vtime = 0.0
+        # source -> deque of (finish tag, queued at, task)
+        self.queues = {}
+        # source -> finish tag of its last task
+        self.finish = {}
+        # (head finish tag, seq, source) for each source with tasks
+        self.heads = []
+        self.size = 0
+
+    def put(self, task, source, weight, now, seq):
+        start = max(self.vtime, self.finish.get(source, 0.0))
+        tag = start + 1.0 / weight
+        self.finish[source] = tag
+        queue = self.queues.get(source)
+        if queue is None:
+            queue = self.queues[source] = deque()
+        if not queue:
+            heapq.heappush(self.heads, (tag, seq, source))
+        queue.append((tag, now, task))
+        self.size += 1
+
+    def get(self, seq):
+        tag, _, source = heapq.heappop(self.heads)
+        queue = self.queues[source]
+        tag, queued_at, task = queue.popleft()
+        self.vtime = tag
+        self.size -= 1
+        if queue:
+            heapq.heappush(self.heads, (queue[0][0], seq, source))
+        else:
+            # Its tag is at most vtime now, so forgetting it loses nothing
+            del self.queues[source]
+            del self.finish[source]
+        return source, queued_at, task
+
+
+class FairScheduler(object):
+    """
+    A task queue with priorities, and weighted fair queuing across
+    sources within each priority; see the module docs. WorkerPools keep
+    their tasks in one.
+
+    weights maps sources to weights; other sources get 1. Wait statistics
+    are kept for up to max_sources sources. Thread-safe.
+    """
+
+    def __init__(self, weights=None, default_priority=NORMAL,
+                 max_sources=1000):
+        self.weights = dict(weights or {})
+        self.default_priority = default_priority
+        self.max_sources = max_sources
+        self.closed = False
+        self._levels = {}
+        self._priorities = []
+        self._seq = 0
+        self._size = 0
+        self._cond = threading.Condition()
+        self._waits = {}
+        self._source_waits = {}
+
+    def put(self, task, priority=None, source=None):
+        if priority is None:
+            priority = self.default_priority
+        weight = self.weights.get(source, 1)
+        with self._cond:
+            level = self._levels.get(priority)
+            if level is None:
+                level = self._levels[priority] = _Level()
+                self._priorities = sorted(self._levels)
+            self._seq += 1
+            level.put(task, source, weight, time.time(), self._seq)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        """
+        Wait for a task, and return the one that should run next; once
+        we're closed and empty, return None.
+        """
+        with self._cond:
+            while not self._size:
+                if self.closed:
+                    return None
+                self._cond.wait()
+            for priority in self._priorities:
+                level = self._levels[priority]
+                if level.size:
+                    break
+            self._seq += 1
+            source, queued_at, task = level.get(self._seq)
+            self._size -= 1
+            wait = time.time() - queued_at
+            self._wait_stats(self._waits, priority).add(wait)
+            if source not in self._source_waits and \
+                    len(self._source_waits) >= self.max_sources:
+                self._source_waits.clear()
+            self._wait_stats(self._source_waits, source).add(wait)
+            return task
+
+    def close(self):
+        """ Have get() return None once every task's been got. """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _wait_stats(self, by, key):
+        stats = by.get(key)
+        if stats is None:
+            stats = by[key] = WaitStats()
+        return stats
+
+    def qsize(self):
+        return self._size
+
+    def stats(self):
+        """
+        Queue waits per priority ('priorities') and per source
+        ('sources'), and how many tasks are waiting ('queued').
+        """
+        with self._cond:
+            return {
+                'queued': self._size,
+                'priorities': dict(
+                    (priority, stats.stats())
+                    for priority, stats in self._waits.items()),
+                'sources': dict(
+                    (source, stats.stats())
+                    for source, stats in self._source_waits.items()),
+            }
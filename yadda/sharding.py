@@ -0,0 +1,260 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Spreading a manager's work over processes, so it isn't all under one GIL.
+
+ShardedDicomManager runs a manager in each of N worker processes (shards).
+It takes file paths from the watcher and does nothing else with them:
+paths are spread over the shards by a hash of the path, and shards parse
+the headers. The shard that parsed a file works out its series'
+handler_key and passes the parsed header on to the shard that owns that
+key, found with shard_for(). shard_for() is a stable hash, so a series
+never spans processes, and it's the same on every run. Headers travel
+packed as in yadda.ingest, so they're parsed once.
+
+Files of a series are parsed in different shards, so they can reach their
+handler in a slightly different order than they showed up.
+
+The per-shard managers come from a factory called in each shard, so give
+each its own journal or dedup there if you want them. Shards run the
+manager's handle_dicom() from their own loop, so AsyncDicomManagers,
+whose work only happens on their event loop, can't be sharded.
+
+If a shard dies, whatever it held is lost: handle_file() and stop() raise
+ShardDiedError rather than wait on it.
+"""
+
+import zlib
+import signal
+import logging
+import multiprocessing
+from Queue import Empty
+
+from dicom.filereader import InvalidDicomError
+
+from yadda.ingest import _pack, _unpack
+from yadda.managers import AsyncDicomManager
+
+logger = logging.getLogger(__name__)
+
+# Messages to shards
+_FILE = 'file'
+_DICOM = 'dicom'
+_DRAIN = 'drain'
+_STOP = 'stop'
+
+
+class ShardDiedError(RuntimeError):
+    """ A shard process exited before it was told to stop. """
+    pass
+
+
+def shard_for(key, shards):
+    """ Which of shards shards handles series key. Stable across runs. """
+    return (zlib.crc32(str(key)) & 0xffffffff) % shards
+
+
+class ShardedDicomManager(object):
+    """
+    Hands files to managers in shards worker processes; see the module
+    docs. manager_factory() is called once in each shard to build its
+    manager: a ThreadedDicomManager or PooledDicomManager (or a subclass),
+    but not an AsyncDicomManager.
+
+    stop() checks on the shards every poll_interval seconds while it waits
+    for them.
+    """
+
+    poll_interval = 1.0
+
+    def __init__(self, manager_factory, shards=None):
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+        self.manager_factory = manager_factory
+        self.shards = shards
+        self.files = 0
+        self._inboxes = []
+        self._processes = []
+        self._replies = None
+
+    def start(self):
+        self._inboxes = [multiprocessing.Queue() for i in range(self.shards)]
+        self._replies = multiprocessing.Queue()
+        for index in range(self.shards):
+            process = multiprocessing.Process(
+                target=_run_shard, name='yadda-shard-{0}'.format(index),
+                args=(index, self.manager_factory, self._inboxes,
+                      self._replies))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def handle_file(self, filename):
+        # By path, so repeat events for a file meet the same dedup
+        index = shard_for(filename, self.shards)
+        self._check_shard(self._processes[index])
+        self.files += 1
+        self._inboxes[index].put((_FILE, filename))
+
+    def _check_shard(self, process):
+        if not process.is_alive():
+            raise ShardDiedError("{0} exited with code {1}".format(
+                process.name, process.exitcode))
+
+    def _check_shards(self):
+        for process in self._processes:
+            self._check_shard(process)
+
+    def stop(self):
+        """
+        Handle every file we've been given, finish every series, and shut
+        the shards down. Raises ShardDiedError, after killing the others,
+        if a shard dies first.
+        """
+        if not self._processes:
+            return
+        try:
+            self._stop()
+        except ShardDiedError as e:
+            logger.error("{0}; its files are lost".format(e))
+            for process in self._processes:
+                if process.is_alive():
+                    process.terminate()
+            raise
+        finally:
+            for process in self._processes:
+                process.join()
+            self._processes = []
+
+    def _stop(self):
+        # Once every shard has parsed everything sent to it, we know how
+        # many headers each should get from the others before it stops
+        for inbox in self._inboxes:
+            inbox.put((_DRAIN,))
+        expected = [0] * self.shards
+        replies = 0
+        while replies < self.shards:
+            try:
+                index, forwarded = self._replies.get(
+                    timeout=self.poll_interval)
+            except Empty:
+                self._check_shards()
+                continue
+            replies += 1
+            for owner, count in enumerate(forwarded):
+                expected[owner] += count
+        for inbox, count in zip(self._inboxes, expected):
+            inbox.put((_STOP, count))
+        running = list(self._processes)
+        while running:
+            running[0].join(self.poll_interval)
+            for process in list(running):
+                if process.is_alive():
+                    continue
+                running.remove(process)
+                if process.exitcode != 0:
+                    raise ShardDiedError(
+                        "{0} exited with code {1}".format(
+                            process.name, process.exitcode))
+
+    def wait(self):
+        for process in self._processes:
+            process.join()
+
+
+def _run_shard(index, manager_factory, inboxes, replies):
+    # The parent decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    manager = manager_factory()
+    if isinstance(manager, AsyncDicomManager):
+        raise TypeError("AsyncDicomManagers can't be sharded")
+    _Shard(index, manager, inboxes).run(replies)
+
+
+class _Shard(object):
+    """ The loop in each shard process. """
+
+    def __init__(self, index, manager, inboxes):
+        self.index = index
+        self.manager = manager
+        self.inboxes = inboxes
+        self.forwarded = [0] * len(inboxes)
+
+    def run(self, replies):
+        inbox = self.inboxes[self.index]
+        received = 0
+        expected = None
+        while expected is None or received < expected:
+            message = inbox.get()
+            kind = message[0]
+            if kind == _FILE:
+                self.route_file(message[1])
+            elif kind == _DICOM:
+                received += 1
+                self.handle(*message[1:])
+            elif kind == _DRAIN:
+                replies.put((self.index, self.forwarded))
+            elif kind == _STOP:
+                expected = message[1]
+        self.manager.wait_for_handlers()
+        self.manager.stop()
+
+    def route_file(self, filename):
+        """ Like ThreadedDicomManager.handle_file(), up to the hand-off. """
+        manager = self.manager
+        if manager.dedup is not None and \
+                not manager.dedup.file_is_new(filename):
+            return
+        try:
+            dcm = manager.read_dicom(filename)
+            owner = shard_for(manager.handler_key(dcm), len(self.inboxes))
+        except InvalidDicomError:
+            logger.warn('Not a dicom: {0}'.format(filename))
+            if manager.journal is not None:
+                manager.journal.file_ignored(filename)
+            self._forget(filename)
+            return
+        except Exception as exc:
+            logger.error('Error processing {0}: {1}'.format(filename, exc))
+            self._forget(filename)
+            return
+        if owner == self.index:
+            self.handle(filename, dcm=dcm)
+            return
+        self.forwarded[owner] += 1
+        packed = None
+        # Whole files can hold memoryviews, which don't pickle; the owner
+        # reads those again
+        if manager.routing_spec is not None:
+            packed = _pack(dcm)
+        self.inboxes[owner].put((_DICOM, filename, packed))
+
+    def _forget(self, filename, dcm=None):
+        # A file we couldn't hand off; if its path was routed here, this
+        # shard's dedup is the one that saw it
+        dedup = self.manager.dedup
+        if dedup is not None:
+            dedup.forget_file(filename)
+            if dcm is not None:
+                dedup.forget_dicom(dcm)
+
+    def handle(self, filename, packed=None, dcm=None):
+        manager = self.manager
+        marked = None
+        try:
+            if dcm is None:
+                if packed is None:
+                    dcm = manager.read_dicom(filename)
+                else:
+                    dcm = _unpack(filename, packed)
+            if manager.dedup is not None:
+                if not manager.dedup.dicom_is_new(dcm):
+                    return
+                marked = dcm
+            manager.handle_dicom(dcm, filename)
+        except Exception as exc:
+            logger.error('Error processing {0}: {1}'.format(filename, exc))
+            self._forget(filename, marked)
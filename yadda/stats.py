@@ -0,0 +1,88 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Counters for seeing where time goes in a series, from the moment a handler
+gets a dicom to the moment it's been delivered.
+"""
+
+import threading
+import time
+
+
+class SeriesStats(object):
+    """
+    Thread-safe counters for one series' deliveries.
+
+    queued counts files waiting to be sent, in_flight counts files being
+    sent right now. handoff_latency is measured from when the handler was
+    handed a file to when the transport finished with it; time spent
+    before that (waiting for the file to settle, parsing its header) isn't
+    in it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at = None
+        self.files = 0
+        self.bytes = 0
+        self.batches = 0
+        self.errors = 0
+        self.queued = 0
+        self.in_flight = 0
+        self.send_seconds = 0.0
+        self.handoff_latency_total = 0.0
+        self.handoff_latency_max = 0.0
+        self._lock = threading.Lock()
+
+    def file_queued(self):
+        with self._lock:
+            self.queued += 1
+
+    def batch_started(self, count):
+        with self._lock:
+            self.queued -= count
+            self.in_flight += count
+
+    def batch_done(self, received_times, byte_count, started, errors=0):
+        now = time.time()
+        with self._lock:
+            count = len(received_times)
+            self.in_flight -= count
+            self.batches += 1
+            self.errors += errors
+            self.files += count - errors
+            self.bytes += byte_count
+            self.send_seconds += now - started
+            for received_at in received_times:
+                latency = now - received_at
+                self.handoff_latency_total += latency
+                self.handoff_latency_max = max(
+                    self.handoff_latency_max, latency)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def snapshot(self):
+        """ The counters as a plain dict, plus a few derived numbers. """
+        with self._lock:
+            done = self.files + self.errors
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                'name': self.name,
+                'files': self.files,
+                'bytes': self.bytes,
+                'batches': self.batches,
+                'errors': self.errors,
+                'queued': self.queued,
+                'in_flight': self.in_flight,
+                'send_seconds': self.send_seconds,
+                'handoff_latency_mean':
+                    done and self.handoff_latency_total / done or 0.0,
+                'handoff_latency_max': self.handoff_latency_max,
+                'bytes_per_second': elapsed and self.bytes / elapsed or 0.0,
+                'finished': self.finished_at is not None,
+            }
@@ -0,0 +1,163 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Idle timeouts that fit the source.
+
+A CT scanner sends a series in one burst, a few milliseconds between
+files; an fMRI run sends a volume every TR for ten minutes. One fixed
+timeout is either too long for the first (every series waits it out
+before finishing) or too short for the second (a slow series gets split
+in two). AdaptiveTimeouts keeps streaming statistics of the gaps between
+files of a series, per source, and derives each source's timeout from
+them: margin times the larger of an EWMA of the gaps (for drift) and a
+high quantile of them (for the tail), kept between min_timeout and
+max_timeout. Until a source has min_samples gaps, it gets the default.
+
+The quantile comes from P2Quantile, the P-squared algorithm (Jain and
+Chlamtac, 1985): five markers, constant memory and time per sample.
+"""
+
+import bisect
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class P2Quantile(object):
+    """ A running estimate of the p-quantile of what's been add()ed. """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        # Marker heights and positions, and where the positions should be
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2.0, p, (1 + p) / 2.0, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self._heights
+        if self.count <= 5:
+            bisect.insort(q, x)
+            return
+        n = self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x > q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = min(bisect.bisect_right(q, x) - 1, 3)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+                    (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / float(
+                        n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self._heights, self._positions
+        above = (q[i + 1] - q[i]) / float(n[i + 1] - n[i])
+        below = (q[i] - q[i - 1]) / float(n[i] - n[i - 1])
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * above + (n[i + 1] - n[i] - d) * below)
+
+    def value(self):
+        """ The estimate, or None if nothing's been added. """
+        if not self.count:
+            return None
+        if self.count <= 5:
+            return self._heights[int(round(self.p * (self.count - 1)))]
+        return self._heights[2]
+
+
+class ArrivalStats(object):
+    """ EWMA and a quantile sketch of one source's inter-arrival gaps. """
+
+    def __init__(self, quantile=0.99, alpha=0.2):
+        self.alpha = alpha
+        self.count = 0
+        self.ewma = None
+        self.sketch = P2Quantile(quantile)
+
+    def add(self, gap):
+        self.count += 1
+        if self.ewma is None:
+            self.ewma = gap
+        else:
+            self.ewma += self.alpha * (gap - self.ewma)
+        self.sketch.add(gap)
+
+    def estimate(self):
+        """ The gap a timeout should allow for, before the margin. """
+        return max(self.ewma, self.sketch.value())
+
+
+class AdaptiveTimeouts(object):
+    """
+    Per-source idle timeouts, learned from gaps between files; see the
+    module docs. Sources are any hashable; managers use a tuple of header
+    values (see ThreadedDicomManager.source_keys). Thread-safe.
+    """
+
+    def __init__(self, default, min_timeout=1.0, max_timeout=300.0,
+                 quantile=0.99, margin=3.0, alpha=0.2, min_samples=10,
+                 max_sources=1000):
+        self.default = default
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.quantile = quantile
+        self.margin = margin
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_sources = max_sources
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def observe(self, source, gap):
+        """ Record gap seconds between two files of a series from source. """
+        with self._lock:
+            stats = self._sources.get(source)
+            if stats is None:
+                if len(self._sources) >= self.max_sources:
+                    self._sources.clear()
+                stats = ArrivalStats(self.quantile, self.alpha)
+                self._sources[source] = stats
+            stats.add(gap)
+
+    def timeout_for(self, source):
+        with self._lock:
+            stats = self._sources.get(source)
+            if stats is None or stats.count < self.min_samples:
+                return self.default
+            timeout = self.margin * stats.estimate()
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def stats(self):
+        """ Each source's gap statistics and timeout, keyed by source. """
+        with self._lock:
+            sources = list(self._sources.items())
+        result = {}
+        for source, stats in sources:
+            result[source] = {
+                'gaps': stats.count,
+                'ewma': stats.ewma,
+                'quantile': stats.sketch.value(),
+                'timeout': self.timeout_for(source),
+            }
+        return result
@@ -0,0 +1,267 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Transports get a series' files to wherever they're going; a Delivery
+feeds them.
+
+A Transport knows three things: how to get ready for a series
+(open_series), how to send it some files (send_batch), and how to wrap it
+up (close_series, or fail_series if any files didn't make it). A
+Delivery sits in front of a transport: it gathers files that show up close
+together into batches, keeps a few batches in flight per series on a
+worker pool, and counts everything in a SeriesStats so you can see which
+hop is slow.
+"""
+
+import os
+import time
+import threading
+import itertools
+import logging
+from collections import deque
+
+from yadda.pool import WorkerPool, TimerWheel
+from yadda.stats import SeriesStats
+from yadda.materialize import Materializer, AUTO
+
+logger = logging.getLogger(__name__)
+
+_failures = itertools.count(1)
+
+
+def failed_name(name):
+    """
+    Where fail_series() puts series name: hidden, and different every
+    time, so failing a series again doesn't collide with the last failure.
+    """
+    return '.{0}.failed-{1}-{2}'.format(
+        name, time.strftime('%Y%m%d-%H%M%S'), next(_failures))
+
+
+class Transport(object):
+    """
+    Superclass for transports. send_batch() may be called from several
+    threads at once, even for the same series.
+    """
+
+    def open_series(self, name):
+        pass
+
+    def send_batch(self, name, filenames):
+        """
+        Send filenames for series name. Returns the number of bytes sent.
+        """
+        return sum(self.send(name, filename) for filename in filenames)
+
+    def send(self, name, filename):
+        """ Send one file. You must override this or send_batch(). """
+        raise NotImplementedError()
+
+    def close_series(self, name):
+        pass
+
+    def fail_series(self, name):
+        """
+        Wrap up a series some files failed to send, instead of
+        close_series(). It mustn't look like a complete series.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalCopyTransport(Transport):
+    """
+    Copies each series into dest_dir/.name, then renames it to
+    dest_dir/name when the series is done. Files get there with the
+    cheapest of `strategies` that works (see yadda.materialize), picked
+    once per series.
+    """
+
+    def __init__(self, dest_dir, strategies=AUTO):
+        self.dest_dir = dest_dir
+        self.strategies = strategies
+        self._materializers = {}
+        self._lock = threading.Lock()
+
+    def temp_dir(self, name):
+        return os.path.join(self.dest_dir, '.' + name)
+
+    def open_series(self, name):
+        temp_dir = self.temp_dir(name)
+        if os.path.isdir(temp_dir):
+            logger.warn('{0} already exists'.format(temp_dir))
+        else:
+            os.makedirs(temp_dir)
+        with self._lock:
+            self._materializers[name] = Materializer(self.strategies)
+
+    def send(self, name, filename):
+        with self._lock:
+            materializer = self._materializers[name]
+        materializer.materialize(filename, self.temp_dir(name))
+        return os.path.getsize(filename)
+
+    def close_series(self, name):
+        with self._lock:
+            self._materializers.pop(name, None)
+        os.rename(self.temp_dir(name), os.path.join(self.dest_dir, name))
+
+    def fail_series(self, name):
+        # Out of the way, so a retry starts from an empty directory
+        with self._lock:
+            self._materializers.pop(name, None)
+        os.rename(self.temp_dir(name),
+                  os.path.join(self.dest_dir, failed_name(name)))
+
+
+class FTPTransport(Transport):
+    """
+    Uploads each series into a hidden '.name' directory through an
+    FTPConnectionPool, then renames it to 'name'. A batch goes up over a
+    single session.
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+
+    def open_series(self, name):
+        self.connections.makedir('.' + name)
+
+    def send_batch(self, name, filenames):
+        self.connections.store_all(filenames, '.' + name)
+        return sum(os.path.getsize(filename) for filename in filenames)
+
+    def close_series(self, name):
+        self.connections.rename('.' + name, name)
+
+    def fail_series(self, name):
+        self.connections.rename('.' + name, failed_name(name))
+
+    def close(self):
+        self.connections.close()
+
+
+class Delivery(object):
+    """
+    Batches and pipelines files from handlers into a transport.
+
+    Files for a series go out in batches of up to batch_size; a batch that
+    isn't full is sent batch_window seconds after its first file showed up.
+    Up to `pipeline` batches per series are sent at once, on `workers`
+    threads shared by every series.
+    """
+
+    def __init__(
+            self, transport, workers=4, batch_size=16, batch_window=0.05,
+            pipeline=2, history=100):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.pipeline = pipeline
+        self.pool = WorkerPool(workers, name='yadda-delivery')
+        self.timers = TimerWheel(min(batch_window, 0.1) or 0.01)
+        self.finished = deque(maxlen=history)
+        self.pool.start()
+        self.timers.start()
+
+    def open(self, name):
+        """ Start a series; returns the SeriesDelivery to add() files to. """
+        series = SeriesDelivery(self, name)
+        self.transport.open_series(name)
+        return series
+
+    def stop(self):
+        self.timers.stop()
+        self.pool.stop()
+        self.transport.close()
+
+
+class SeriesDelivery(object):
+
+    def __init__(self, delivery, name):
+        self.delivery = delivery
+        self.name = name
+        self.stats = SeriesStats(name)
+        self._batch = []
+        self._ready = deque()
+        self._in_flight = 0
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def add(self, filename, received_at=None):
+        if received_at is None:
+            received_at = time.time()
+        self.stats.file_queued()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(
+                    "{0}: add() after close()".format(self.name))
+            self._batch.append((filename, received_at))
+            if len(self._batch) >= self.delivery.batch_size:
+                self.delivery.timers.cancel(self)
+                self._end_batch()
+            elif len(self._batch) == 1:
+                self.delivery.timers.schedule(
+                    self, self.delivery.batch_window, self.flush)
+
+    def flush(self):
+        """ Send whatever's in the current batch now. """
+        with self._lock:
+            self.delivery.timers.cancel(self)
+            self._end_batch()
+
+    def close(self):
+        """
+        Send anything left, wait for everything to arrive, and close the
+        series on the transport -- or, if any files failed, fail it.
+        """
+        with self._lock:
+            self._closed = True
+            self.delivery.timers.cancel(self)
+            self._end_batch()
+            while self._ready or self._in_flight:
+                self._lock.wait(1)
+        if self.stats.errors:
+            logger.error('{0}: {1} files failed; not publishing it'.format(
+                self.name, self.stats.errors))
+            self.delivery.transport.fail_series(self.name)
+        else:
+            self.delivery.transport.close_series(self.name)
+        self.stats.finish()
+        self.delivery.finished.append(self.stats)
+
+    def _end_batch(self):
+        # Call with self._lock held
+        if self._batch:
+            self._ready.append(self._batch)
+            self._batch = []
+        while self._ready and self._in_flight < self.delivery.pipeline:
+            batch = self._ready.popleft()
+            self._in_flight += 1
+            self.stats.batch_started(len(batch))
+            self.delivery.pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        filenames = [filename for filename, received_at in batch]
+        started = time.time()
+        byte_count = 0
+        errors = 0
+        try:
+            byte_count = self.delivery.transport.send_batch(
+                self.name, filenames)
+        except Exception as e:
+            logger.error('{0}: Failed to send {1} files: {2}'.format(
+                self.name, len(filenames), e))
+            errors = len(filenames)
+        self.stats.batch_done(
+            [received_at for filename, received_at in batch],
+            byte_count, started, errors)
+        with self._lock:
+            self._in_flight -= 1
+            self._end_batch()
+            self._lock.notify_all()
@@ -0,0 +1,304 @@
+# coding: utf8
+# Part of yadda -- a simple dicom file uploader
+#
+# Copyright 2014 Board of Regents of the University of Wisconsin System
+
+"""
+Turning inotify events into "this file is ready".
+
+A file being written makes a stream of events: IN_CREATE when it shows up
+(usually still empty), an IN_MODIFY for every write, and IN_CLOSE_WRITE
+when the writer's done. Reading it on the first of these gets a truncated
+header at best. FileWatcher collects the events for each path and calls
+back once per file, when it's complete: on IN_CLOSE_WRITE or IN_MOVED_TO,
+or -- for writers that never close it, or files that show up by hard link
+-- once settle seconds go by without another event for it.
+
+Use it as the processor for a pyinotify notifier, and add directories
+with its watch():
+
+    watcher = FileWatcher(callback=manager.handle_file)
+    notifier = pyinotify.ThreadedNotifier(watch_manager, watcher)
+    watcher.watch(watch_manager, source_dir)
+
+When a burst of files outruns the kernel's event queue (see
+/proc/sys/fs/inotify/max_queued_events), inotify drops events and sends
+IN_Q_OVERFLOW. FileWatcher then rescans the directories it watches, on a
+thread of its own. To keep that from rereading everything, it keeps a
+high-water mark per directory: the newest ctime of any file it's called
+back for there. A rescan only looks at files changed since -- ctime, not
+mtime, since cp -p and rsync set mtimes but can't set ctimes. The marks
+it goes by are the ones from when the overflow came in: files handled
+after that can be newer than the ones whose events were dropped. It also
+watches directories that were created while events were being dropped.
+
+The callback runs on the notifier's thread, or for settled files on one
+of the watcher's settle_workers threads -- not its timer thread, so a
+slow callback can't hold up other files' settle timers. The callback has
+to be thread-safe; with an AsyncDicomManager, have it go through
+loop.call_soon_threadsafe().
+"""
+
+import os
+import time
+import threading
+import logging
+
+from yadda.vendor import pyinotify
+from yadda.pool import TimerWheel, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+WATCH_MASK = (
+    pyinotify.IN_CREATE |
+    pyinotify.IN_MODIFY |
+    pyinotify.IN_CLOSE_WRITE |
+    pyinotify.IN_MOVED_TO |
+    pyinotify.IN_MOVED_FROM |
+    pyinotify.IN_DELETE)
+
+
+class FileWatcher(pyinotify.ProcessEvent):
+    """
+    A pyinotify processor that calls callback(path) once for each file
+    that's finished being written. See the module docs.
+
+    Counters: events is every event we've been handed, files the number
+    of callbacks, and settled how many of those came from the settle
+    timer rather than a close or a move. overflows counts IN_Q_OVERFLOWs,
+    rescans the rescans they set off, and rescanned the files those
+    turned up.
+    """
+
+    def my_init(self, callback, settle=2.0, tick=0.1, settle_workers=2):
+        self.callback = callback
+        self.settle = settle
+        self.events = 0
+        self.files = 0
+        self.settled = 0
+        self.errors = 0
+        self.overflows = 0
+        self.rescans = 0
+        self.rescanned = 0
+        self.rescan_seconds = 0.0
+        self.roots = []
+        self.watch_manager = None
+        # Paths we've seen written to but not closed, each with a timer
+        self._writing = set()
+        # directory -> [newest ctime we've handled, names with that ctime]
+        self._marks = {}
+        # Files older than this were there before we started watching
+        self._baseline = None
+        self._rescan_wanted = False
+        self._rescanning = False
+        # _marks as they were at the first overflow the next rescan's for
+        self._rescan_marks = None
+        self._lock = threading.Lock()
+        self.timers = TimerWheel(tick, name='yadda-settle')
+        self.timers.start()
+        # Settled files are called back here
+        self.settled_pool = WorkerPool(settle_workers, name='yadda-settled')
+        self.settled_pool.start()
+
+    def watch(self, watch_manager, path):
+        """ Watch path and everything under it with watch_manager. """
+        if self._baseline is None:
+            self._baseline = time.time()
+        self.watch_manager = watch_manager
+        # The way pyinotify has it, so event paths match what we walk
+        self.roots.append(os.path.normpath(path))
+        watch_manager.add_watch(path, WATCH_MASK, rec=True, auto_add=True)
+
+    def process_IN_CREATE(self, event):
+        self.events += 1
+        if not event.dir:
+            self._written(event.pathname)
+
+    process_IN_MODIFY = process_IN_CREATE
+
+    def process_IN_CLOSE_WRITE(self, event):
+        self.events += 1
+        if not event.dir:
+            self._complete(event.pathname)
+
+    process_IN_MOVED_TO = process_IN_CLOSE_WRITE
+
+    def process_IN_MOVED_FROM(self, event):
+        self.events += 1
+        self._forget(event.pathname)
+
+    process_IN_DELETE = process_IN_MOVED_FROM
+
+    def process_IN_Q_OVERFLOW(self, event):
+        self.events += 1
+        self.overflows += 1
+        logger.warn("inotify dropped events; rescanning {0}".format(
+            ', '.join(self.roots)))
+        with self._lock:
+            # Events after this one can raise marks past files whose events
+            # were dropped, so the rescan goes by the marks as they are now
+            if self._rescan_marks is None:
+                self._rescan_marks = self._snapshot_marks()
+            self._rescan_wanted = True
+            if self._rescanning:
+                return
+            self._rescanning = True
+        # Not on the notifier's thread: it needs to get back to reading
+        # events before the queue overflows again
+        thread = threading.Thread(
+            target=self._rescan_loop, name='yadda-rescan')
+        thread.daemon = True
+        thread.start()
+
+    def process_default(self, event):
+        self.events += 1
+
+    def _rescan_loop(self):
+        # Overflows during a rescan get one more rescan, not one each
+        while True:
+            with self._lock:
+                if not self._rescan_wanted:
+                    self._rescanning = False
+                    return
+                self._rescan_wanted = False
+                marks, self._rescan_marks = self._rescan_marks, None
+            try:
+                self.rescan(marks)
+            except Exception:
+                logger.exception("Rescan failed")
+
+    def _snapshot_marks(self):
+        # Call with self._lock held
+        return dict((dirpath, (mark[0], frozenset(mark[1])))
+                    for dirpath, mark in self._marks.items())
+
+    def rescan(self, marks=None):
+        """
+        Find files under our roots that changed since we last handled
+        anything in their directory, and handle them. Returns how many
+        there were.
+
+        marks are the per-directory marks to go by; the default is the
+        current ones. Files we've handled since they were taken are
+        skipped if they're the newest in their directory, but others may
+        be handled twice.
+        """
+        started = time.time()
+        if marks is None:
+            with self._lock:
+                marks = self._snapshot_marks()
+        watched = set()
+        if self.watch_manager is not None:
+            watched = set(w.path for w in self.watch_manager.watches.values())
+        found = 0
+        for root in list(self.roots):
+            for dirpath, dirnames, filenames in os.walk(root):
+                if self.watch_manager is not None and dirpath not in watched:
+                    logger.debug("Watching {0}, missed while we were "
+                                 "dropping events".format(dirpath))
+                    self.watch_manager.add_watch(
+                        dirpath, WATCH_MASK, auto_add=True)
+                mark_time, mark_names = marks.get(
+                    dirpath, (self._baseline or 0, ()))
+                with self._lock:
+                    current_time, current_names = self._marks.get(
+                        dirpath, (None, ()))
+                    current_names = frozenset(current_names)
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        ctime = os.stat(path).st_ctime
+                    except OSError:
+                        continue
+                    if ctime < mark_time or \
+                            (ctime == mark_time and name in mark_names):
+                        continue
+                    if ctime == current_time and name in current_names:
+                        continue
+                    found += 1
+                    if started - ctime < self.settle:
+                        # Might still be being written
+                        self._written(path)
+                    else:
+                        self._complete(path)
+        self.rescans += 1
+        self.rescanned += found
+        self.rescan_seconds += time.time() - started
+        logger.info("Rescan found {0} files in {1:.1f}s".format(
+            found, time.time() - started))
+        return found
+
+    def _written(self, path):
+        with self._lock:
+            if path in self._writing and \
+                    self.timers.touch(path, self.settle):
+                return
+            self._writing.add(path)
+            self.timers.schedule(
+                path, self.settle, lambda: self._settled(path))
+
+    def _complete(self, path):
+        self._forget(path)
+        self._dispatch(path)
+
+    def _forget(self, path):
+        with self._lock:
+            if path in self._writing:
+                self._writing.discard(path)
+                self.timers.cancel(path)
+
+    def _settled(self, path):
+        with self._lock:
+            if path not in self._writing:
+                return
+            self._writing.discard(path)
+            self.settled += 1
+        logger.debug("{0}: no events for {1}s; taking it as done".format(
+            path, self.settle))
+        # We're on the timer thread, which has other timers to fire
+        self.settled_pool.submit(self._dispatch, path)
+
+    def _mark(self, path):
+        try:
+            ctime = os.stat(path).st_ctime
+        except OSError:
+            return
+        dirpath, name = os.path.split(path)
+        with self._lock:
+            mark = self._marks.get(dirpath)
+            if mark is None or ctime > mark[0]:
+                self._marks[dirpath] = [ctime, set([name])]
+            elif ctime == mark[0]:
+                mark[1].add(name)
+
+    def _dispatch(self, path):
+        self.files += 1
+        if self.roots:
+            self._mark(path)
+        try:
+            self.callback(path)
+        except Exception as exc:
+            self.errors += 1
+            logger.error('Error processing {0}: {1}'.format(path, exc))
+
+    @property
+    def pending(self):
+        """ The number of files still being written. """
+        return len(self._writing)
+
+    def stats(self):
+        return {
+            'events': self.events,
+            'files': self.files,
+            'settled': self.settled,
+            'errors': self.errors,
+            'pending': self.pending,
+            'overflows': self.overflows,
+            'rescans': self.rescans,
+            'rescanned': self.rescanned,
+            'rescan_seconds': self.rescan_seconds,
+        }
+
+    def stop(self):
+        self.timers.stop()
+        self.settled_pool.stop()